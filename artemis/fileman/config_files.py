@@ -1,10 +1,31 @@
 from ConfigParser import NoSectionError, NoOptionError, ConfigParser
+import atexit
 import os
 import sys
+import tempfile
+import threading
+import time
 
 __author__ = 'peter'
 
 
+# Parsed config files are cached, and only re-read when the file's modification time or size changes.  To keep lookups
+# cheap, we check the file at most once every CONFIG_CHECK_INTERVAL seconds.
+CONFIG_CHECK_INTERVAL = 1.
+
+_CONFIG_CACHE = {}  # config_path -> _CachedConfig
+_CONFIG_LOCK = threading.RLock()
+
+
+class _CachedConfig(object):
+
+    def __init__(self):
+        self.parser = None  # ConfigParser, or None if the file does not exist
+        self.signature = None  # (mtime, size) of the file when it was parsed
+        self.last_checked = -float('inf')
+        self.pending_defaults = []  # (section, option, value) defaults to be written to the file
+
+
 def get_config_value(config_filename, section, option, default_generator = None, write_default = False, read_method=None):
     """
     Get a setting from a configuration file.  If none exists, you can optionally create one.  An example config file is
@@ -33,44 +54,120 @@ def get_config_value(config_filename, section, option, default_generator = None,
     :return: The value of the property of interest.
     """
     config_path = get_config_path(config_filename)
-    default_used = False
 
     if write_default:
         assert default_generator is not None, "If you set write_default true, you must provide a function that can generate the default."
 
-    if not os.path.exists(config_path):
-        assert default_generator is not None, 'No config file "%s" exists, and you do not have any default value.' % (config_path, )
-        value = default_generator()
-        default_used = True
-
-    else:
-        config = ConfigParser()
-        config.read(config_path)
-        try:
-            value = config.get(section, option)
-        except (NoSectionError, NoOptionError) as err:
-            if default_generator is None:
-                raise
-            else:
-                value = default_generator()
-                default_used = True
-
-    if default_used and write_default:
-        config = ConfigParser()
-        config.read(config_path)
-        if not config.has_section(section):
-            config.add_section(section)
-        config.set(section, option, value)
-        with open(config_path, 'w') as f:
-            config.write(f)
+    with _CONFIG_LOCK:
+        config = _get_cached_config(config_path)
+        if config is None:
+            assert default_generator is not None, 'No config file "%s" exists, and you do not have any default value.' % (config_path, )
+            value = default_generator()
+            default_used = True
+        else:
+            try:
+                value = config.get(section, option)
+                default_used = False
+            except (NoSectionError, NoOptionError) as err:
+                if default_generator is None:
+                    raise
+                else:
+                    value = default_generator()
+                    default_used = True
+
+        if default_used and write_default:
+            _add_default(config_path, section, option, value)
 
     if read_method == 'eval':
-        value = eval(value)
+        value = eval(value) if isinstance(value, basestring) else value
     elif callable(read_method):
         value = read_method(value)
     return value
 
 
+def flush_config_defaults():
+    """
+    Write any defaults that were generated by get_config_value(..., write_default=True) to their config files.  Defaults
+    are written in one batch (when the program exits, or when you call this), rather than rewriting the file each time.
+    """
+    with _CONFIG_LOCK:
+        for config_path, cached in _CONFIG_CACHE.items():
+            if not cached.pending_defaults:
+                continue
+            config = ConfigParser()
+            config.read(config_path)  # Re-read, in case someone else has changed the file in the meantime
+            for section, option, value in cached.pending_defaults:
+                if not config.has_section(section):
+                    config.add_section(section)
+                if not config.has_option(section, option):
+                    config.set(section, option, value)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(config_path), suffix='.part')
+            with os.fdopen(fd, 'w') as f:
+                config.write(f)
+            os.chmod(temp_path, os.stat(config_path).st_mode & 0o777 if os.path.exists(config_path) else 0o644)  # mkstemp makes files only we can read
+            os.rename(temp_path, config_path)
+            cached.pending_defaults = []
+            cached.last_checked = -float('inf')
+
+
+atexit.register(flush_config_defaults)
+
+
+def clear_config_cache():
+    """
+    Write any pending defaults, and forget all parsed config files, so that they are re-read on the next lookup.
+    """
+    with _CONFIG_LOCK:
+        flush_config_defaults()
+        _CONFIG_CACHE.clear()
+
+
+def _get_cached_config(config_path):
+    """
+    :return: A ConfigParser containing the contents of the file (with any defaults that have not yet been written), or
+        None if the file does not exist and no defaults have been added.
+    """
+    cached = _CONFIG_CACHE.get(config_path)
+    if cached is None:
+        cached = _CONFIG_CACHE[config_path] = _CachedConfig()
+    now = time.time()
+    if now - cached.last_checked >= CONFIG_CHECK_INTERVAL:
+        cached.last_checked = now
+        try:
+            stat = os.stat(config_path)
+            signature = (stat.st_mtime, stat.st_size)
+        except OSError:
+            signature = None
+        if signature != cached.signature:
+            cached.signature = signature
+            if signature is None:
+                cached.parser = None
+            else:
+                cached.parser = ConfigParser()
+                cached.parser.read(config_path)
+            if cached.pending_defaults:
+                if cached.parser is None:
+                    cached.parser = ConfigParser()
+                for section, option, value in cached.pending_defaults:
+                    _set_if_missing(cached.parser, section, option, value)
+    return cached.parser
+
+
+def _add_default(config_path, section, option, value):
+    cached = _CONFIG_CACHE[config_path]
+    if cached.parser is None:
+        cached.parser = ConfigParser()
+    _set_if_missing(cached.parser, section, option, value)
+    cached.pending_defaults.append((section, option, value))
+
+
+def _set_if_missing(config, section, option, value):
+    if not config.has_section(section):
+        config.add_section(section)
+    if not config.has_option(section, option):
+        config.set(section, option, value)
+
+
 def get_artemis_config_value(section, option, default_generator = None, write_default = False, read_method=None):
     """
     Get a setting from the artemis configuration.
@@ -1,6 +1,17 @@
+import atexit
+import inspect
 import logging
+import multiprocessing
 import os
+import pickle
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import partial
+from multiprocessing.pool import ThreadPool
 from artemis.fileman.local_dir import get_local_path, make_file_dir
 from artemis.general.functional import infer_arg_values
 from artemis.general.hashing import compute_fixed_hash
@@ -16,9 +27,10 @@ __author__ = 'peter'
 MEMO_WRITE_ENABLED = True
 MEMO_READ_ENABLED = True
 MEMO_DIR = get_local_path('memoize_to_disk')
+MEMO_STATS_PATH = get_local_path('memoize_to_disk_stats.pkl')
 
 
-def memoize_to_disk(fcn, local_cache = False, disable_on_tests=True, use_cpickle = False):
+def memoize_to_disk(fcn, local_cache = False, disable_on_tests=True, use_cpickle = False, include_code = False, dependencies = ()):
     """
     Save (memoize) computed results to disk, so that the same function, called with the
     same arguments, does not need to be recomputed.  This is useful if you have a long-running
@@ -47,6 +59,14 @@ def memoize_to_disk(fcn, local_cache = False, disable_on_tests=True, use_cpickle
         True.  Generally, leave this as true, unless you are testing memoization itself.
     :param use_cpickle: Use CPickle, instead of pickle, to save results.  This can be faster for complex python
         structures, but can be slower for numpy arrays.  So we recommend not using it.
+    :param include_code: Include the identity and code of the function in the memo key, so that functions with the same
+        name in different modules do not share memos, and editing the function invalidates its old memos.
+        False: Key only on the function name (default, and compatible with old memos).
+        True or 'source': Key on the module, qualified name and source code of the function and its dependencies.
+        'bytecode': Key on the module, qualified name and bytecode (so edits to comments/formatting do not invalidate
+            memos)
+    :param dependencies: Only used if include_code is set.  A list of other functions/classes/modules whose code the
+        result depends on.  Changing the code of any of these will also invalidate the memos.
     :return: A wrapper around the function that checks for memos and loads old results if they exist.
     """
 
@@ -56,15 +76,55 @@ def memoize_to_disk(fcn, local_cache = False, disable_on_tests=True, use_cpickle
         import pickle
 
     cached_local_results = {}
+    code_hash = []  # Computed lazily, on first call.
+    stats = get_memo_stats(fcn)
+
+    def get_filepath(args, kwargs):
+        full_args = infer_arg_values(fcn, *args, **kwargs)
+        if include_code and len(code_hash)==0:
+            code_hash.append(compute_function_code_hash(fcn, dependencies=dependencies, use_source = include_code!='bytecode'))
+        return get_function_hash_filename(fcn, full_args, code_hash = code_hash[0] if include_code else None)
+
+    def load_memo(filepath):
+        """ Return (success, result), where success is False if the memo is corrupt or refers to an old class. """
+        start_time = time.time()
+        with open(filepath) as f:
+            try:
+                LOGGER.info('Reading memo for function %s' % (fcn.__name__, ))
+                result = pickle.load(f)
+                stats.record(disk_hits=1, bytes_read=f.tell(), load_time=time.time()-start_time)
+                return True, result
+            except (ValueError, ImportError, EOFError, pickle.UnpicklingError) as err:
+                if not isinstance(err, ImportError):
+                    LOGGER.warn('Memo-file "%s" was corrupt.  (%s: %s).  Recomputing.' % (filepath, err.__class__.__name__, str(err)))
+                elif isinstance(err, ImportError):
+                    LOGGER.warn('Memo-file "{}" was tried to reference an old class and got ImportError: {}.  Recomputing.'.format(filepath, str(err)))
+                stats.record(corrupt_recomputes=1)
+                return False, None
+
+    def compute(args, kwargs):
+        start_time = time.time()
+        result = fcn(*args, **kwargs)
+        stats.record(misses=1, compute_time=time.time()-start_time)
+        return result
+
+    def save_memo(filepath, result, result_computed):
+        if MEMO_WRITE_ENABLED and result is not None:  # We assume result of None means you haven't done coding your function.
+            if local_cache:
+                cached_local_results[filepath] = result
+            if result_computed:  # Result was computed, so write it down
+                make_file_dir(filepath)
+                with open(filepath, 'w') as f:
+                    LOGGER.info('Writing disk-memo for function %s' % (fcn.__name__, ))
+                    pickle.dump(result, f, protocol=2)
+                    stats.record(bytes_written=f.tell())
 
     def check_memos(*args, **kwargs):
 
         if disable_on_tests and is_test_mode():
             return fcn(*args, **kwargs)
 
-        result_computed = False
-        full_args = infer_arg_values(fcn, *args, **kwargs)
-        filepath = get_function_hash_filename(fcn, full_args)
+        filepath = get_filepath(args, kwargs)
         # The filepath is used as the unique identifier, for both the local path and the disk-path
         # It may be more efficient to use the built-in hashability of certain types for the local cash, and just have special
         # ways of dealing with non-hashables like lists and numpy arrays - it's a bit dangerous because we need to check
@@ -74,44 +134,101 @@ def memoize_to_disk(fcn, local_cache = False, disable_on_tests=True, use_cpickle
                 # local_cache_signature = get_local_cache_signature(args, kwargs)
                 if filepath in cached_local_results:
                     LOGGER.info('Reading disk-memo from local cache for function %s' % (fcn.__name__, ))
+                    stats.record(local_hits=1)
                     return cached_local_results[filepath]
             if os.path.exists(filepath):
-                with open(filepath) as f:
-                    try:
-                        LOGGER.info('Reading memo for function %s' % (fcn.__name__, ))
-                        result = pickle.load(f)
-                    except (ValueError, ImportError) as err:
-                        if isinstance(err, ValueError):
-                            LOGGER.warn('Memo-file "%s" was corrupt.  (%s: %s).  Recomputing.' % (filepath, err.__class__.__name__, str(err)))
-                        elif isinstance(err, ImportError):
-                            LOGGER.warn('Memo-file "{}" was tried to reference an old class and got ImportError: {}.  Recomputing.'.format(filepath, str(err)))
-                        result_computed = True
-                        result = fcn(*args, **kwargs)
-            else:
-                result_computed = True
-                result = fcn(*args, **kwargs)
-        else:
-            result_computed = True
-            result = fcn(*args, **kwargs)
+                success, result = load_memo(filepath)
+                if success:
+                    save_memo(filepath, result, result_computed=False)
+                    return result
+        result = compute(args, kwargs)
+        save_memo(filepath, result, result_computed=True)
+        return result
 
-        if MEMO_WRITE_ENABLED and result is not None:  # We assume result of None means you haven't done coding your function.
-            if local_cache:
-                cached_local_results[filepath] = result
-            if result_computed:  # Result was computed, so write it down
-                filepath = get_function_hash_filename(fcn, full_args)
-                make_file_dir(filepath)
-                with open(filepath, 'w') as f:
-                    LOGGER.info('Writing disk-memo for function %s' % (fcn.__name__, ))
-                    pickle.dump(result, f, protocol=2)
+    def check_memos_batch(arg_sets, n_load_threads = 8, n_compute_processes = None):
+        """
+        Call the memoized function on many sets of arguments.  The memo files are all looked up with a single scan of
+        the memo directory, the existing memos are loaded concurrently, and only the missing results are computed.
+
+        :param arg_sets: A list of argument sets.  Each may be a tuple of positional args, a dict of keyword args, or an
+            (args, kwargs) pair, where args is a tuple and kwargs is a dict.
+        :param n_load_threads: Number of threads with which to load the existing memos.
+        :param n_compute_processes: Optionally, compute the missing results in a pool of this many processes.  For this,
+            the function must be picklable (e.g. defined at the top level of a module).  If None, compute them serially.
+        :return: A list of results, one for each argument set.
+        """
+        arg_sets = [_parse_arg_set(a) for a in arg_sets]
+        if disable_on_tests and is_test_mode():
+            return [fcn(*args, **kwargs) for args, kwargs in arg_sets]
 
-        return result
+        filepaths = [get_filepath(args, kwargs) for args, kwargs in arg_sets]
+        unique_filepaths = list(OrderedDict.fromkeys(filepaths))
+        results = {}
+        if MEMO_READ_ENABLED:
+            if local_cache:
+                results.update((fp, cached_local_results[fp]) for fp in unique_filepaths if fp in cached_local_results)
+                stats.record(local_hits=sum(fp in results for fp in filepaths))
+            existing_memos = set(os.listdir(MEMO_DIR)) if os.path.exists(MEMO_DIR) else set()
+            to_load = [fp for fp in unique_filepaths if fp not in results and os.path.basename(fp) in existing_memos]
+            if len(to_load)>0:
+                loaded = _map_in_pool(ThreadPool(processes=min(n_load_threads, len(to_load))), load_memo, to_load)
+                for fp, (success, result) in zip(to_load, loaded):
+                    if success:
+                        results[fp] = result
+                        save_memo(fp, result, result_computed=False)
+
+        arg_sets_to_compute = OrderedDict((fp, arg_set) for fp, arg_set in zip(filepaths, arg_sets) if fp not in results)
+        if n_compute_processes is not None and len(arg_sets_to_compute)>1:
+            start_time = time.time()
+            # If the function is decorated, the module attribute refers to this wrapper, so we send the wrapper
+            module = sys.modules.get(getattr(fcn, '__module__', None))
+            picklable_fcn = check_memos if getattr(module, check_memos.__name__, None) is check_memos else fcn
+            computed = _map_in_pool(multiprocessing.Pool(processes=min(n_compute_processes, len(arg_sets_to_compute))),
+                _call_unmemoized, [(picklable_fcn, args, kwargs) for args, kwargs in arg_sets_to_compute.values()])
+            stats.record(misses=len(computed), compute_time=time.time()-start_time)
+        else:
+            computed = [compute(args, kwargs) for args, kwargs in arg_sets_to_compute.values()]
+        for fp, result in zip(arg_sets_to_compute.keys(), computed):
+            results[fp] = result
+            save_memo(fp, result, result_computed=True)
+        return [results[fp] for fp in filepaths]
 
     check_memos.wrapped_fcn = fcn
     check_memos.clear_cache = lambda: clear_memo_files_for_function(check_memos)
+    check_memos.batch = check_memos_batch
+    if hasattr(fcn, '__name__'):  # Allows decorated functions to be pickled by reference (e.g. to send to a process pool)
+        check_memos.__name__ = fcn.__name__
+        check_memos.__module__ = fcn.__module__
 
     return check_memos
 
 
+def _parse_arg_set(arg_set):
+    if isinstance(arg_set, dict):
+        return (), arg_set
+    elif isinstance(arg_set, tuple) and len(arg_set)==2 and isinstance(arg_set[0], tuple) and isinstance(arg_set[1], dict):
+        return arg_set
+    else:
+        assert isinstance(arg_set, tuple), 'Each argument set must be a tuple of args, a dict of kwargs, or an (args, kwargs) pair.  Got {}'.format(arg_set)
+        return arg_set, {}
+
+
+def _map_in_pool(pool, fcn, items):
+    try:
+        results = pool.map(fcn, items)
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return results
+
+
+def _call_unmemoized(fcn_args_kwargs):
+    fcn, args, kwargs = fcn_args_kwargs
+    return getattr(fcn, 'wrapped_fcn', fcn)(*args, **kwargs)
+
+
 def memoize_to_disk_test(fcn):
     """
     Use this just when testing the memoization itself (because normally memoization is disabled when is_test_mode() is True.
@@ -132,12 +249,71 @@ def memoize_to_disk_and_cache_test(fcn):
     return memoize_to_disk(fcn, local_cache=True, disable_on_tests=False)
 
 
-def get_function_hash_filename(fcn, argname_argvalue_list):
-    args_code = compute_fixed_hash(argname_argvalue_list)
-    # TODO: Include function path in hash?  Or module path, which would allow memos to be shareable.
+def get_function_hash_filename(fcn, argname_argvalue_list, code_hash = None):
+    """
+    :param fcn: The memoized function
+    :param argname_argvalue_list: An OrderedDict of (arg_name->arg_value) that the function is called with
+    :param code_hash: Optionally, a hash of the function's identity and code (see compute_function_code_hash).  If
+        None, the memo is keyed only on the function name and arguments.
+    :return: The path of the memo file.
+    """
+    args_code = compute_fixed_hash(argname_argvalue_list if code_hash is None else (code_hash, argname_argvalue_list))
     return os.path.join(MEMO_DIR, '%s-%s.pkl' % (fcn.__name__, args_code))
 
 
+def compute_function_code_hash(fcn, dependencies = (), use_source = True):
+    """
+    Compute a hash that identifies a function by its module, qualified name, and code, as well as the code of the
+    things it depends on.
+
+    :param fcn: A function
+    :param dependencies: A list of functions, classes, or modules, whose code the function's output also depends on.
+    :param use_source: True to hash the source code.  False to hash the bytecode (so comments and formatting do not
+        matter).  Objects without available source are hashed by bytecode either way.
+    :return: A 32-character hexidecimal hash code.
+    """
+    return compute_fixed_hash([_get_code_description(f, use_source=use_source) for f in (fcn, )+tuple(dependencies)])
+
+
+def _get_module_name(obj):
+    module_name = getattr(obj, '__module__', None) if not isinstance(obj, types.ModuleType) else obj.__name__
+    if module_name == '__main__':  # Use the file name, so that memos are the same whether or not a module is run as main
+        try:
+            module_name = os.path.splitext(os.path.basename(inspect.getfile(obj)))[0]
+        except TypeError:
+            pass
+    return module_name
+
+
+def _get_qualified_name(obj):
+    if hasattr(obj, '__qualname__'):
+        return obj.__qualname__
+    elif inspect.ismethod(obj):
+        return '%s.%s' % (obj.im_class.__name__, obj.__name__)
+    else:
+        return getattr(obj, '__name__', obj.__class__.__name__)
+
+
+def _get_bytecode_description(code):
+    return (code.co_name, code.co_code, code.co_names, code.co_varnames,
+        tuple(_get_bytecode_description(c) if isinstance(c, types.CodeType) else repr(c) for c in code.co_consts))
+
+
+def _get_code_description(obj, use_source):
+    if isinstance(obj, partial):
+        return ('partial', _get_code_description(obj.func, use_source=use_source), repr(obj.args), repr(sorted((obj.keywords or {}).items())))
+    if inspect.ismethod(obj):
+        obj = obj.im_func
+    code = getattr(obj, '__code__', None)
+    source = None
+    if use_source or code is None:
+        try:
+            source = inspect.getsource(obj)
+        except (IOError, TypeError):
+            assert code is not None, "Can't get the source or bytecode of {}, so we can't include its code in the memo key.".format(obj)
+    return (_get_module_name(obj), _get_qualified_name(obj), source if source is not None else _get_bytecode_description(code))
+
+
 def memoize_to_disk_with_settings(**kwargs):
     return partial(memoize_to_disk, **kwargs)
 
@@ -170,6 +346,185 @@ def clear_all_memos():
     print 'Removed %s memos.' % (len(all_memos))
 
 
+class MemoStats(object):
+    """
+    Counters describing how effective the memoization of a function has been.
+    """
+
+    FIELDS = ('local_hits', 'disk_hits', 'misses', 'corrupt_recomputes', 'bytes_read', 'bytes_written', 'load_time', 'compute_time')
+
+    def __init__(self, **initial_values):
+        for field in self.FIELDS:
+            setattr(self, field, initial_values.pop(field, 0))
+        assert len(initial_values)==0, 'Unknown fields: {}'.format(initial_values.keys())
+        self._lock = threading.Lock()
+
+    def record(self, **increments):
+        with self._lock:
+            for field, increment in increments.iteritems():
+                setattr(self, field, getattr(self, field) + increment)
+
+    def take(self):
+        """
+        Reset the counters to zero.
+        :return: A MemoStats with the values of the counters before they were reset.
+        """
+        with self._lock:
+            old_stats = MemoStats(**self.to_dict())
+            for field in self.FIELDS:
+                setattr(self, field, 0)
+        return old_stats
+
+    def is_empty(self):
+        return all(getattr(self, field)==0 for field in self.FIELDS)
+
+    @property
+    def hit_rate(self):
+        n_calls = self.local_hits + self.disk_hits + self.misses
+        return float(self.local_hits + self.disk_hits) / n_calls if n_calls > 0 else float('nan')
+
+    @property
+    def time_saved(self):
+        """
+        An estimate of the time saved by memoization: The time it would have taken to compute all the hits (based on
+        the average computation time), minus the time spent loading memos.
+        """
+        return (self.local_hits + self.disk_hits) * self.compute_time / self.misses - self.load_time if self.misses > 0 else float('nan')
+
+    def to_dict(self):
+        return OrderedDict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __add__(self, other):
+        return MemoStats(**{field: getattr(self, field) + getattr(other, field) for field in self.FIELDS})
+
+    def __eq__(self, other):
+        return isinstance(other, MemoStats) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join('{}={}'.format(k, v) for k, v in self.to_dict().iteritems()))
+
+
+_MEMO_STATS = OrderedDict()
+
+
+def get_memo_stats(fcn):
+    """
+    Get the statistics of the memoized function in this process.
+    :param fcn: A memoized function (or the function it wraps)
+    :return: A MemoStats object.  This is live: it will continue to be updated as the function is called.
+    """
+    key = _get_memo_stats_key(getattr(fcn, 'wrapped_fcn', fcn))
+    if key not in _MEMO_STATS:
+        _MEMO_STATS[key] = MemoStats()
+    return _MEMO_STATS[key]
+
+
+def get_all_memo_stats(include_saved = False):
+    """
+    :param include_saved: Also include the statistics saved by previous processes (see save_memo_stats).
+    :return: An OrderedDict<function_identifier: MemoStats>
+    """
+    all_stats = load_saved_memo_stats() if include_saved else OrderedDict()
+    for key, stats in _MEMO_STATS.iteritems():
+        all_stats[key] = all_stats[key] + stats if key in all_stats else stats + MemoStats()
+    return all_stats
+
+
+def clear_memo_stats():
+    """
+    Reset the statistics of this process.  (Counters are reset in place, because memoized functions keep a reference
+    to their MemoStats object.)
+    """
+    for stats in _MEMO_STATS.values():
+        stats.take()
+
+
+def load_saved_memo_stats():
+    """
+    :return: An OrderedDict<function_identifier: MemoStats> of statistics saved by previous processes.
+    """
+    if not os.path.exists(MEMO_STATS_PATH):
+        return OrderedDict()
+    with open(MEMO_STATS_PATH) as f:
+        try:
+            return OrderedDict((key, MemoStats(**stats_dict)) for key, stats_dict in pickle.load(f).iteritems())
+        except Exception as err:
+            LOGGER.warn('Memo statistics file "{}" could not be read ({}: {}).  Ignoring it.'.format(MEMO_STATS_PATH, err.__class__.__name__, str(err)))
+            return OrderedDict()
+
+
+def save_memo_stats():
+    """
+    Add the statistics collected in this process to the saved statistics, and reset the statistics of this process.
+    This is called automatically when the process exits (except in test mode).
+    """
+    new_stats = OrderedDict((key, stats.take()) for key, stats in _MEMO_STATS.items() if not stats.is_empty())
+    if len(new_stats)==0:
+        return
+    make_file_dir(MEMO_STATS_PATH)
+    with _lock_file(MEMO_STATS_PATH+'.lock'):  # So that processes exiting at the same time don't lose each other's updates
+        all_stats = load_saved_memo_stats()
+        for key, stats in new_stats.iteritems():
+            all_stats[key] = all_stats[key] + stats if key in all_stats else stats
+        temp_path = '{}.{}.tmp'.format(MEMO_STATS_PATH, os.getpid())
+        with open(temp_path, 'w') as f:
+            pickle.dump(OrderedDict((key, stats.to_dict()) for key, stats in all_stats.iteritems()), f, protocol=2)
+        os.rename(temp_path, MEMO_STATS_PATH)  # Atomic, so a process dying mid-write can't corrupt the saved stats
+
+
+def _save_memo_stats_on_exit():
+    if not is_test_mode():
+        save_memo_stats()
+
+
+atexit.register(_save_memo_stats_on_exit)
+
+
+@contextmanager
+def _lock_file(path):
+    try:
+        import fcntl
+    except ImportError:  # Windows: no locking
+        yield
+        return
+    with open(path, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def clear_saved_memo_stats():
+    if os.path.exists(MEMO_STATS_PATH):
+        os.remove(MEMO_STATS_PATH)
+
+
+def _get_memo_stats_key(fcn):
+    return '{}.{}'.format(_get_module_name(fcn), getattr(fcn, '__name__', fcn.__class__.__name__))
+
+
+def get_memo_stats_report(include_saved = True):
+    """
+    :param include_saved: Include statistics saved by previous processes.
+    :return: A string containing a table of the memoization statistics of each function, along with the number and size
+        of the memo files it has on disk.
+    """
+    import tabulate
+    memo_files_per_function = {}
+    for path in get_all_memos():
+        memo_files_per_function.setdefault(os.path.basename(path).rsplit('-', 1)[0], []).append(path)
+    headers = ['Function', 'Local Hits', 'Disk Hits', 'Misses', 'Corrupt', 'Hit Rate', 'MB Read', 'MB Written',
+        'Load Time', 'Compute Time', 'Est. Time Saved', 'Memos on Disk', 'MB on Disk']
+    rows = []
+    for key, stats in get_all_memo_stats(include_saved=include_saved).iteritems():
+        memo_files = memo_files_per_function.get(key.rsplit('.', 1)[-1], [])
+        rows.append([key, stats.local_hits, stats.disk_hits, stats.misses, stats.corrupt_recomputes, '{:.1%}'.format(stats.hit_rate),
+            stats.bytes_read/1e6, stats.bytes_written/1e6, stats.load_time, stats.compute_time, stats.time_saved,
+            len(memo_files), sum(os.path.getsize(p) for p in memo_files)/1e6])
+    return tabulate.tabulate(rows, headers=headers, floatfmt='.3g')
+
+
 class DisableMemoReading(object):
 
     def __enter__(self):
@@ -216,9 +571,16 @@ class DisableMemos(object):
 
 if __name__ == '__main__':
 
-    cmd = raw_input('Type "clearall" to clear all memos: ')
+    import argparse
+    parser = argparse.ArgumentParser(description='Inspect or clear the memos saved by memoize_to_disk.')
+    parser.add_argument('command', nargs='?', default='stats', choices=['stats', 'clearall', 'clearstats'],
+        help='"stats" (default) prints the hit-rate statistics of memoized functions.  "clearall" removes all memos.  '
+             '"clearstats" resets the saved statistics.')
+    args = parser.parse_args()
 
-    if cmd == 'clearall':
+    if args.command == 'stats':
+        print get_memo_stats_report()
+    elif args.command == 'clearall':
         clear_all_memos()
-    else:
-        raise Exception('Bad command or file name.')
\ No newline at end of file
+    elif args.command == 'clearstats':
+        clear_saved_memo_stats()
\ No newline at end of file
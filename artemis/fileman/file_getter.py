@@ -1,11 +1,24 @@
+import atexit
 import hashlib
+import httplib
+import json
+import logging
+import socket
 import tempfile
+import threading
+import time
+import urllib
 import urllib2
+import urlparse
+from collections import OrderedDict
+from contextlib import contextmanager
 from StringIO import StringIO
 import gzip
 import tarfile
+from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile
 from artemis.fileman.local_dir import get_local_path, make_dir, make_file_dir
+from artemis.general.progress_indicator import ProgressIndicator
 from artemis.general.should_be_builtins import bad_value
 import shutil
 import os
@@ -13,7 +26,38 @@ import os
 __author__ = 'peter'
 
 
-def get_file(relative_name, url = None, data_transformation = None):
+DOWNLOAD_CHUNK_SIZE = 2**16
+DOWNLOAD_TIMEOUT = 60
+URL_CACHE_DIR = 'caches'  # Relative to the data directory
+URL_CACHE_MAX_BYTES = 2**33  # The least recently used files are deleted from the url cache when it gets bigger than this.
+_URL_CACHE_INDEX_NAME = 'index.json'
+_URL_CACHE_INDEX_LOCK = threading.Lock()
+TEMP_FILE_TTL = 60  # Seconds for which temporary copies of urls (see use_temp_file) are kept for reuse.
+_TEMP_FILES = {}  # (url, data_transformation) -> _TempFileEntry
+_TEMP_FILE_LOCK = threading.RLock()
+_TEMP_DIR = None
+
+logging.basicConfig()
+LOGGER = logging.getLogger(__name__)
+
+
+class ChecksumError(IOError):
+    pass
+
+
+def get_file(relative_name, url = None, data_transformation = None, checksum = None, connections = None):
+    """
+    Get the local path to a file, downloading it first if there is no local copy.
+
+    :param relative_name: Path of the file, relative to the data directory
+    :param url: Url to download the file from, if it does not exist locally
+    :param data_transformation: Optionally, a function that transforms the downloaded data (a string) before it is
+        saved (e.g. unzip_gz).
+    :param checksum: Optionally, a checksum of the downloaded file of the form '<algorithm>:<hexdigest>', e.g.
+        'md5:0123456789abcdef0123456789abcdef'.  A ChecksumError is raised if the download does not match.
+    :param connections: (for internal use) A KeepAliveConnections object through which to reuse connections.
+    :return: The full local path to the file
+    """
 
     relative_folder, file_name = os.path.split(relative_name)
     local_folder = get_local_path(relative_folder)
@@ -29,16 +73,111 @@ def get_file(relative_name, url = None, data_transformation = None):
         assert url is not None, "No local copy of '%s' was found, and you didn't provide a URL to fetch it from" % (full_filename, )
 
         print 'Downloading file from url: "%s"...' % (url, )
-        response = urllib2.urlopen(url)
-        data = response.read()
+        _download_and_transform(url, full_filename, data_transformation=data_transformation, checksum=checksum, connections=connections)
         print '...Done.'
+    return full_filename
 
-        if data_transformation is not None:
-            print 'Processing downloaded data...'
-            data = data_transformation(data)
-        with open(full_filename, 'w') as f:
+
+def _download_and_transform(url, local_path, data_transformation = None, checksum = None, connections = None):
+    if data_transformation is None:
+        download_file(url, local_path, checksum=checksum, connections=connections)
+    else:
+        raw_filename = download_file(url, local_path+'.raw', checksum=checksum, connections=connections)
+        print 'Processing downloaded data...'
+        with open(raw_filename) as f:
+            data = data_transformation(f.read())
+        with open(local_path, 'w') as f:
             f.write(data)
-    return full_filename
+        os.remove(raw_filename)
+    return local_path
+
+
+def get_files(relative_names, urls, data_transformation = None, checksums = None, n_threads = 8, raise_errors = True):
+    """
+    Get the local paths to many files, downloading the ones that do not exist locally concurrently.
+
+    :param relative_names: A list of file paths, relative to the data directory
+    :param urls: A list of urls to download the files from
+    :param data_transformation: See get_file
+    :param checksums: Optionally, a list of checksums (see get_file)
+    :param n_threads: Maximum number of downloads to run at once.
+    :param raise_errors: If False, failed downloads do not raise an error, but return None in place of their path.
+    :return: A list of full local paths to the files.
+    """
+    assert len(relative_names)==len(urls)
+    if checksums is None:
+        checksums = [None]*len(urls)
+    assert len(checksums)==len(urls)
+
+    with KeepAliveConnections() as connections:
+
+        def get((relative_name, url, checksum)):
+            return get_file(relative_name, url=url, data_transformation=data_transformation, checksum=checksum, connections=connections)
+
+        return _map_unique_with_threads(get, zip(relative_names, urls, checksums), key = lambda (relative_name, _, __): get_local_path(relative_name),
+            n_threads=n_threads, raise_errors=raise_errors)
+
+
+def download_file(url, local_path, checksum = None, resume = True, progress = False, chunk_size = DOWNLOAD_CHUNK_SIZE, connections = None):
+    """
+    Download a file, streaming it to disk in chunks.  The data is first written to "<local_path>.part", which is
+    renamed to local_path once the download is complete.  If a ".part" file already exists (from an interrupted
+    download), we ask the server for only the remaining bytes.
+
+    :param url: The url to download
+    :param local_path: The full local path to save the file to
+    :param checksum: Optionally, a checksum of the form '<algorithm>:<hexdigest>' (e.g. 'md5:...' or 'sha256:...')
+        to verify the downloaded file against.  If it does not match, the partial file is deleted and a ChecksumError
+        is raised.
+    :param resume: Resume from a partial download, if there is one.
+    :param progress: Print the progress of the download.
+    :param chunk_size: Number of bytes to read/write at once.
+    :param connections: (for internal use) A KeepAliveConnections object through which to reuse connections.
+    :return: local_path
+    """
+    partial_path = local_path + '.part'
+    make_file_dir(local_path)
+    n_bytes_existing = os.path.getsize(partial_path) if resume and os.path.exists(partial_path) else 0
+    try:
+        response, status, info = _open_url(url, headers = {'Range': 'bytes=%s-' % (n_bytes_existing, )} if n_bytes_existing > 0 else {}, connections=connections)
+    except urllib2.HTTPError as err:
+        if err.code == 416 and n_bytes_existing > 0:  # Requested range not satisfiable: The partial file is already complete.
+            response = None
+        else:
+            raise
+    if response is not None:
+        _write_response(response, info, partial_path, append = status == 206, chunk_size=chunk_size, progress_name = url if progress else None)
+    if checksum is not None:
+        _check_file_checksum(partial_path, checksum)
+    os.rename(partial_path, local_path)
+    return local_path
+
+
+def download_files(urls, local_paths, checksums = None, n_threads = 8, skip_existing = True, raise_errors = True):
+    """
+    Download many files concurrently, through a bounded pool of threads.  Each thread keeps its connections alive
+    until all downloads are done, so many files from the same server do not each need a new connection.
+
+    :param urls: A list of urls to download.
+    :param local_paths: A list of full local paths to save them to.
+    :param checksums: Optionally, a list of checksums (see download_file)
+    :param n_threads: Maximum number of downloads to run at once.
+    :param skip_existing: Do not download files that already exist locally.
+    :param raise_errors: If False, failed downloads do not raise an error, but return None in place of their path.
+    :return: A list of local paths.
+    """
+    assert len(urls)==len(local_paths)
+    if checksums is None:
+        checksums = [None]*len(urls)
+    assert len(checksums)==len(urls)
+
+    with KeepAliveConnections() as connections:
+
+        def download((url, local_path, checksum)):
+            return local_path if skip_existing and os.path.exists(local_path) else download_file(url, local_path, checksum=checksum, connections=connections)
+
+        return _map_unique_with_threads(download, zip(urls, local_paths, checksums), key = lambda (_, local_path, __): local_path,
+            n_threads=n_threads, raise_errors=raise_errors)
 
 
 def get_file_in_archive(relative_path, subpath, url, force_extract = False):
@@ -57,13 +196,23 @@ def get_file_in_archive(relative_path, subpath, url, force_extract = False):
     return local_file_path
 
 
-def get_archive(relative_path, url, force_extract=False, archive_type = None, force_download = False):
+def get_archive(relative_path, url, force_extract=False, archive_type = None, force_download = False, members = None, keep_archive = True):
     """
     Download a compressed archive and extract it into a folder.
 
+    .tar.gz archives are decompressed and extracted while they download, so the download and extraction happen at the
+    same time, and (if keep_archive is False) the archive never needs to be stored.  .zip archives can only be read once
+    they are complete, so they are downloaded first.
+
     :param relative_path: Local name for the extracted folder.  (Zip file will be named this with the appropriate zip extension)
     :param url: Url of the archive to download
     :param force_extract: Force the zip file to re-extract (rather than just reusing the extracted folder)
+    :param archive_type: '.tar.gz' or '.zip', or None to infer it from the url or the response headers.
+    :param force_download: Delete the extracted folder and download the archive again.
+    :param members: Optionally, a list of paths (files or directories) within the archive.  If provided, only these are
+        extracted, and the archive is only re-read if any of them are missing from the extracted folder.
+    :param keep_archive: Keep the archive on disk (as "<folder><archive_type>"), so that it can be re-extracted without
+        downloading it again.  Set to False to save disk space.
     :return: The full path to the extracted folder on your system.
     """
 
@@ -71,80 +220,544 @@ def get_archive(relative_path, url, force_extract=False, archive_type = None, fo
 
     assert archive_type in ('.tar.gz', '.zip', None)
 
-    if force_download:
+    if force_download and os.path.exists(local_folder_path):
         shutil.rmtree(local_folder_path)
 
-    if not os.path.exists(local_folder_path) or force_download:  # If the folder does not exist, download zip and extract.
-        # (We also check force download here to avoid a race condition)
-        response = urllib2.urlopen(url)
-
-        # Need to infer
-        if archive_type is None:
-            if url.endswith('.tar.gz'):
-                archive_type = '.tar.gz'
-            elif url.endswith('.zip'):
-                archive_type = '.zip'
+    if members is None:
+        needs_extraction = not os.path.exists(local_folder_path)
+    else:
+        needs_extraction = not all(os.path.exists(os.path.join(local_folder_path, m)) for m in members)
+
+    if force_extract or needs_extraction:
+        local_archive_path = None if force_download else next((local_folder_path+ext for ext in ([archive_type] if archive_type is not None else ['.tar.gz', '.zip'])
+            if os.path.exists(local_folder_path+ext)), None)
+        if local_archive_path is not None:  # Reuse the archive we downloaded before
+            if local_archive_path.endswith('.tar.gz'):
+                with open(local_archive_path, 'rb') as f:
+                    _extract_tar_stream(f, local_folder_path, members=members)
             else:
-                info = response.info()
-                try:
-                    header = next(x for x in info.headers if x.startswith('Content-Disposition'))
-                    original_file_name = next(x for x in header.split(';') if x.startswith('filename')).split('=')[-1].lstrip('"\'').rstrip('"\'')
-                    archive_type = '.tar.gz' if original_file_name.endswith('.tar.gz') else '.zip' if original_file_name.endswith('.zip') else \
-                        bad_value(original_file_name, 'Filename "%s" does not end with a familiar zip extension like .zip or .tar.gz' % (original_file_name, ))
-                except StopIteration:
-                    raise Exception("Could not infer archive type from user argument, url-name, or file-header.  Please specify archive type as either '.zip' or '.tar.gz'.")
-        print 'Downloading archive from url: "%s"...' % (url, )
-        data = response.read()
-        print '...Done.'
+                _extract_zip(local_archive_path, local_folder_path, members=members)
+        else:
+            response = info = None
+            if archive_type is None:
+                if url.endswith('.tar.gz'):
+                    archive_type = '.tar.gz'
+                elif url.endswith('.zip'):
+                    archive_type = '.zip'
+                else:
+                    response, _, info = _open_url(url)
+                    archive_type = _infer_archive_type_from_header(info)
+            local_zip_path = local_folder_path + archive_type
+            print 'Downloading archive from url: "%s"...' % (url, )
+            if archive_type == '.tar.gz':
+                if response is None:
+                    response, _, info = _open_url(url)
+                content_length = info.getheader('content-length')
+                stream = _TeeReader(response, save_path = local_zip_path+'.part' if keep_archive else None)
+                with stream:
+                    _extract_tar_stream(stream, local_folder_path, members=members)
+                    stream.read_to_end()
+                if content_length is not None and stream.n_bytes < int(content_length):
+                    raise IOError('Download was cut off after {} of {} bytes'.format(stream.n_bytes, content_length))
+                if keep_archive:
+                    os.rename(local_zip_path+'.part', local_zip_path)
+            else:
+                if response is None:
+                    download_file(url, local_zip_path)
+                else:  # We've already started the download to read the header, so just save it.
+                    _write_response(response, info, local_zip_path+'.part')
+                    os.rename(local_zip_path+'.part', local_zip_path)
+                _extract_zip(local_zip_path, local_folder_path, members=members)
+                if not keep_archive:
+                    os.remove(local_zip_path)
+            print '...Done.'
 
-        local_zip_path = local_folder_path + archive_type
-        make_file_dir(local_zip_path)
-        with open(local_zip_path, 'w') as f:
-            f.write(data)
+    return local_folder_path
 
-        force_extract = True
 
-    if force_extract:
-        if archive_type == '.tar.gz':
-            with tarfile.open(local_zip_path) as f:
-                f.extractall(local_folder_path)
-        elif archive_type == '.zip':
-            with ZipFile(local_zip_path) as f:
-                f.extractall(local_folder_path)
-        else:
-            raise Exception()
+def _infer_archive_type_from_header(info):
+    try:
+        header = info.getheader('Content-Disposition')
+        original_file_name = next(x for x in header.split(';') if x.strip().startswith('filename')).split('=')[-1].lstrip('"\'').rstrip('"\'')
+    except (StopIteration, AttributeError):
+        raise Exception("Could not infer archive type from user argument, url-name, or file-header.  Please specify archive type as either '.zip' or '.tar.gz'.")
+    return '.tar.gz' if original_file_name.endswith('.tar.gz') else '.zip' if original_file_name.endswith('.zip') else \
+        bad_value(original_file_name, 'Filename "%s" does not end with a familiar zip extension like .zip or .tar.gz' % (original_file_name, ))
 
-    return local_folder_path
 
+def _is_selected_member(name, members):
+    """
+    :param name: The name of a file or directory within an archive.
+    :param members: A list of paths of files/directories to select, or None to select everything.
+    :return: True if name is one of the members or within one of the member directories.
+    """
+    name = os.path.normpath(name)
+    assert not (os.path.isabs(name) or name.startswith('..')), 'Refusing to extract "{}", which is outside the archive folder'.format(name)
+    return members is None or any(name == os.path.normpath(m) or name.startswith(os.path.normpath(m)+os.sep) for m in members)
+
+
+def _extract_tar_stream(fileobj, local_folder_path, members = None):
+    """
+    Extract a gzipped tar file as it is read from the (not necessarily seekable) file object.
+    """
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+        for member in tar:
+            if _is_selected_member(member.name, members):
+                tar.extract(member, local_folder_path)
+
+
+def _extract_zip(local_zip_path, local_folder_path, members = None):
+    with ZipFile(local_zip_path) as f:
+        f.extractall(local_folder_path, members=[name for name in f.namelist() if _is_selected_member(name, members)])
+
+
+class _TeeReader(object):
+    """
+    A file-like object that reads from a source, and optionally saves everything it reads to a file.
+    """
+
+    def __init__(self, source, save_path = None):
+        self._source = source
+        self._save_file = open(save_path, 'wb') if save_path is not None else None
+        self.n_bytes = 0
+
+    def read(self, size = -1):
+        data = self._source.read(size) if size >= 0 else self._source.read()
+        if self._save_file is not None:
+            self._save_file.write(data)
+        self.n_bytes += len(data)
+        return data
 
-def get_file_and_cache(url, data_transformation = None, enable_cache_write = True, enable_cache_read = True):
+    def read_to_end(self, chunk_size = DOWNLOAD_CHUNK_SIZE):
+        """ Read the remainder of the source (e.g. padding after the end of a tar file) """
+        while self.read(chunk_size):
+            pass
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._save_file is not None:
+            self._save_file.close()
+
+
+def get_file_and_cache(url, data_transformation = None, enable_cache_write = True, enable_cache_read = True, max_age = None,
+        max_bytes = None):
+    """
+    Get a local copy of the file at a url, keeping it in the "caches" folder of the data directory for future calls.
+
+    The cache is kept coherent with the server.  When a file is downloaded, we remember its ETag and Last-Modified
+    headers.  When a cached file is used again, we ask the server whether it has changed (a conditional request, which
+    costs a round trip but no data if it has not), and download it again if it has.  If the server cannot be reached,
+    the cached copy is used.
+
+    :param url: The url of the file
+    :param data_transformation: Optionally, a function that transforms the downloaded data (a string) before it is saved.
+    :param enable_cache_write: Save the downloaded file in the cache.
+    :param enable_cache_read: Use the cached copy of the file, if there is one.
+    :param max_age: If not None, cached copies that were downloaded or validated less than max_age seconds ago are used
+        without asking the server.  Cached copies for which the server gave neither an ETag nor a Last-Modified header
+        cannot be validated, so they are downloaded again once they are older than max_age (or never, if max_age is None).
+    :param max_bytes: Once the cache exceeds this many bytes, the least recently used files are deleted from it.
+        Defaults to URL_CACHE_MAX_BYTES.  None means no limit.
+    :return: The full local path to the file
+    """
     _, ext = os.path.splitext(url)
 
-    if enable_cache_read or enable_cache_write:
-        hasher = hashlib.md5()
-        hasher.update(url)
-        code = hasher.hexdigest()
-        local_cache_path = os.path.join(get_local_path('caches'), code+ext)
+    if not (enable_cache_read or enable_cache_write):
+        return get_temp_file(url, data_transformation=data_transformation)
+
+    code = hashlib.md5(url).hexdigest()
+    local_cache_path = os.path.join(get_local_path(URL_CACHE_DIR), code+ext)
 
     if enable_cache_read and os.path.exists(local_cache_path):
-        return local_cache_path
+        entry = _read_url_cache_index().get(code, {})
+        validators = dict((header, entry[key]) for header, key in [('If-None-Match', 'etag'), ('If-Modified-Since', 'last_modified')] if entry.get(key) is not None)
+        age = time.time() - entry['validated'] if 'validated' in entry else float('inf')
+        if (max_age is not None and age < max_age) or (max_age is None and not validators):
+            os.utime(local_cache_path, None)  # The modification time marks when the file was last used
+            return local_cache_path
+        try:
+            try:
+                response, status, info = _open_url(url, headers=validators)
+            except urllib2.HTTPError as err:
+                if err.code != 304:
+                    raise
+                status = 304
+            if status == 304:  # Not modified
+                _set_url_cache_entry(code, dict(entry, validated=time.time()))
+                os.utime(local_cache_path, None)
+                return local_cache_path
+            _write_url_to_cache(url, response, info, local_cache_path, code=code, data_transformation=data_transformation)
+        except (IOError, socket.error, httplib.HTTPException) as err:  # (urllib2.URLError is an IOError)
+            LOGGER.warn('Could not check whether cached file for url "{}" is up to date ({}: {}).  Using the cached copy.'.format(url, err.__class__.__name__, str(err)))
+            return local_cache_path
     elif enable_cache_write:
-        full_path = get_file(
-            relative_name = os.path.join('caches', code+ext),
-            url = url,
-            data_transformation=data_transformation
-            )
-        return full_path
+        response, _, info = _open_url(url)
+        _write_url_to_cache(url, response, info, local_cache_path, code=code, data_transformation=data_transformation)
     else:
         return get_temp_file(url, data_transformation=data_transformation)
 
+    _evict_from_url_cache(max_bytes = URL_CACHE_MAX_BYTES if max_bytes is None else max_bytes, keep = local_cache_path)
+    return local_cache_path
+
+
+def get_url_cache_entries():
+    """
+    :return: A list of dicts describing the files in the url cache, most recently used first, with keys:
+        'url', 'path', 'size' (in bytes), 'last_used' (a timestamp), and, where known, 'etag', 'last_modified' (the
+        header) and 'validated' (a timestamp of when the file was last downloaded or found to be up to date).
+    """
+    index = _read_url_cache_index()
+    cache_dir = get_local_path(URL_CACHE_DIR)
+    entries = []
+    for file_name in (os.listdir(cache_dir) if os.path.exists(cache_dir) else []):
+        path = os.path.join(cache_dir, file_name)
+        code, _ = os.path.splitext(file_name)
+        if file_name == _URL_CACHE_INDEX_NAME or file_name.endswith('.part'):
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:  # Deleted in the meantime
+            continue
+        entries.append(dict(index.get(code, {}), path=path, size=stat.st_size, last_used=stat.st_mtime))
+    return sorted(entries, key=lambda e: e['last_used'], reverse=True)
+
+
+def clear_url_cache(url = None):
+    """
+    Delete a url's file from the url cache, or delete all files in the url cache if url is None.
+    """
+    for entry in get_url_cache_entries():
+        if url is None or entry.get('url') == url:
+            _remove_from_url_cache(entry['path'])
+
+
+def _write_url_to_cache(url, response, info, local_cache_path, code, data_transformation = None):
+    make_file_dir(local_cache_path)
+    fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(local_cache_path), suffix='.part')  # Unique, so concurrent writes do not collide
+    os.close(fd)
+    try:
+        _write_response(response, info, partial_path)
+        if data_transformation is not None:
+            with open(partial_path) as f:
+                data = data_transformation(f.read())
+            with open(partial_path, 'w') as f:
+                f.write(data)
+        os.rename(partial_path, local_cache_path)
+    except:
+        os.remove(partial_path)
+        raise
+    _set_url_cache_entry(code, dict(url=url, etag=info.getheader('ETag'), last_modified=info.getheader('Last-Modified'), validated=time.time()))
+
+
+def _evict_from_url_cache(max_bytes, keep = None):
+    """
+    Delete the least recently used files from the url cache until it takes no more than max_bytes.
+    """
+    if max_bytes is None:
+        return
+    entries = get_url_cache_entries()
+    total_bytes = sum(e['size'] for e in entries)
+    for entry in entries[::-1]:
+        if total_bytes <= max_bytes:
+            break
+        if entry['path'] != keep:
+            _remove_from_url_cache(entry['path'])
+            total_bytes -= entry['size']
+
+
+def _remove_from_url_cache(path):
+    try:
+        os.remove(path)
+    except OSError:  # Someone else removed it first
+        pass
+    _set_url_cache_entry(os.path.splitext(os.path.basename(path))[0], None)
+
+
+def _read_url_cache_index():
+    index_path = get_local_path(os.path.join(URL_CACHE_DIR, _URL_CACHE_INDEX_NAME))
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except ValueError:  # Corrupt index.  We lose our validators, but the cached files remain usable.
+        LOGGER.warn('Url cache index "{}" was corrupt.  Ignoring it.'.format(index_path))
+        return {}
+
+
+def _set_url_cache_entry(code, entry):
+    """
+    Set (or delete, if entry is None) an entry in the url cache index.  The index is written to a temporary file which
+    is then renamed, so readers never see a partially written index.
+    """
+    index_path = get_local_path(os.path.join(URL_CACHE_DIR, _URL_CACHE_INDEX_NAME))
+    with _URL_CACHE_INDEX_LOCK:
+        index = _read_url_cache_index()
+        if entry is None:
+            if code not in index:
+                return
+            del index[code]
+        else:
+            index[code] = entry
+        make_file_dir(index_path)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix='.part')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.rename(temp_path, index_path)
+
 
 def get_temp_file(url, data_transformation = None):
+    """
+    Download a file into a new temporary file.  It is up to the caller to delete it.
+
+    :param url: The url of the file
+    :param data_transformation: Optionally, a function that transforms the downloaded data (a string) before it is saved.
+    :return: The full local path to the temporary file
+    """
     _, ext = os.path.splitext(url)
-    tmp_file = tempfile.mktemp() + ext
-    return get_file(tmp_file, url, data_transformation=data_transformation)
+    fd, tmp_file = tempfile.mkstemp(suffix=ext, dir=_get_temp_dir())  # In our private directory, so nobody can meddle with the ".part" file
+    os.close(fd)
+    try:
+        return _download_and_transform(url, tmp_file, data_transformation=data_transformation)
+    except:
+        os.remove(tmp_file)
+        raise
+
+
+@contextmanager
+def use_temp_file(url, data_transformation = None, ttl = None):
+    """
+    Get a temporary local copy of the file at a url, for the duration of a "with" block:
+
+        with use_temp_file(url) as local_path:
+            data = open(local_path).read()
+
+    Temporary copies are kept for a short time (ttl seconds) after they were downloaded, and are shared, so code that
+    repeatedly loads the same url does not download it again each time.  If several threads ask for the same url at
+    once, it is downloaded only once.  A copy is deleted once it has expired and nobody is using it (or when the process
+    exits).
+
+    :param url: The url of the file
+    :param data_transformation: Optionally, a function that transforms the downloaded data (a string) before it is saved.
+    :param ttl: Time, in seconds, for which the downloaded copy can be reused.  Defaults to TEMP_FILE_TTL.
+    :yield: The full local path to the temporary copy.  Do not modify or delete it.
+    """
+    key = (url, data_transformation)
+    with _TEMP_FILE_LOCK:
+        _remove_expired_temp_files()
+        entry = _TEMP_FILES.get(key)
+        is_fetcher = entry is None or entry.is_expired()
+        if is_fetcher:
+            entry = _TEMP_FILES[key] = _TempFileEntry()
+        entry.n_users += 1
+    try:
+        if is_fetcher:
+            try:
+                entry.path = get_temp_file(url, data_transformation=data_transformation)
+            except Exception as err:
+                entry.error = err
+                with _TEMP_FILE_LOCK:
+                    if _TEMP_FILES.get(key) is entry:
+                        del _TEMP_FILES[key]
+                raise
+            finally:
+                entry.expiry = time.time() + (TEMP_FILE_TTL if ttl is None else ttl)
+                entry.ready.set()
+        else:  # Someone else is (or was) downloading it
+            entry.ready.wait()
+            if entry.error is not None:
+                raise IOError('Download of url "{}" failed: {}: {}'.format(url, entry.error.__class__.__name__, str(entry.error)))
+        yield entry.path
+    finally:
+        with _TEMP_FILE_LOCK:
+            entry.n_users -= 1
+            if entry.n_users == 0 and _TEMP_FILES.get(key) is not entry:  # It has been replaced by a newer copy
+                entry.delete()
+            _remove_expired_temp_files()
+
+
+class _TempFileEntry(object):
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.path = None
+        self.error = None
+        self.expiry = None
+        self.n_users = 0
+
+    def is_expired(self, now = None):
+        return self.ready.is_set() and (time.time() if now is None else now) >= self.expiry
+
+    def delete(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _remove_expired_temp_files():
+    now = time.time()
+    for key, entry in _TEMP_FILES.items():
+        if entry.n_users == 0 and entry.is_expired(now):
+            del _TEMP_FILES[key]
+            entry.delete()
+
+
+def _get_temp_dir():
+    global _TEMP_DIR
+    with _TEMP_FILE_LOCK:
+        if _TEMP_DIR is None:
+            _TEMP_DIR = tempfile.mkdtemp(prefix='artemis-')
+            atexit.register(shutil.rmtree, _TEMP_DIR, ignore_errors=True)
+        return _TEMP_DIR
 
 
 def unzip_gz(data):
     return gzip.GzipFile(fileobj = StringIO(data)).read()
+
+
+class KeepAliveConnections(object):
+    """
+    A set of HTTP(S) connections that are kept alive for reuse by later requests to the same server.  Each thread gets
+    its own connections.  All connections are closed when the "with" block exits.
+
+        with KeepAliveConnections() as connections:
+            download_file(url_1, path_1, connections=connections)
+            download_file(url_2, path_2, connections=connections)  # Reuses the connection if url_2 is on the same server
+    """
+
+    def __init__(self):
+        self._thread_local = threading.local()
+        self._all_connections = []
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        if not hasattr(self._thread_local, 'connections'):
+            self._thread_local.connections = {}
+        connections = self._thread_local.connections
+        if (scheme, netloc) not in connections:
+            connection_class = httplib.HTTPSConnection if scheme=='https' else httplib.HTTPConnection
+            connections[scheme, netloc] = connection_class(netloc, timeout=DOWNLOAD_TIMEOUT)
+            with self._lock:
+                self._all_connections.append(connections[scheme, netloc])
+        return connections[scheme, netloc]
+
+    def close(self):
+        with self._lock:
+            for connection in self._all_connections:
+                connection.close()
+            del self._all_connections[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _open_url(url, headers = {}, connections = None, max_redirects = 10):
+    """
+    Send a GET request.  Normally this goes through urllib2 (so proxy settings are respected).  If connections are
+    provided, and no proxy applies to the url, HTTP(S) requests are sent through kept-alive connections instead.
+
+    :return: (response, status, info), where response is a file-like object to read the body from, status is the
+        HTTP status code, and info contains the headers (use info.getheader(name)).
+    """
+    headers = dict(headers)
+    headers.setdefault('User-Agent', 'Python-urllib/%s' % (urllib2.__version__, ))
+    for _ in xrange(max_redirects+1):
+        parts = urlparse.urlsplit(url)
+        if connections is None or parts.scheme not in ('http', 'https') or _uses_proxy(parts):
+            response = urllib2.urlopen(urllib2.Request(url, headers=headers), timeout=DOWNLOAD_TIMEOUT)  # Follows redirects itself
+            return response, response.getcode(), response.info()
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        connection = connections.get(parts.scheme, parts.netloc)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error):  # The server may have closed the kept-alive connection.  Try once more.
+            connection.close()
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+        if response.status in (301, 302, 303, 307, 308):
+            response.read()  # Finish reading, so that the connection can be reused
+            url = urlparse.urljoin(url, response.getheader('location'))
+        elif response.status >= 400:
+            response.read()
+            raise urllib2.HTTPError(url, response.status, response.reason, response.msg, None)
+        else:
+            return response, response.status, response.msg
+    raise IOError('Url "{}" redirected more than {} times'.format(url, max_redirects))
+
+
+def _uses_proxy(url_parts):
+    proxies = urllib.getproxies()
+    return url_parts.scheme in proxies and not urllib.proxy_bypass(url_parts.hostname or '')
+
+
+def _write_response(response, info, path, append = False, chunk_size = DOWNLOAD_CHUNK_SIZE, progress_name = None):
+    content_length = info.getheader('content-length')
+    with open(path, 'ab' if append else 'wb') as f:
+        _copy_stream(response, f, chunk_size=chunk_size, n_bytes_expected = None if content_length is None else int(content_length),
+            progress_name = progress_name)
+
+
+def _copy_stream(source, dest, chunk_size = DOWNLOAD_CHUNK_SIZE, n_bytes_expected = None, progress_name = None):
+    progress = ProgressIndicator(n_bytes_expected, name=progress_name) if progress_name is not None and n_bytes_expected else None
+    n_bytes = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        dest.write(chunk)
+        n_bytes += len(chunk)
+        if progress is not None:
+            progress(n_bytes)
+    if n_bytes_expected is not None and n_bytes < n_bytes_expected:
+        raise IOError('Download was cut off after {} of {} bytes'.format(n_bytes, n_bytes_expected))
+    return n_bytes
+
+
+def _check_file_checksum(path, checksum, chunk_size = DOWNLOAD_CHUNK_SIZE):
+    algorithm, expected_digest = checksum.split(':', 1)
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            hasher.update(chunk)
+    if hasher.hexdigest() != expected_digest.lower():
+        os.remove(path)
+        raise ChecksumError('File downloaded to "{}" had {} checksum {}, but we expected {}'.format(path, algorithm, hasher.hexdigest(), expected_digest))
+
+
+def _map_unique_with_threads(fcn, items, key, n_threads, raise_errors = True):
+    """
+    Call fcn on each item in a pool of threads.  Items with the same key are only processed once (so that two threads
+    never write to the same file).
+    """
+    unique_items = OrderedDict()
+    for item in items:
+        unique_items.setdefault(key(item), item)
+    unique_results = dict(zip(unique_items.keys(), _map_with_threads(fcn, unique_items.values(), n_threads=n_threads, raise_errors=raise_errors)))
+    return [unique_results[key(item)] for item in items]
+
+
+def _map_with_threads(fcn, items, n_threads, raise_errors = True):
+    def call(item):
+        try:
+            return fcn(item)
+        except Exception as err:
+            if raise_errors:
+                raise
+            print 'Ignoring error: {}: {}'.format(err.__class__.__name__, err)
+            return None
+    if len(items)==0:
+        return []
+    pool = ThreadPool(processes=min(n_threads, len(items)))
+    try:
+        results = pool.map(call, items)
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return results
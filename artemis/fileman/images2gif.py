@@ -148,6 +148,60 @@ def intToBin(i):
     return chr(i1) + chr(i2)
 
 
+class EncodedFrame(object):
+    """ EncodedFrame(im)
+
+    A frame that has been converted to a paletted image and LZW-encoded,
+    ready to be written into an animated GIF. Encoding is the expensive
+    part of writing a GIF, and frames can be encoded independently (see
+    encodeFrames), so this is what gets done in parallel.
+
+    """
+
+    def __init__(self, im):
+        self.size = im.size
+        palette = getheader(im)[0][-1]
+        if not palette:
+            palette = im.palette.tobytes()
+        self.palette = palette
+        data = getdata(im)
+        imdes, data = data[0], data[1:]
+        if len(data) > 0 and data[0] == '\x08':  # Newer versions of PIL write the LZW minimum code size separately
+            imdes, data = imdes + data[0], data[1:]
+        self.imdes, self.data = imdes, data
+
+
+def _encodeFrame(args):
+    """ Convert and encode a single image (see encodeFrames). """
+    im, dither, nq = args
+    im, = GifWriter().convertImagesToPIL([im], dither, nq)
+    return EncodedFrame(im)
+
+
+def encodeFrames(images, dither=False, nq=0, nProcesses=1):
+    """ encodeFrames(images, dither=False, nq=0, nProcesses=1)
+
+    Convert images to paletted images and encode them, in a pool of
+    nProcesses processes if nProcesses > 1. Returns a list of
+    EncodedFrames.
+
+    """
+    args = [(im, dither, nq) for im in images]
+    if nProcesses is None or nProcesses > 1 and len(images) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=nProcesses)
+        try:
+            frames = pool.map(_encodeFrame, args)
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+        return frames
+    else:
+        return [_encodeFrame(a) for a in args]
+
+
 class GifWriter:
     """ GifWriter()
 
@@ -342,8 +396,8 @@ class GifWriter:
             Y = np.argwhere(diff.sum(1))
             # Get rect coordinates
             if X.size and Y.size:
-                x0, x1 = X[0], X[-1]+1
-                y0, y1 = Y[0], Y[-1]+1
+                x0, x1 = X[0,0], X[-1,0]+1
+                y0, y1 = Y[0,0], Y[-1,0]+1
             else: # No change ... make it minimal
                 x0, x1 = 0, 2
                 y0, y1 = 0, 2
@@ -410,84 +464,80 @@ class GifWriter:
 
         Given a set of images writes the bytes to the specified stream.
 
+        """
+        frames = [EncodedFrame(im) for im in images]
+        return self.writeEncodedFramesToFile(fp, frames, durations, loops, xys, disposes)
+
+
+    def writeEncodedFramesToFile(self, fp, frames, durations, loops, xys, disposes):
+        """ writeEncodedFramesToFile(fp, frames, durations, loops, xys, disposes)
+
+        Given a set of EncodedFrames writes the bytes to the specified stream.
+
         """
         # Obtain palette for all images and count each occurance
-        palettes, occur = [], []
-        for im in images:
-            #palette = getheader(im)[1]
-            palette = getheader(im)[0][-1]
-            if not palette:
-              #palette = PIL.ImagePalette.ImageColor
-                palette = im.palette.tobytes()
-            palettes.append(palette)
-        for palette in palettes:
-            occur.append( palettes.count( palette ) )
+        palettes = [frame.palette for frame in frames]
+        occur = [palettes.count(palette) for palette in palettes]
 
         # Select most-used palette as the global one (or first in case no max)
         globalPalette = palettes[ occur.index(max(occur)) ]
 
-        # Init
-        frames = 0
-        firstFrame = True
+        for i, frame in enumerate(frames):
 
+            if i==0:
+                # Write header
+                fp.write(encode(self.getheaderAnim(frame)))
+                fp.write(globalPalette)
+                fp.write(encode(self.getAppExt(loops)))
 
-        for im, palette in zip(images, palettes):
+            self.writeEncodedFrame(fp, frame, durations[i], disposes[i], xys[i], globalPalette)
 
-            if firstFrame:
-                # Write header
+        fp.write(encode(";"))  # end gif
+        return len(frames)
 
-                # Gather info
-                header = self.getheaderAnim(im)
-                appext = self.getAppExt(loops)
 
-                # Write
-                fp.write(encode(header))
-                fp.write(globalPalette)
-                fp.write(encode(appext))
-
-                # Next frame is not the first
-                firstFrame = False
-
-            if True:
-                # Write palette and image data
-
-                # print {'dur': durations[frames], 'disp': disposes[frames], 'xy': xys[frames]}
-                # xys[frames] = (0, 0)
-
-                # Gather info
-                data = getdata(im)
-                imdes, data = data[0], data[1:]
-                graphext = self.getGraphicsControlExt(durations[frames],
-                                                        disposes[frames])
-                # Make image descriptor suitable for using 256 local color palette
-                lid = self.getImageDescriptor(im, xys[frames])
-
-                # Write local header
-                if (palette != globalPalette) or (disposes[frames] != 2):
-                    # Use local color palette
-                    fp.write(encode(graphext))
-                    fp.write(encode(lid)) # write suitable image descriptor
-                    fp.write(palette) # write local color table
-                    fp.write(encode('\x08')) # LZW minimum size code
-                else:
-                    # Use global color palette
-                    fp.write(encode(graphext))
-                    fp.write(imdes) # write suitable image descriptor
+    def writeEncodedFrame(self, fp, frame, duration, dispose, xy, globalPalette):
+        """ writeEncodedFrame(fp, frame, duration, dispose, xy, globalPalette)
 
-                # Write image data
-                for d in data:
-                    fp.write(d)
+        Write the palette and image data of one EncodedFrame.
 
-            # Prepare for next round
-            frames = frames + 1
+        """
+        graphext = self.getGraphicsControlExt(duration, dispose)
+        # Make image descriptor suitable for using 256 local color palette
+        lid = self.getImageDescriptor(frame, xy)
 
-        fp.write(encode(";"))  # end gif
-        return frames
+        # Write local header
+        if (frame.palette != globalPalette) or (dispose != 2):
+            # Use local color palette
+            fp.write(encode(graphext))
+            fp.write(encode(lid)) # write suitable image descriptor
+            fp.write(frame.palette) # write local color table
+            fp.write(encode('\x08')) # LZW minimum size code
+        else:
+            # Use global color palette
+            fp.write(encode(graphext))
+            fp.write(frame.imdes) # write suitable image descriptor
+
+        # Write image data
+        for d in frame.data:
+            fp.write(d)
 
 
 class OnlineGifWriter(object):
+    """ OnlineGifWriter(filename, repeat=True, fps=10, dispose=2, xy=(0,0), nProcesses=1)
 
-    def __init__(self, filename, repeat = True, fps = 10, dispose = 2, xy = (0,0)):  # Todo, displose, loop, etc
+    Write an animated GIF one frame at a time:
+
+        with OnlineGifWriter('anim.gif') as writer:
+            for im in images:
+                writer.write(im)
+
+    If nProcesses > 1, frames are encoded in a pool of processes while
+    you produce the next ones, and written in order as they finish.
+
+    """
+
+    def __init__(self, filename, repeat = True, fps = 10, dispose = 2, xy = (0,0), nProcesses = 1):  # Todo, displose, loop, etc
         self.filename = filename
         self.pointless_instance = GifWriter()
         self.first_frame = True
@@ -496,6 +546,9 @@ class OnlineGifWriter(object):
         self.xy = xy
         self.loops = 1 if repeat is False else 0 if repeat is True else int(repeat)
         self.fp = None
+        self.nProcesses = nProcesses
+        self.pool = None
+        self.pending = []  # AsyncResults of frames being encoded, in order
 
     def __enter__(self):
         return self
@@ -507,21 +560,31 @@ class OnlineGifWriter(object):
             data = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
             im = data.reshape(fig.canvas.get_width_height()[::-1] + (3,))
 
-        im = self.check_im(im)
-
         if isinstance(im, np.ndarray):
-            im, = self.pointless_instance.convertImagesToPIL([im], dither=False, nq=0)
+            im = self.check_im(im)
+
+        if self.nProcesses > 1:
+            if self.pool is None:
+                import multiprocessing
+                self.pool = multiprocessing.Pool(processes=self.nProcesses)
+            self.pending.append(self.pool.apply_async(_encodeFrame, ((im, False, 0), )))
+            while len(self.pending) > 0 and (self.pending[0].ready() or len(self.pending) > 2*self.nProcesses):
+                self._write_encoded_frame(self.pending.pop(0).get())
+        else:
+            self._write_encoded_frame(_encodeFrame((im, False, 0)))
 
+    def _write_encoded_frame(self, frame):
         if self.first_frame:
-            self._init_gif(im)
+            self._init_gif(frame)
             self.first_frame = False
-        self._write_frame(im)
+        self.pointless_instance.writeEncodedFrame(self.fp, frame, duration=self.duration, dispose=self.dispose, xy=self.xy,
+            globalPalette=self.globalPalette)
 
-    def _init_gif(self, im):
-        self.globalPalette = getheader(im)[0][-1]
+    def _init_gif(self, frame):
+        self.globalPalette = frame.palette
 
         # Gather info
-        header = self.pointless_instance.getheaderAnim(im)
+        header = self.pointless_instance.getheaderAnim(frame)
         appext = self.pointless_instance.getAppExt(self.loops)
 
         # Write
@@ -530,41 +593,16 @@ class OnlineGifWriter(object):
         self.fp.write(self.globalPalette)
         self.fp.write(encode(appext))
 
-    def _write_frame(self, im, duration = None, dispose = None, xy = None):
-
-        duration = self.duration if duration is None else duration
-        dispose = self.dispose if dispose is None else dispose
-        xy = self.xy if xy is None else xy
-
-        palette = getheader(im)[0][-1]
-        if not palette:
-            palette = im.palette.tobytes()
-
-        # Gather info
-        data = getdata(im)
-        imdes, data = data[0], data[1:]
-        graphext = self.pointless_instance.getGraphicsControlExt(duration,
-                                                dispose)
-        # Make image descriptor suitable for using 256 local color palette
-        lid = self.pointless_instance.getImageDescriptor(im, xy)
-
-        # Write local header
-        if (palette != self.globalPalette) or (dispose != 2):
-            # Use local color palette
-            self.fp.write(encode(graphext))
-            self.fp.write(encode(lid)) # write suitable image descriptor
-            self.fp.write(palette) # write local color table
-            self.fp.write(encode('\x08')) # LZW minimum size code
-        else:
-            # Use global color palette
-            self.fp.write(encode(graphext))
-            self.fp.write(imdes) # write suitable image descriptor
-
-        # Write image data
-        for d in data:
-            self.fp.write(d)
-
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pool is not None:
+            if exc_type is None:
+                for result in self.pending:
+                    self._write_encoded_frame(result.get())
+                self.pool.close()
+            else:
+                self.pool.terminate()
+            self.pool.join()
+            self.pending = []
         if self.fp is not None:
             self.fp.write(encode(";"))
             self.fp.close()
@@ -596,9 +634,9 @@ class OnlineGifWriter(object):
 ## Exposed functions
 
 def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
-                nq=0, subRectangles=True, dispose=None):
+                nq=0, subRectangles=True, dispose=None, nProcesses=1):
     """ writeGif(filename, images, duration=0.1, repeat=True, dither=False,
-                    nq=0, subRectangles=True, dispose=None)
+                    nq=0, subRectangles=True, dispose=None, nProcesses=1)
 
     Write an animated gif from the specified images.
 
@@ -635,6 +673,10 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
         in place. 2 means the background color should be restored after
         each frame. 3 means the decoder should restore the previous frame.
         If subRectangles==False, the default is 2, otherwise it is 1.
+    nProcesses : int or None
+        Number of processes in which to convert and encode the frames.
+        None means one per CPU. Worthwhile for long animations, or when
+        using nq.
 
     """
 
@@ -685,14 +727,13 @@ def writeGif(filename, images, duration=0.1, repeat=True, dither=False,
         dispose = [dispose for im in images]
 
 
-    # Make images in a format that we can write easy
-    images = gifWriter.convertImagesToPIL(images, dither, nq)
+    # Convert and encode the images (this is the slow part)
+    frames = encodeFrames(images, dither, nq, nProcesses)
 
     # Write
     fp = open(filename, 'wb')
     try:
-        # print fp, images, duration, loops, xy, dispose
-        gifWriter.writeGifToFile(fp, images, duration, loops, xy, dispose)
+        gifWriter.writeEncodedFramesToFile(fp, frames, duration, loops, xy, dispose)
     finally:
         fp.close()
 
@@ -704,7 +745,98 @@ def readGif(filename, asNumpy=True):
     Read images from an animated GIF file.  Returns a list of numpy
     arrays, or, if asNumpy is false, a list if PIL images.
 
+    See also iterGif, readGifFrame and readGifArray, which do not need
+    to hold every frame in memory at once.
+
+    """
+    return list(iterGif(filename, asNumpy=asNumpy))
+
+
+def iterGif(filename, frames=None, asNumpy=True):
+    """ iterGif(filename, frames=None, asNumpy=True)
+
+    Iterate over the frames of an animated GIF file, converting each one
+    only when it is needed. Yields numpy arrays, or, if asNumpy is false,
+    PIL images.
+
+    frames can be a list of frame indices, or a slice, to only read some
+    frames. Note that the frames before the last wanted one still need to
+    be decoded (a GIF frame may be drawn on top of the previous one), but
+    they are not converted or stored.
+
+    """
+    for pilIm in _iterGifFrames(filename, frames):
+        tmp = pilIm.convert() # Make without palette
+        if asNumpy:
+            a = np.asarray(tmp)
+            if len(a.shape)==0:
+                raise MemoryError("Too little memory to convert PIL image to array")
+            yield a
+        else:
+            yield tmp
+
+
+def readGifFrame(filename, index, asNumpy=True):
+    """ readGifFrame(filename, index, asNumpy=True)
+
+    Read a single frame from an animated GIF file.
+
+    """
+    for im in iterGif(filename, frames=[index], asNumpy=asNumpy):
+        return im
+    raise IndexError('GIF file %s has no frame %s' % (filename, index))
+
+
+def readGifArray(filename, frames=None, out=None):
+    """ readGifArray(filename, frames=None, out=None)
+
+    Read the frames of an animated GIF file into a single numpy array of
+    shape (n_frames, height, width, n_channels). Each frame is converted
+    straight into the array, so frames are never held in a list.
+
+    frames can be a list of frame indices, or a slice, to only read some
+    frames (see iterGif). out can be a preallocated uint8 array to write
+    the frames into. All frames are converted to the mode (e.g. RGB) of
+    the first one.
+
     """
+    if frames is None or isinstance(frames, slice):
+        frames = range(*(frames or slice(None)).indices(getGifLength(filename)))
+    mode = None
+    nFrames = 0
+    for pilIm in _iterGifFrames(filename, frames):
+        tmp = pilIm.convert() if mode is None else pilIm.convert(mode)
+        mode = tmp.mode
+        a = np.asarray(tmp)
+        if out is None:
+            out = np.empty((len(frames), )+a.shape, dtype=np.uint8)
+        out[nFrames] = a
+        nFrames += 1
+    if out is None:
+        raise IndexError('GIF file %s has none of the frames %s' % (filename, frames))
+    return out[:nFrames]
+
+
+def getGifLength(filename):
+    """ getGifLength(filename)
+
+    Get the number of frames in an animated GIF file (without decoding
+    them).
+
+    """
+    pilIm = _openGif(filename)
+    if hasattr(pilIm, 'n_frames'):
+        return pilIm.n_frames
+    nFrames = 1
+    try:
+        while True:
+            pilIm.seek(nFrames)
+            nFrames += 1
+    except EOFError:
+        return nFrames
+
+
+def _openGif(filename):
 
     # Check PIL
     if PIL is None:
@@ -721,32 +853,34 @@ def readGif(filename, asNumpy=True):
     # Load file using PIL
     pilIm = PIL.Image.open(filename)
     pilIm.seek(0)
-
-    # Read all images inside
-    images = []
+    return pilIm
+
+
+def _iterGifFrames(filename, frames=None):
+    """ Yield the (loaded) PIL image at each wanted frame. """
+    pilIm = _openGif(filename)
+    if isinstance(frames, slice):
+        frames = range(*frames.indices(getGifLength(filename)))
+    wanted = None if frames is None else sorted(set(frames))
+    if wanted is not None and len(wanted) == 0:
+        return
+    index = 0
     try:
         while True:
-            # Get image as numpy array
-            tmp = pilIm.convert() # Make without palette
-            a = np.asarray(tmp)
-            if len(a.shape)==0:
-                raise MemoryError("Too little memory to convert PIL image to array")
-            # Store, and next
-            images.append(a)
-            pilIm.seek(pilIm.tell()+1)
+            if wanted is None or index == wanted[0]:
+                pilIm.load()
+                yield pilIm
+                if wanted is not None:
+                    wanted.pop(0)
+                    if len(wanted) == 0:
+                        return
+            else:
+                pilIm.load()  # The next frame may be drawn on top of this one
+            index += 1
+            pilIm.seek(index)
     except EOFError:
         pass
 
-    # Convert to normal PIL images if needed
-    if not asNumpy:
-        images2 = images
-        images = []
-        for im in images2:
-            images.append( PIL.Image.fromarray(im) )
-
-    # Done
-    return images
-
 
 class NeuQuant:
     """ NeuQuant(image, samplefac=10, colors=256)
@@ -878,7 +1012,7 @@ class NeuQuant:
 
         # Initialize
         self.setconstants(samplefac, colors)
-        self.pixels = np.fromstring(image.tostring(), np.uint32)
+        self.pixels = np.fromstring(image.tobytes() if hasattr(image, 'tobytes') else image.tostring(), np.uint32)
         self.setUpArrays()
 
         self.learn()
@@ -938,6 +1072,18 @@ class NeuQuant:
             self.a_s[(alpha, rad)] = a
             return a
 
+    def getaSlice(self, alpha, rad, start, end):
+        """ Equivalent to self.geta(alpha, rad)[start:end], but only
+            computes (and does not cache) the part that is needed, which
+            is never more than NETSIZE elements, however big rad is. """
+        length = rad*2-1
+        mid = int(length//2)
+        k = np.arange(*slice(start, end).indices(length))
+        q = np.where(k < mid, mid-1-k, k-mid-1)
+        a = alpha*(rad*rad - q*q)/(rad*rad)
+        a[k==mid] = 0
+        return a
+
     def alterneigh(self, alpha, rad, i, b, g, r):
         if i-rad >= self.SPECIALS-1:
             lo = i-rad
@@ -953,7 +1099,7 @@ class NeuQuant:
             hi = self.NETSIZE
             end = (self.NETSIZE - (i+rad))
 
-        a = self.geta(alpha, rad)[start:end]
+        a = self.getaSlice(alpha, rad, start, end)
 
         p = self.network[lo+1:hi]
         p -= np.transpose(np.transpose(p - np.array([b, g, r])) * a)
@@ -1011,7 +1157,7 @@ class NeuQuant:
         alpha = self.INITALPHA
 
         i = 0;
-        rad = biasRadius * 2**self.RADIUSBIASSHIFT
+        rad = biasRadius // 2**self.RADIUSBIASSHIFT
         if rad <= 1:
             rad = 0
 
@@ -1028,38 +1174,37 @@ class NeuQuant:
         else:
             step = NeuQuant.PRIME4
 
-        i = 0
-        printed_string = ''
-        while i < samplepixels:
-            if i%100 == 99:
-                tmp = '\b'*len(printed_string)
-                printed_string = str((i+1)*100/samplepixels)+"%\n"
-                print(tmp + printed_string)
-            p = self.pixels[pos]
-            r = (p >> 16) & 0xff
-            g = (p >>  8) & 0xff
-            b = (p      ) & 0xff
+        # The learning itself is sequential, but we can unpack all the
+        # pixels we will visit at once.
+        positions = (np.arange(int(samplepixels), dtype=np.int64)*step) % lengthcount
+        samples = self.pixels[positions]
+        samples = np.column_stack([samples & 0xff, (samples >> 8) & 0xff, (samples >> 16) & 0xff]).astype(np.float64)
+        specials = self.network[:self.SPECIALS]
+
+        for i in xrange(len(samples)):
+            bgr = samples[i]
 
             if i == 0: # Remember background colour
-                self.network[self.BGCOLOR] = [b, g, r]
+                self.network[self.BGCOLOR] = bgr
 
-            j = self.specialFind(b, g, r)
+            j = -1
+            for k in xrange(self.SPECIALS):  # specialFind
+                if (specials[k] == bgr).all():
+                    j = k
+                    break
             if j < 0:
-                j = self.contest(b, g, r)
+                j = self.contest(*bgr)
 
             if j >= self.SPECIALS: # Don't learn for specials
                 a = (1.0 * alpha) / self.INITALPHA
-                self.altersingle(a, j, b, g, r)
+                self.network[j] -= a*(self.network[j] - bgr)  # altersingle
                 if rad > 0:
-                    self.alterneigh(a, rad, j, b, g, r)
+                    self.alterneigh(a, rad, j, *bgr)
 
-            pos = (pos+step)%lengthcount
-
-            i += 1
-            if i%delta == 0:
+            if delta > 0 and (i+1)%delta == 0:
                 alpha -= alpha / alphadec
                 biasRadius -= biasRadius / self.RADIUSDEC
-                rad = biasRadius * 2**self.RADIUSBIASSHIFT
+                rad = biasRadius // 2**self.RADIUSBIASSHIFT
                 if rad <= 1:
                     rad = 0
 
@@ -1067,13 +1212,8 @@ class NeuQuant:
         print("Finished 1D learning: final alpha = %1.2f!" % finalAlpha)
 
     def fix(self):
-        for i in range(self.NETSIZE):
-            for j in range(3):
-                x = int(0.5 + self.network[i,j])
-                x = max(0, x)
-                x = min(255, x)
-                self.colormap[i,j] = x
-            self.colormap[i,3] = i
+        self.colormap[:,:3] = np.clip(np.floor(self.network + 0.5), 0, 255)
+        self.colormap[:,3] = np.arange(self.NETSIZE)
 
     def inxbuild(self):
         previouscol = 0
@@ -1125,46 +1265,50 @@ class NeuQuant:
 
 
     def quantize(self, image):
-        """ Use a kdtree to quickly find the closest palette colors for the pixels """
+        """ Map each pixel of the image to the closest palette colour.
+            Uses a kdtree if scipy is available. """
         if get_cKDTree():
             return self.quantize_with_scipy(image)
         else:
-            print('Scipy not available, falling back to slower version.')
             return self.quantize_without_scipy(image)
 
 
     def quantize_with_scipy(self, image):
         w,h = image.size
-        px = np.asarray(image).copy()
-        px2 = px[:,:,:3].reshape((w*h,3))
+        px = np.asarray(image)[:,:,:3].reshape((w*h,3))
 
         cKDTree = get_cKDTree()
         kdtree = cKDTree(self.colormap[:,:3],leafsize=10)
-        result = kdtree.query(px2)
+        result = kdtree.query(px)
         colorindex = result[1]
         print("Distance: %1.2f" % (result[0].sum()/(w*h)) )
-        px2[:] = self.colormap[colorindex,:3]
-
-        return Image.fromarray(px).convert("RGB").quantize(palette=self.paletteImage())
+        return self.indexImage(colorindex.reshape(h, w))
 
 
     def quantize_without_scipy(self, image):
         """" This function can be used if no scipy is availabe.
-        It's 7 times slower though.
+        Each distinct colour is only looked up once.
         """
         w,h = image.size
-        px = np.asarray(image).copy()
-        memo = {}
-        for j in range(w):
-            for i in range(h):
-                key = (px[i,j,0],px[i,j,1],px[i,j,2])
-                try:
-                    val = memo[key]
-                except KeyError:
-                    val = self.convert(*key)
-                    memo[key] = val
-                px[i,j,0],px[i,j,1],px[i,j,2] = val
-        return Image.fromarray(px).convert("RGB").quantize(palette=self.paletteImage())
+        px = np.asarray(image)[:,:,:3].reshape((w*h,3)).astype(np.int32)
+        codes = (px[:,0] << 16) | (px[:,1] << 8) | px[:,2]
+        uniqueCodes, inverse = np.unique(codes, return_inverse=True)
+        uniqueColors = np.column_stack([uniqueCodes >> 16, (uniqueCodes >> 8) & 0xff, uniqueCodes & 0xff])
+        palette = self.colormap[:,:3]
+        uniqueIndex = np.empty(len(uniqueColors), dtype=np.int64)
+        chunk = 4096  # Bound the size of the distance matrix
+        for start in xrange(0, len(uniqueColors), chunk):
+            dists = uniqueColors[start:start+chunk, None, :] - palette[None, :, :]
+            uniqueIndex[start:start+chunk] = np.argmin((dists*dists).sum(2), axis=1)
+        return self.indexImage(uniqueIndex[inverse].reshape(h, w))
+
+
+    def indexImage(self, colorindex):
+        """ Make a paletted PIL image from an array of indices into the
+            colour map. """
+        im = Image.fromarray(colorindex.astype(np.uint8), 'P')
+        im.putpalette(self.paletteImage().getpalette())
+        return im
 
     def convert(self, *color):
         i = self.inxsearch(*color)
@@ -1,10 +1,36 @@
 import logging
-from collections import OrderedDict
+from collections import OrderedDict, MutableMapping
 import pickle
 import os
+import struct
+import tempfile
+import uuid
 
+LOGGER = logging.getLogger(__name__)
 
-class PersistentOrderedDict(OrderedDict):
+# The file is an append-only log.  It starts with a header (_MAGIC followed by a random "generation" id, which changes
+# whenever the file is rewritten), followed by records.  Each record is a _RECORD_HEADER (kind, key length, value
+# length) followed by the pickled key and the pickled value.  A set of changes only counts once it is followed by a
+# commit record, so a write that is interrupted half-way is simply ignored when the file is read.
+_MAGIC = 'ARTEMIS-PERSISTENT-ORDERED-DICT-1\n'
+_GENERATION_LENGTH = 16
+_HEADER_LENGTH = len(_MAGIC) + _GENERATION_LENGTH
+_RECORD_HEADER = struct.Struct('<cQQ')
+_SET, _DELETE, _COMMIT = 'S', 'D', 'C'
+
+# Logs smaller than this are never compacted
+COMPACTION_MIN_BYTES = 2**16
+
+
+class _LazyValue(object):
+    """ A value that has not yet been read from the file. """
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+class PersistentOrderedDict(MutableMapping):
     """
     A Persisten ordered dict.  Usage:
 
@@ -18,31 +44,240 @@ class PersistentOrderedDict(OrderedDict):
     This is similar to python's built in "shelve" module, but
     - It is ordered,
     - It is used in a "with" statement.
+
+    The file is an append-only log: on exiting the "with" block, only the items that were set or deleted are appended
+    to it, along with a commit marker.  Values are only unpickled when they are first accessed.  When the log has grown
+    to compaction_ratio times the size of the live data, it is rewritten (to a temporary file, which then replaces the
+    old one).  Note that, because only changed items are written, modifying a value in place (e.g. pod['a'].append(4))
+    is not recorded unless you assign it again.
+
+    Files written by older versions (a single pickled list of items) are read, and converted on the first write.
     """
 
-    def __init__(self, file_path, pickle_protocol=2):
+    def __init__(self, file_path, pickle_protocol=2, compaction_ratio=2., sync=True):
+        """
+        :param file_path: Path to the file.
+        :param pickle_protocol: The protocol to pickle keys and values with.
+        :param compaction_ratio: Rewrite the file when the log is this many times bigger than the live data.
+        :param sync: Flush writes to disk (with fsync) before and after writing the commit marker, so that a commit
+            survives a crash or power failure.
+        """
         self.file_path = file_path
-        if os.path.exists(self.file_path):
-            try:
-                with open(self.file_path, 'rb') as f:
-                    items = pickle.load(f)
-            except:
-                logging.critical("WARNING: Failed to unpickle file: {}.  Starting from scratch instead".format(self.file_path))
-                items = []
-        else:
-            items = []
         self.pickle_protocol = pickle_protocol
-        OrderedDict.__init__(self, items)
+        self.compaction_ratio = compaction_ratio
+        self.sync = sync
+        self._items = OrderedDict()  # key -> value or _LazyValue
+        self._record_lengths = {}  # key -> length of the record that sets it in the file
+        self._changes = OrderedDict()  # key -> None, for keys set or deleted since the last commit
+        self._generation = None  # None if the file does not exist or is not (yet) a log
+        self._end = _HEADER_LENGTH  # End of the last commit in the file
+        self._loaded = False
+        self._refresh()
 
     def __enter__(self):
         return self
 
     def close(self):
-        with open(self.file_path, 'w') as f:
-            pickle.dump(self.items(), f, protocol=self.pickle_protocol)
+        """
+        Write all changes since the last close to the file.
+        """
+        self._refresh()
+        if self._generation is None:
+            self._rewrite()
+        elif self._changes:
+            self._append()
+            if self._end > COMPACTION_MIN_BYTES and self._end > self.compaction_ratio * (_HEADER_LENGTH + sum(self._record_lengths.values())):
+                self._rewrite()
 
     def __exit__(self, thing1, thing2, thing3):
         self.close()
 
     def get_data(self):
-        return OrderedDict(self)
\ No newline at end of file
+        return OrderedDict(self.items())
+
+    def __getitem__(self, key):
+        value = self._items[key]
+        if isinstance(value, _LazyValue):
+            with open(self.file_path, 'rb') as f:
+                if f.read(_HEADER_LENGTH) != _MAGIC + self._generation:  # The file has been rewritten by someone else
+                    self._refresh()
+                    return self[key]
+                f.seek(value.offset)
+                value = self._items[key] = pickle.loads(f.read(value.length))
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._changes[key] = None
+
+    def __delitem__(self, key):
+        del self._items[key]
+        self._changes[key] = None
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return '{}({}, {})'.format(self.__class__.__name__, self.file_path, self.items())
+
+    def _refresh(self):
+        """
+        Read any commits that were added to the file (e.g. by another process) since we last read it.  Changes that
+        we have not yet written take precedence.
+        """
+        if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) == 0:
+            self._generation = None
+            self._loaded = True
+            return
+        changes = [(key, self._items[key] if key in self._items else _DeletedValue) for key in self._changes]
+        with open(self.file_path, 'rb') as f:
+            header = f.read(_HEADER_LENGTH)
+            if header[:len(_MAGIC)] != _MAGIC:
+                if not self._loaded:
+                    f.seek(0)
+                    self._load_old_format(f)
+                return
+            generation = header[len(_MAGIC):]
+            if generation != self._generation:
+                self._items = OrderedDict()
+                self._record_lengths = {}
+                self._generation = generation
+                self._end = _HEADER_LENGTH
+            self._read_log(f)
+        self._loaded = True
+        for key, value in changes:
+            if value is _DeletedValue:
+                self._items.pop(key, None)
+            else:
+                self._items[key] = value
+
+    def _load_old_format(self, f):
+        try:
+            items = pickle.load(f)
+        except Exception as err:
+            backup_path = self.file_path + '.corrupt'
+            f.close()
+            os.rename(self.file_path, backup_path)
+            LOGGER.critical("Failed to unpickle file: {} ({}).  Moved it to {} and starting from scratch instead".format(self.file_path, err, backup_path))
+            items = []
+        self._items = OrderedDict(items)
+        self._generation = None
+        self._loaded = True
+
+    def _read_log(self, f):
+        """
+        Read all committed records from self._end onwards.
+        """
+        file_size = os.fstat(f.fileno()).st_size
+        f.seek(self._end)
+        position = self._end
+        pending = []
+        while True:
+            record_header = f.read(_RECORD_HEADER.size)
+            if len(record_header) < _RECORD_HEADER.size:
+                break
+            kind, key_length, value_length = _RECORD_HEADER.unpack(record_header)
+            record_length = _RECORD_HEADER.size + key_length + value_length
+            if kind not in (_SET, _DELETE, _COMMIT) or position + record_length > file_size:
+                break
+            if kind == _COMMIT:
+                for kind, key, value, length in pending:
+                    if kind == _SET:
+                        self._items[key] = value
+                        self._record_lengths[key] = length
+                    else:
+                        self._items.pop(key, None)
+                        self._record_lengths.pop(key, None)
+                pending = []
+                self._end = position + record_length
+            else:
+                key = pickle.loads(f.read(key_length))
+                pending.append((kind, key, _LazyValue(offset=position+_RECORD_HEADER.size+key_length, length=value_length), record_length))
+                f.seek(value_length, 1)
+            position += record_length
+        if file_size > self._end:
+            LOGGER.warn('Ignoring {} bytes of uncommitted data at the end of {} (probably from an interrupted write)'.format(file_size-self._end, self.file_path))
+
+    def _make_record(self, kind, key='', value_bytes=''):
+        key_bytes = pickle.dumps(key, protocol=self.pickle_protocol) if kind != _COMMIT else ''
+        return _RECORD_HEADER.pack(kind, len(key_bytes), len(value_bytes)) + key_bytes + value_bytes
+
+    def _flush(self, f):
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+
+    def _append(self):
+        """
+        Append the changes since the last commit to the file, followed by a commit marker.
+        """
+        records = []
+        for key in self._changes:
+            if key in self._items:
+                records.append(self._make_record(_SET, key, pickle.dumps(self[key], protocol=self.pickle_protocol)))
+                self._record_lengths[key] = len(records[-1])
+            else:
+                records.append(self._make_record(_DELETE, key))
+                self._record_lengths.pop(key, None)
+        with open(self.file_path, 'r+b') as f:
+            f.truncate(self._end)  # Remove any remains of an interrupted write
+            f.seek(self._end)
+            f.write(''.join(records))
+            self._flush(f)
+            f.write(self._make_record(_COMMIT))
+            self._flush(f)
+            self._end = f.tell()
+        self._changes.clear()
+
+    def _rewrite(self):
+        """
+        Write all items to a new file, and then replace the old file with it.
+        """
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        generation = uuid.uuid4().bytes
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            old_file = open(self.file_path, 'rb') if self._generation is not None else None
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(_MAGIC + generation)
+                    items = OrderedDict()
+                    record_lengths = {}
+                    for key, value in self._items.iteritems():
+                        if isinstance(value, _LazyValue):  # Copy the pickled value over without unpickling it
+                            old_file.seek(value.offset)
+                            value_bytes = old_file.read(value.length)
+                        else:
+                            value_bytes = pickle.dumps(value, protocol=self.pickle_protocol)
+                        record = self._make_record(_SET, key, value_bytes)
+                        items[key] = _LazyValue(offset=f.tell()+len(record)-len(value_bytes), length=len(value_bytes)) if isinstance(value, _LazyValue) else value
+                        record_lengths[key] = len(record)
+                        f.write(record)
+                    f.write(self._make_record(_COMMIT))
+                    self._flush(f)
+                    end = f.tell()
+            finally:
+                if old_file is not None:
+                    old_file.close()
+            os.rename(temp_path, self.file_path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._items = items
+        self._record_lengths = record_lengths
+        self._generation = generation
+        self._end = end
+        self._changes.clear()
+
+
+class _DeletedValue(object):
+    """ Marks a key that we have deleted but not yet committed. """
@@ -1,28 +1,44 @@
+import Queue
+import itertools
+import multiprocessing
 import os
 import pickle
 import re
+import shutil
+import sys
+import threading
 from contextlib import contextmanager
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
-from artemis.fileman.file_getter import get_temp_file, get_file_and_cache
-from artemis.fileman.images2gif import readGif
+from artemis.fileman.file_getter import get_file_and_cache, use_temp_file, get_temp_file
+from artemis.fileman.images2gif import readGifArray
 from artemis.fileman.local_dir import get_local_path, make_file_dir
 from artemis.general.image_ops import get_dark_edge_slice, resize_image
 
 
-def smart_save(obj, relative_path, remove_file_after = False):
+def smart_save(obj, relative_path, remove_file_after = False, **save_kwargs):
     """
-    Save an object locally.  How you save it depends on its extension.
+    Save an object locally.  How you save it depends on its extension.  See register_format for how to add extensions.
     Extensions currently supported:
-        pkl: Pickle file.
-        That is all.
+        .pkl: Pickle file.
+        .pkl.gz, .pkl.bz2: Compressed pickle file.
+        .npy: A numpy array.
+        .npz: A numpy array, or a dict of numpy arrays.  Use compressed=True to compress it.
+        .h5, .hdf5: A numpy array, or a dict of numpy arrays, in HDF5 format (requires h5py).  Extra arguments (e.g.
+            compression='gzip', chunks=True) are passed to h5py's create_dataset.
+        .zarr: A chunked numpy array in a zarr directory (requires zarr).  Extra arguments (e.g. chunks=(1000, None))
+            are passed to zarr.
+        .jpg, .jpeg, .png, .gif: An image array.
+        .pdf: A matplotlib figure.
     :param obj: Object to save
     :param relative_path: Path to save it, relative to "Data" directory.  The following placeholders can be used:
         %T - ISO time
         %R - Current Experiment Record Identifier (includes experiment time and experiment name)
     :param remove_file_after: If you're just running a test, it's good to verify that you can save, but you don't
         actually want to leave a file behind.  If that's the case, set this argument to True.
+    :param save_kwargs: Format-specific arguments, passed on to the function that saves the file.
     """
     if '%T' in relative_path:
         iso_time = datetime.now().isoformat().replace(':', '.').replace('-', '.')
@@ -30,59 +46,85 @@ def smart_save(obj, relative_path, remove_file_after = False):
     if '%R' in relative_path:
         from artemis.experiments.experiment_record import get_current_experiment_id
         relative_path = relative_path.replace('%R', get_current_experiment_id())
-    _, ext = os.path.splitext(relative_path)
+    ext = _get_extension(relative_path)
+    if ext not in _SAVERS:
+        raise Exception("No method exists yet to save '%s' files.  Add it with register_format!" % (ext, ))
 
     with smart_file(relative_path, make_dir=True) as local_path:
         print 'Saved object <%s at %s> to file: "%s"' % (obj.__class__.__name__, hex(id(object)), local_path)
-        if ext=='.pkl':
-            with open(local_path, 'w') as f:
-                pickle.dump(obj, f)
-        if ext in _IMAGE_EXTENSIONS:
-            _save_image(obj, local_path)
-        elif ext=='.pdf':
-            obj.savefig(local_path)
-        else:
-            raise Exception("No method exists yet to save '%s' files.  Add it!" % (ext, ))
+        _SAVERS[ext](obj, local_path, **save_kwargs)
 
     if remove_file_after:
-        os.remove(local_path)
+        if os.path.isdir(local_path):
+            shutil.rmtree(local_path)
+        else:
+            os.remove(local_path)
 
     return local_path
 
 
-def smart_load(location, use_cache = False):
+def smart_load(location, use_cache = False, **load_kwargs):
     """
     Load a file, with the method based on the extension.  See smart_save doc for the list of extensions.
     :param location: Identifies file location.
         If it's formatted as a url, it's downloaded.
         If it begins with a "/", it's assumed to be a local path.
         Otherwise, it is assumed to be referenced relative to the data directory.
-    :param use_cache: If True, and the location is a url, make a local cache of the file for future use (note: if the
-        file at this url changes, the cached file will not).
+    :param use_cache: If True, and the location is a url, make a local cache of the file for future use.  The cached
+        copy is checked against the server (see get_file_and_cache), so it is refreshed if the file at this url changes.
+        If False, the file is downloaded to a temporary copy, which is reused for a short time (see use_temp_file).
+    :param load_kwargs: Format-specific arguments, passed on to the function that loads the file.  Array formats
+        accept:
+            index: An index (e.g. slice(1000, 2000), or (slice(None), 3)) into the saved array.  Only the indexed
+                part of the array is read from the file.  (.npy, .h5, .hdf5, .zarr)
+            mmap_mode: Return a memory-mapped array, which is read from disk only as you access it.  e.g. 'r' for
+                read-only.  See numpy.load.  (.npy)
+            lazy: Return a zarr array, which is read from disk chunk-by-chunk as you index it.  (.zarr)
     :return: An object, whose type depends on the extension.  Generally a numpy array for data or an object for pickles.
     """
     assert isinstance(location, str), 'Location must be a string!  We got: %s' % (location, )
+    ext = _get_extension(location)
+    if ext not in _LOADERS:
+        raise Exception("No method exists yet to load '%s' files.  Add it with register_format!" % (ext, ))
     with smart_file(location, use_cache=use_cache) as local_path:
-        ext = os.path.splitext(local_path)[1].lower()
-        if ext=='.pkl':
-            with open(local_path) as f:
-                obj = pickle.load(f)
-        elif ext=='.gif':
-            frames = readGif(local_path)
-            if frames[0].shape[2]==3 and all(f.shape[2] for f in frames[1:]):  # Wierd case:
-                obj = np.array([frames[0]]+[f[:, :, :3] for f in frames[1:]])
-            else:
-                obj = np.array(readGif(local_path))
-        elif ext in _IMAGE_EXTENSIONS:
-            from PIL import Image
-            obj = _load_image(local_path)
-        elif ext in ('.mpg', '.mp4', '.mpeg'):
-            obj = _load_video(local_path)
-        else:
-            raise Exception("No method exists yet to load '%s' files.  Add it!" % (ext, ))
+        obj = _LOADERS[ext](local_path, **load_kwargs)
     return obj
 
 
+def register_format(extensions, loader = None, saver = None):
+    """
+    Register functions that load and/or save files with the given extensions, so that smart_load and smart_save can
+    handle them.  Import any optional dependencies inside these functions, so that they are only required when the
+    format is actually used.
+
+    :param extensions: An extension (e.g. '.npy') or a list of extensions.  Multi-part extensions (e.g. '.pkl.gz') are
+        allowed, and take precedence over their last part.
+    :param loader: A function (local_path, **load_kwargs) -> obj
+    :param saver: A function (obj, local_path, **save_kwargs) -> None
+    """
+    if isinstance(extensions, basestring):
+        extensions = [extensions]
+    for ext in extensions:
+        assert ext.startswith('.'), 'Extensions should start with a ".".  Got "{}"'.format(ext)
+        if loader is not None:
+            _LOADERS[ext.lower()] = loader
+        if saver is not None:
+            _SAVERS[ext.lower()] = saver
+
+
+def _get_extension(path):
+    """
+    :return: The (lower-case) extension of the path, including multi-part extensions like ".pkl.gz" if they are registered.
+    """
+    file_name = os.path.basename(path.rstrip('/')).lower()
+    registered = [ext for ext in set(_LOADERS.keys()+_SAVERS.keys()) if ext.count('.') > 1 and file_name.endswith(ext)]
+    return max(registered, key=len) if len(registered) > 0 else os.path.splitext(file_name)[1]
+
+
+_LOADERS = {}  # extension -> function(local_path, **load_kwargs) -> obj
+_SAVERS = {}  # extension -> function(obj, local_path, **save_kwargs)
+
+
 def smart_load_image(location, max_resolution = None, force_rgb=False, use_cache = False):
     """
     Load an image into a numpy array.
@@ -93,13 +135,112 @@ def smart_load_image(location, max_resolution = None, force_rgb=False, use_cache
         Otherwise, it is assumed to be referenced relative to the data directory.
     :param max_resolution: Maximum resolution (size_y, size_x) of the image
     :param force_rgb: Force an RGB representation (transform greyscale and RGBA images into RGB)
-    :param use_cache: If True, and the location is a url, make a local cache of the file for future use (note: if the
-        file at this url changes, the cached file will not).
+    :param use_cache: If True, and the location is a url, make a local cache of the file for future use.  The cached
+        copy is checked against the server (see get_file_and_cache), so it is refreshed if the file at this url changes.
+        If False, the file is downloaded to a temporary copy, which is reused for a short time (see use_temp_file).
     :return: An object, whose type depends on the extension.  Generally a numpy array for data or an object for pickles.
     """
     with smart_file(location, use_cache=use_cache) as local_path:
         return _load_image(local_path, max_resolution = max_resolution, force_rgb=force_rgb)
 
+
+def smart_load_images(locations, size = None, resize_mode = 'scale_crop', draft = True, use_cache = False, n_processes = None,
+        out = None, cache_decoded = False):
+    """
+    Load many images into a single (n_images, height, width, 3) uint8 array.  Images are decoded and resized in a pool
+    of processes, and each is written into the array as it arrives.
+
+    :param locations: A list of image locations (see smart_load_image).  Urls are downloaded concurrently.
+    :param size: A 2-tuple of (width, height) to resize the images to.  If None, all images must have the same size.
+    :param resize_mode: The mode with which to get the images to the desired size.  Can be:
+        'squeeze', 'preserve_aspect', 'crop', 'scale_crop'.  See resize_image in image_ops.py for more info.
+    :param draft: Let the JPEG decoder decode large images at a reduced resolution (a power of 2 smaller, but no smaller
+        than size), which is much faster than decoding the full image and then shrinking it.
+    :param use_cache: If True, keep a local cache of images loaded from urls.  (see smart_file)
+    :param n_processes: Number of processes to decode images in.  Defaults to the number of CPUs.  Set to 1 to decode in
+        this process.
+    :param out: Optionally, a preallocated (n_images, height, width, 3) uint8 array to write the images into.
+    :param cache_decoded: Memoize the decoded (and resized) images to disk (see memoize_to_disk), so that loading them
+        again does not require decoding them again.  Memos are invalidated when an image file changes.
+    :return: A (n_images, height, width, 3) uint8 array.
+    """
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    local_paths, temp_paths = _get_local_image_paths(locations, use_cache=use_cache)
+    pool = None
+    try:
+        arg_sets = [dict(local_path=path, size=size, resize_mode=resize_mode, draft=draft, file_signature=(os.path.getmtime(path), os.path.getsize(path)))
+            for path in local_paths]
+        if cache_decoded:
+            from artemis.fileman.disk_memoize import memoize_to_disk
+            images = memoize_to_disk(_load_resized_image).batch(arg_sets, n_compute_processes=n_processes if n_processes > 1 else None)
+        elif n_processes > 1 and len(arg_sets) > 1:
+            pool = multiprocessing.Pool(processes=min(n_processes, len(arg_sets)))
+            images = pool.imap(_load_resized_image_from_kwargs, arg_sets, chunksize=max(1, len(arg_sets)//(4*n_processes)))
+        else:
+            images = (_load_resized_image(**kwargs) for kwargs in arg_sets)
+        for i, (location, im) in enumerate(zip(locations, images)):
+            if out is None:
+                out = np.empty((len(locations), )+im.shape, dtype=np.uint8)
+            if im.shape != out.shape[1:]:
+                raise ValueError('Image "{}" has shape {}, but the others have shape {}.  Specify size to resize them to the same size.'.format(location, im.shape, out.shape[1:]))
+            out[i] = im
+        if pool is not None:
+            pool.close()
+            pool.join()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        for path in temp_paths:
+            os.remove(path)
+    if out is None:
+        assert size is not None, "We can not know the shape of an empty set of images unless you specify size"
+        out = np.empty((0, size[1], size[0], 3), dtype=np.uint8)
+    return out
+
+
+def _get_local_image_paths(locations, use_cache = False, n_threads = 8):
+    """
+    :return: (local_paths, temp_paths), where temp_paths are the paths of temporary files that should be removed later.
+    """
+    urls = list(set(loc for loc in locations if is_url(loc)))
+    if len(urls) > 0:
+        pool = ThreadPool(min(n_threads, len(urls)))
+        try:
+            downloaded = dict(zip(urls, pool.map(get_file_and_cache if use_cache else get_temp_file, urls)))
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+    else:
+        downloaded = {}
+    local_paths = [downloaded[loc] if loc in downloaded else get_local_path(loc) for loc in locations]
+    return local_paths, [] if use_cache else downloaded.values()
+
+
+def _load_resized_image(local_path, size = None, resize_mode = 'scale_crop', draft = True, file_signature = None):
+    """
+    Load an image as a (height, width, 3) array, resized to size.  (see smart_load_images)
+
+    :param file_signature: Not used here, but distinguishes memos of this function for files that have changed.
+    """
+    from PIL import Image
+    pic = Image.open(local_path)
+    if draft and size is not None:
+        pic.draft(pic.mode, tuple(size))  # Only affects JPEGs
+    im = np.asarray(pic.convert('RGB'))
+    if size is not None:
+        width, height = size
+        im = resize_image(im, width=width, height=height, mode=resize_mode)
+    return im
+
+
+def _load_resized_image_from_kwargs(kwargs):
+    return _load_resized_image(**kwargs)
+
 _IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
 
 
@@ -150,27 +291,24 @@ def smart_file(location, use_cache = False, make_dir = False):
         If it's formatted as a url, it's downloaded.
         If it begins with a "/", it's assumed to be a local path.
         Otherwise, it is assumed to be referenced relative to the data directory.
-    :param use_cache: If True, and the location is a url, make a local cache of the file for future use (note: if the
-        file at this url changes, the cached file will not).
+    :param use_cache: If True, and the location is a url, make a local cache of the file for future use.  The cached
+        copy is checked against the server (see get_file_and_cache), so it is refreshed if the file at this url changes.
+        If False, the file is downloaded to a temporary copy, which is reused for a short time (see use_temp_file).
     :param make_dir: Make the directory for this file, if it does not exist.
     :yield: The local path to the file.
     """
-    its_a_url = is_url(location)
-    if its_a_url:
+    if is_url(location):
         assert not make_dir, "We cannot 'make the directory' for a URL"
         if use_cache:
-            local_path = get_file_and_cache(location)
+            yield get_file_and_cache(location)
         else:
-            local_path = get_temp_file(location)
+            with use_temp_file(location) as local_path:
+                yield local_path
     else:
         local_path = get_local_path(location)
         if make_dir:
             make_file_dir(local_path)
-
-    yield local_path
-
-    if its_a_url and not use_cache:
-        os.remove(local_path)
+        yield local_path
 
 
 def is_url(path):
@@ -184,7 +322,8 @@ def is_url(path):
     return True if re.match(regex, path) else False
 
 
-def smart_load_video(location, use_cache = False, resize_mode='resize_and_crop', cut_edges=False, size = None, cut_edges_thresh=0):
+def smart_load_video(location, use_cache = False, resize_mode='scale_crop', cut_edges=False, size = None, cut_edges_thresh=0,
+        every = 1, max_frames = None, out = None):
     """
     :param location:
     :param size: A 2-tuple of width-height, indicating the desired size of the ouput
@@ -192,14 +331,60 @@ def smart_load_video(location, use_cache = False, resize_mode='resize_and_crop',
         'squeeze', 'preserve_aspect', 'crop', 'scale_crop'.  See resize_image in image_ops.py for more info.
     :param cut_edges: True if you want to cut the dark edges from the video
     :param cut_edges_thresh: If cut_edges, this is the threshold at which you'd like to cut them.
+    :param every: Only keep every n'th frame.
+    :param max_frames: Only read (up to) this many frames (after skipping).
+    :param out: Optionally, a preallocated (n_frames, height, width, 3) array to write the frames into.  Reading stops
+        once it is full.
     :return: A (n_frames, height, width, 3) numpy array
     """
 
     with smart_file(location, use_cache=use_cache) as local_path:
-        return _load_video(local_path, resize_mode=resize_mode, cut_edges=cut_edges, size=size, cut_edges_thresh=cut_edges_thresh)
+        return _load_video(local_path, resize_mode=resize_mode, cut_edges=cut_edges, size=size, cut_edges_thresh=cut_edges_thresh,
+            every=every, max_frames=max_frames, out=out)
+
+
+def smart_iter_video(location, use_cache = False, resize_mode='scale_crop', cut_edges=False, size = None, cut_edges_thresh=0,
+        every = 1, max_frames = None, batch_size = None, prefetch = 16):
+    """
+    Stream the frames of a video, so that it never needs to be held in memory all at once.  Frames are cropped and
+    resized in a worker thread, so this overlaps with whatever you do with them.
+
+    :param batch_size: If None, yield frames one at a time.  Otherwise, yield (batch_size, height, width, 3) arrays of
+        frames (the last one may be shorter).
+    :param prefetch: Maximum number of frames to prepare ahead of time.
+    (See smart_load_video for the other parameters)
+    :yield: (height, width, 3) frames, or (n_frames, height, width, 3) batches of frames.
+    """
+    with smart_file(location, use_cache=use_cache) as local_path:
+        for item in _iter_video(local_path, resize_mode=resize_mode, cut_edges=cut_edges, size=size, cut_edges_thresh=cut_edges_thresh,
+                every=every, max_frames=max_frames, batch_size=batch_size, prefetch=prefetch):
+            yield item
+
 
+def _open_video(full_path):
+    try:
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+    except ImportError:
+        raise ImportError("You need to install moviepy to read videos.  In the virtualenv, go `pip install moviepy`")
+    assert os.path.exists(full_path)
+    return VideoFileClip(full_path)
+
+
+def _iter_video(full_path, every = 1, max_frames = None, **processing_kwargs):
+    video = _open_video(full_path)
+    try:
+        frames = itertools.islice(video.iter_frames(), 0, None if max_frames is None else max_frames*every, every)
+        processed_frames = _iter_processed_frames(frames, **processing_kwargs)
+        try:
+            for item in processed_frames:
+                yield item
+        finally:
+            processed_frames.close()  # Stops the worker thread before we close the video
+    finally:
+        video.reader.close()
 
-def _load_video(full_path, size = None, resize_mode = 'resize_and_crop', cut_edges=False, cut_edges_thresh=0):
+
+def _load_video(full_path, size = None, resize_mode = 'scale_crop', cut_edges=False, cut_edges_thresh=0, every = 1, max_frames = None, out = None):
     """
     Lead a video into a numpy array
 
@@ -209,24 +394,240 @@ def _load_video(full_path, size = None, resize_mode = 'resize_and_crop', cut_edg
         'squeeze', 'preserve_aspect', 'crop', 'scale_crop'.  See resize_image in image_ops.py for more info.
     :param cut_edges: True if you want to cut the dark edges from the video
     :param cut_edges_thresh: If cut_edges, this is the threshold at which you'd like to cut them.
+    :param every: Only keep every n'th frame.
+    :param max_frames: Only read (up to) this many frames (after skipping).
+    :param out: Optionally, a preallocated (n_frames, height, width, 3) array to write the frames into.
     :return: A (n_frames, height, width, 3) numpy array
     """
+    video = _open_video(full_path)
     try:
-        from moviepy.video.io.VideoFileClip import VideoFileClip
-    except ImportError:
-        raise ImportError("You need to install moviepy to read videos.  In the virtualenv, go `pip install moviepy`")
-    assert os.path.exists(full_path)
-    video = VideoFileClip(full_path)
-    images = []
-    edge_crops = None
-    for frame in video.iter_frames():
-        if cut_edges:
-            if edge_crops is None:
-                edge_crops = get_dark_edge_slice(frame, cut_edges_thresh=cut_edges_thresh)
+        n_frames_estimate = int(np.ceil(video.fps*video.duration/every))
+        if max_frames is not None:
+            n_frames_estimate = min(n_frames_estimate, max_frames)
+        frames = itertools.islice(video.iter_frames(), 0, None if max_frames is None else max_frames*every, every)
+        processed_frames = _iter_processed_frames(frames, size=size, resize_mode=resize_mode, cut_edges=cut_edges, cut_edges_thresh=cut_edges_thresh)
+        try:
+            return _collect_frames(processed_frames, out=out, n_frames_estimate=n_frames_estimate)
+        finally:
+            processed_frames.close()  # Stops the worker thread before we close the video
+    finally:
+        video.reader.close()
+
+
+def _iter_processed_frames(frames, size = None, resize_mode = 'scale_crop', cut_edges = False, cut_edges_thresh = 0, batch_size = None, prefetch = 16):
+    """
+    Crop and resize frames in a worker thread.  At most prefetch processed frames are waiting at any time, so memory
+    stays bounded however long the video is.
+
+    :param frames: An iterator of (height, width, 3) frames
+    (See smart_iter_video for the other parameters)
+    :yield: Processed frames, or batches of them.
+    """
+    frame_queue = Queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def process_frames():
+        try:
+            edge_crops = None
+            for frame in frames:
+                if cut_edges:
+                    if edge_crops is None:
+                        edge_crops = get_dark_edge_slice(frame, cut_edges_thresh=cut_edges_thresh)
+                    frame = frame[edge_crops[0], edge_crops[1]]
+                if size is not None:
+                    width, height = size
+                    frame = resize_image(frame, width=width, height=height, mode=resize_mode)
+                if not put((frame, None)):
+                    return
+            put((None, None))
+        except:
+            put((None, sys.exc_info()))
+
+    thread = threading.Thread(target=process_frames)
+    thread.daemon = True
+    thread.start()
+    try:
+        batch = None
+        n_in_batch = 0
+        while True:
+            frame, exc_info = frame_queue.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            elif frame is None:
+                break
+            elif batch_size is None:
+                yield frame
             else:
-                frame = frame[edge_crops[0], edge_crops[1]]
-        if size is not None:
-            width, height = size
-            frame = resize_image(frame, width=width, height=height, mode=resize_mode)
-        images.append(frame)
-    return images
+                if batch is None:
+                    batch = np.empty((batch_size, )+frame.shape, dtype=frame.dtype)
+                batch[n_in_batch] = frame
+                n_in_batch += 1
+                if n_in_batch == batch_size:
+                    yield batch
+                    batch = None
+                    n_in_batch = 0
+        if n_in_batch > 0:
+            yield batch[:n_in_batch]
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _collect_frames(frames, out = None, n_frames_estimate = None):
+    """
+    Write frames into a (n_frames, height, width, 3) array.
+
+    :param frames: An iterator of frames
+    :param out: A preallocated array to write them into.  We stop reading frames once it is full.  If None, we allocate
+        an array of n_frames_estimate frames (growing it if the estimate was too low).
+    :return: The array of frames that were read.
+    """
+    fixed_size = out is not None
+    n_frames = 0
+    for frame in frames:
+        if out is None:
+            out = np.empty((max(1, n_frames_estimate), )+frame.shape, dtype=frame.dtype)
+        elif n_frames == len(out):
+            if fixed_size:
+                break
+            out = np.concatenate([out, np.empty((len(out)//4+1, )+out.shape[1:], dtype=out.dtype)])
+        out[n_frames] = frame
+        n_frames += 1
+    if out is None:
+        raise IOError('The video had no frames')
+    return out[:n_frames]
+
+
+def _load_pickle(local_path):
+    with open(local_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _save_pickle(obj, local_path, protocol = pickle.HIGHEST_PROTOCOL):
+    with open(local_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=protocol)
+
+
+def _open_compressed(local_path, mode):
+    if local_path.lower().endswith('.gz'):
+        import gzip
+        return gzip.open(local_path, mode)
+    else:
+        import bz2
+        return bz2.BZ2File(local_path, mode)
+
+
+def _load_compressed_pickle(local_path):
+    with _open_compressed(local_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _save_compressed_pickle(obj, local_path, protocol = pickle.HIGHEST_PROTOCOL):
+    with _open_compressed(local_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=protocol)
+
+
+def _load_npy(local_path, mmap_mode = None, index = None):
+    if index is None:
+        return np.load(local_path, mmap_mode=mmap_mode)
+    arr = np.load(local_path, mmap_mode='r' if mmap_mode is None else mmap_mode)  # So only the indexed part is read
+    return np.array(arr[index]) if mmap_mode is None else arr[index]
+
+
+def _save_npy(arr, local_path):
+    np.save(local_path, arr)
+
+
+def _load_npz(local_path):
+    """
+    :return: A dict of arrays.  If the file contains a single unnamed array (as saved by _save_npz), return that array.
+    """
+    with np.load(local_path) as f:
+        arrays = dict((k, f[k]) for k in f.files)
+    return arrays['arr_0'] if arrays.keys()==['arr_0'] else arrays
+
+
+def _save_npz(obj, local_path, compressed = False):
+    save = np.savez_compressed if compressed else np.savez
+    if isinstance(obj, dict):
+        save(local_path, **obj)
+    else:
+        save(local_path, obj)
+
+
+def _import_h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("You need to install h5py to read and write HDF5 files.  In the virtualenv, go `pip install h5py`")
+    return h5py
+
+
+def _load_hdf5(local_path, index = None):
+    """
+    :return: If the file contains a single dataset named "data" (as saved by _save_hdf5), that array, otherwise a dict
+        of arrays.
+    """
+    h5py = _import_h5py()
+    with h5py.File(local_path, 'r') as f:
+        arrays = dict((k, f[k][() if index is None else index]) for k in f.keys())
+    return arrays['data'] if arrays.keys()==['data'] else arrays
+
+
+def _save_hdf5(obj, local_path, **dataset_kwargs):
+    h5py = _import_h5py()
+    with h5py.File(local_path, 'w') as f:
+        for name, arr in (obj.iteritems() if isinstance(obj, dict) else [('data', obj)]):
+            f.create_dataset(name, data=arr, **dataset_kwargs)
+
+
+def _import_zarr():
+    try:
+        import zarr
+    except ImportError:
+        raise ImportError("You need to install zarr to read and write chunked .zarr arrays.  In the virtualenv, go `pip install zarr`")
+    return zarr
+
+
+def _load_zarr(local_path, index = None, lazy = False):
+    arr = _import_zarr().open(local_path, mode='r')
+    assert not (lazy and index is not None), "You can index the lazy array yourself."
+    return arr if lazy else arr[...] if index is None else arr[index]
+
+
+def _save_zarr(arr, local_path, **array_kwargs):
+    _import_zarr().save_array(local_path, arr, **array_kwargs)
+
+
+def _load_gif(local_path, frames = None, out = None):
+    """
+    :param frames: Optionally, a list of frame indices, or a slice, to only load some frames.
+    :param out: Optionally, a preallocated uint8 array to write the frames into.
+    :return: A (n_frames, height, width, n_channels) array.  All frames are converted to the mode (e.g. RGB) of the first.
+    """
+    return readGifArray(local_path, frames=frames, out=out)
+
+
+def _save_figure(fig, local_path):
+    fig.savefig(local_path)
+
+
+register_format('.pkl', loader=_load_pickle, saver=_save_pickle)
+register_format(['.pkl.gz', '.pkl.bz2'], loader=_load_compressed_pickle, saver=_save_compressed_pickle)
+register_format('.npy', loader=_load_npy, saver=_save_npy)
+register_format('.npz', loader=_load_npz, saver=_save_npz)
+register_format(['.h5', '.hdf5'], loader=_load_hdf5, saver=_save_hdf5)
+register_format('.zarr', loader=_load_zarr, saver=_save_zarr)
+register_format(_IMAGE_EXTENSIONS, loader=_load_image, saver=_save_image)
+register_format('.gif', loader=_load_gif)
+register_format(('.mpg', '.mp4', '.mpeg'), loader=_load_video)
+register_format('.pdf', saver=_save_figure)
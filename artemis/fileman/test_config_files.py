@@ -1,6 +1,7 @@
 from ConfigParser import NoSectionError, NoOptionError
 from pytest import raises
-from artemis.fileman.config_files import get_config_path, get_config_value
+from artemis.fileman import config_files
+from artemis.fileman.config_files import get_config_path, get_config_value, flush_config_defaults, clear_config_cache
 import os
 __author__ = 'peter'
 
@@ -36,8 +37,33 @@ def test_get_config_value():
     with raises(AssertionError):
         _ = get_config_value(config_filename='.testconfigXXXrc', section='opts', option='setting3')
 
+    flush_config_defaults()  # Defaults are written in a batch
+    with open(config_path) as f:
+        assert f.read().split() == ['[opts]', 'setting1', '=', 'somevalue', 'setting2', '=', 'blah']
+
+    os.remove(config_path)
+    clear_config_cache()
+
+
+def test_config_cache_is_reloaded():
+
+    config_path = get_config_path('.testconfigrc')
+    with open(config_path, 'w') as f:
+        f.write('[opts]\nsetting1 = a\n')
+    clear_config_cache()
+    assert get_config_value(config_filename='.testconfigrc', section='opts', option='setting1') == 'a'
+    old_interval = config_files.CONFIG_CHECK_INTERVAL
+    config_files.CONFIG_CHECK_INTERVAL = 0  # Otherwise the file is only checked for changes once a second
+    try:
+        with open(config_path, 'w') as f:
+            f.write('[opts]\nsetting1 = bb\n')
+        assert get_config_value(config_filename='.testconfigrc', section='opts', option='setting1') == 'bb'
+    finally:
+        config_files.CONFIG_CHECK_INTERVAL = old_interval
     os.remove(config_path)
+    clear_config_cache()
 
 
 if __name__ == '__main__':
     test_get_config_value()
+    test_config_cache_is_reloaded()
@@ -1,6 +1,13 @@
+import os
+import shutil
+import tempfile
 import time
+from collections import OrderedDict
+from functools import partial
 from artemis.fileman.disk_memoize import memoize_to_disk, clear_memo_files_for_function, DisableMemos, memoize_to_disk_and_cache, \
-    memoize_to_disk_test, memoize_to_disk_and_cache_test
+    memoize_to_disk_test, memoize_to_disk_and_cache_test, compute_function_code_hash, get_function_hash_filename, \
+    get_memo_stats, get_memo_stats_report, save_memo_stats, load_saved_memo_stats, get_all_memo_stats
+from artemis.fileman import disk_memoize
 from artemis.general.test_mode import set_test_mode
 import numpy as np
 from pytest import raises
@@ -150,6 +157,111 @@ def test_catch_kwarg_error():
     assert t3 == t1
 
 
+def _get_adder(offset):
+    def add_stuff(a, b):
+        return a+b+offset
+    return add_stuff
+
+
+def test_code_aware_memo_keys():
+
+    add_stuff_1 = _get_adder(10)
+
+    def add_stuff(a, b):
+        return a*b
+
+    assert add_stuff.__name__ == add_stuff_1.__name__
+    assert compute_function_code_hash(add_stuff) != compute_function_code_hash(add_stuff_1)
+    assert compute_function_code_hash(add_stuff, use_source=False) != compute_function_code_hash(add_stuff_1, use_source=False)
+    assert compute_function_code_hash(add_stuff) != compute_function_code_hash(add_stuff, dependencies=[_get_adder])
+    assert compute_function_code_hash(partial(add_stuff, b=2)) != compute_function_code_hash(partial(add_stuff, b=3))
+
+    args = (('a', 2), ('b', 3))
+    assert get_function_hash_filename(add_stuff, args) == get_function_hash_filename(add_stuff_1, args)
+    assert get_function_hash_filename(add_stuff, args, code_hash=compute_function_code_hash(add_stuff)) != \
+        get_function_hash_filename(add_stuff_1, args, code_hash=compute_function_code_hash(add_stuff_1))
+
+    memo_add_stuff = memoize_to_disk(add_stuff, disable_on_tests=False, include_code=True)
+    memo_add_stuff_1 = memoize_to_disk(add_stuff_1, disable_on_tests=False, include_code='bytecode')
+    clear_memo_files_for_function(memo_add_stuff)
+    assert memo_add_stuff(2, 3) == 6
+    assert memo_add_stuff_1(2, 3) == 15  # Without include_code, this would load the memo of the other add_stuff
+    assert memo_add_stuff(2, 3) == 6
+    clear_memo_files_for_function(memo_add_stuff)
+
+
+@memoize_to_disk_test
+def compute_slow_thing_in_batch(a, b, c=1):
+    call_time = time.time()
+    time.sleep(0.01)
+    return (a+b)/float(c), call_time
+
+
+def test_memoize_to_disk_batch():
+
+    clear_memo_files_for_function(compute_slow_thing_in_batch)
+
+    num, t1 = compute_slow_thing_in_batch(1, 2)
+    results = compute_slow_thing_in_batch.batch([(1, 2), (3, 4), {'a': 1, 'b': 2}, ((5, ), {'b': 6, 'c': 2}), (3, 4)])
+    assert [num for num, _ in results] == [3., 7., 3., 5.5, 7.]
+    assert results[0][1] == results[2][1] == t1  # Loaded from memo
+    assert results[1][1] == results[4][1] != t1  # Computed once
+
+    results_again = compute_slow_thing_in_batch.batch([(1, 2), (3, 4), (7, 8), (9, 10)], n_compute_processes=2)
+    assert results_again[:2] == results[:2]
+    assert [num for num, _ in results_again[2:]] == [15., 19.]
+    assert compute_slow_thing_in_batch(7, 8) == results_again[2]  # Computed in a subprocess and saved
+    assert compute_slow_thing_in_batch(9, 10) == results_again[3]
+    clear_memo_files_for_function(compute_slow_thing_in_batch)
+
+
+@memoize_to_disk_and_cache_test
+def compute_slow_thing_with_stats(a, b):
+    time.sleep(0.01)
+    return a+b
+
+
+def test_memo_stats():
+
+    clear_memo_files_for_function(compute_slow_thing_with_stats)
+    stats = get_memo_stats(compute_slow_thing_with_stats)
+    old_stats = stats + stats.__class__()
+    assert compute_slow_thing_with_stats(1, 2) == 3
+    assert compute_slow_thing_with_stats(1, 2) == 3
+    assert compute_slow_thing_with_stats(2, 2) == 4
+    assert get_memo_stats(compute_slow_thing_with_stats.wrapped_fcn) is stats
+    assert stats.misses - old_stats.misses == 2
+    assert stats.local_hits - old_stats.local_hits == 1
+    assert stats.compute_time - old_stats.compute_time >= 0.02
+    assert stats.bytes_written > old_stats.bytes_written
+
+    with open(get_function_hash_filename(compute_slow_thing_with_stats.wrapped_fcn, OrderedDict([('a', 3), ('b', 3)])), 'w') as f:
+        f.write('')  # As if the process writing the memo was killed
+    assert compute_slow_thing_with_stats.batch([(1, 2), (3, 3)]) == [3, 6]
+    assert stats.local_hits - old_stats.local_hits == 2
+    assert stats.corrupt_recomputes - old_stats.corrupt_recomputes == 1
+    assert stats.misses - old_stats.misses == 3
+
+    report = get_memo_stats_report(include_saved=False)
+    assert 'compute_slow_thing_with_stats' in report
+
+    stats_path = disk_memoize.MEMO_STATS_PATH
+    disk_memoize.MEMO_STATS_PATH = os.path.join(tempfile.mkdtemp(), 'stats.pkl')
+    try:
+        n_misses = stats.misses
+        save_memo_stats()
+        assert stats.misses == 0  # Reset in place, so that the function keeps recording into the same object
+        assert compute_slow_thing_with_stats(4, 4) == 8
+        assert get_memo_stats(compute_slow_thing_with_stats).misses == 1
+        save_memo_stats()
+        key, = [k for k, v in get_all_memo_stats().iteritems() if k.endswith('.compute_slow_thing_with_stats')]
+        assert load_saved_memo_stats()[key].misses == n_misses + 1
+    finally:
+        shutil.rmtree(os.path.dirname(disk_memoize.MEMO_STATS_PATH))
+        disk_memoize.MEMO_STATS_PATH = stats_path
+    clear_memo_files_for_function(compute_slow_thing_with_stats)
+
+
 if __name__ == '__main__':
     set_test_mode(True)
     test_unnoticed_wrong_arg_bug_is_dead()
@@ -159,3 +271,6 @@ if __name__ == '__main__':
     test_memoize_to_disk_and_cache()
     test_memoize_to_disk()
     test_complex_args()
+    test_code_aware_memo_keys()
+    test_memoize_to_disk_batch()
+    test_memo_stats()
@@ -1,5 +1,18 @@
+import BaseHTTPServer
+import SocketServer
+import hashlib
 import shutil
-from artemis.fileman.file_getter import get_file_in_archive
+import tarfile
+import tempfile
+import threading
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from zipfile import ZipFile
+from pytest import raises
+from artemis.fileman import file_getter
+from artemis.fileman.file_getter import get_file_in_archive, download_file, download_files, ChecksumError, get_file, \
+    get_archive, get_file_and_cache, get_url_cache_entries, clear_url_cache, use_temp_file
 from artemis.fileman.local_dir import get_local_path
 import os
 __author__ = 'peter'
@@ -47,7 +60,268 @@ def test_unpack_zip():
         assert txt == 'blah blah blah'
 
 
+class _RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files from the directory "directory", with support for keep-alive connections, "Range: bytes=<start>-"
+    requests, and ETag validation.  Records the requests it gets in the class-level list "requests".
+    """
+
+    protocol_version = 'HTTP/1.1'
+    directory = None
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.getheader('Range')))
+        path = os.path.join(self.directory, self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = '"%s"' % (hashlib.md5(data).hexdigest(), )
+        if self.headers.getheader('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        range_header = self.headers.getheader('Range')
+        start = int(range_header[len('bytes='):].rstrip('-')) if range_header is not None else 0
+        if start >= len(data) > 0:
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if range_header is not None else 200)
+        self.send_header('Content-Length', str(len(data)-start))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+@contextmanager
+def serve_directory(directory):
+    """
+    Serve the files in a directory over HTTP on localhost.
+    :yield: The base url of the server.
+    """
+    class handler(_RangeRequestHandler):
+        pass
+    handler.directory = directory
+    server = _ThreadingHTTPServer(('localhost', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://localhost:{}'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_download_file():
+
+    served_dir = tempfile.mkdtemp()
+    local_dir = tempfile.mkdtemp()
+    data = os.urandom(300000)
+    with open(os.path.join(served_dir, 'data.bin'), 'wb') as f:
+        f.write(data)
+    checksum = 'md5:'+hashlib.md5(data).hexdigest()
+    local_path = os.path.join(local_dir, 'data.bin')
+    try:
+        with serve_directory(served_dir) as base_url:
+            download_file(base_url+'/data.bin', local_path, checksum=checksum)
+            with open(local_path, 'rb') as f:
+                assert f.read() == data
+            os.remove(local_path)
+
+            # Resume from an interrupted download
+            with open(local_path+'.part', 'wb') as f:
+                f.write(data[:100000])
+            del _RangeRequestHandler.requests[:]
+            download_file(base_url+'/data.bin', local_path, checksum=checksum)
+            assert _RangeRequestHandler.requests == [('/data.bin', 'bytes=100000-')]
+            assert not os.path.exists(local_path+'.part')
+            with open(local_path, 'rb') as f:
+                assert f.read() == data
+            os.remove(local_path)
+
+            with raises(ChecksumError):
+                download_file(base_url+'/data.bin', local_path, checksum='md5:'+hashlib.md5('something else').hexdigest())
+            assert not os.path.exists(local_path) and not os.path.exists(local_path+'.part')
+    finally:
+        shutil.rmtree(served_dir)
+        shutil.rmtree(local_dir)
+
+
+def test_download_files():
+
+    served_dir = tempfile.mkdtemp()
+    local_dir = tempfile.mkdtemp()
+    file_contents = [os.urandom(1000*i) for i in xrange(20)]
+    for i, data in enumerate(file_contents):
+        with open(os.path.join(served_dir, 'file_%s.bin' % (i, )), 'wb') as f:
+            f.write(data)
+    try:
+        with serve_directory(served_dir) as base_url:
+            urls = [base_url+'/file_%s.bin' % (i, ) for i in xrange(len(file_contents))] + [base_url+'/does_not_exist.bin']
+            local_paths = [os.path.join(local_dir, 'file_%s.bin' % (i, )) for i in xrange(len(urls))]
+            del _RangeRequestHandler.requests[:]
+            paths = download_files(urls+urls[:3], local_paths+local_paths[:3], n_threads=4, raise_errors=False)
+            assert paths == local_paths[:-1] + [None] + local_paths[:3]
+            assert len(_RangeRequestHandler.requests) == len(urls)  # Duplicates are only downloaded once
+            for path, data in zip(paths, file_contents):
+                with open(path, 'rb') as f:
+                    assert f.read() == data
+            with raises(Exception):
+                download_files(urls, local_paths, n_threads=4)
+
+            relative_name = os.path.join(local_dir, 'transformed.txt')
+            assert get_file(relative_name, url=urls[3], data_transformation=lambda s: str(len(s))) == relative_name
+            with open(relative_name) as f:
+                assert f.read() == '3000'
+    finally:
+        shutil.rmtree(served_dir)
+        shutil.rmtree(local_dir)
+
+
+def test_get_archive():
+
+    served_dir = tempfile.mkdtemp()
+    local_dir = tempfile.mkdtemp()
+    file_contents = {'data/a.txt': 'aaa', 'data/b.txt': 'bbb', 'data/sub/c.txt': 'ccc'}
+    for name, data in file_contents.iteritems():
+        with open(os.path.join(local_dir, os.path.basename(name)), 'w') as f:
+            f.write(data)
+    with tarfile.open(os.path.join(served_dir, 'archive.tar.gz'), 'w:gz') as tar, ZipFile(os.path.join(served_dir, 'archive.zip'), 'w') as zip_file:
+        for name in sorted(file_contents):
+            tar.add(os.path.join(local_dir, os.path.basename(name)), arcname=name)
+            zip_file.write(os.path.join(local_dir, os.path.basename(name)), arcname=name)
+
+    def read_extracted(folder):
+        return {os.path.relpath(os.path.join(root, name), folder): open(os.path.join(root, name)).read()
+            for root, _, names in os.walk(folder) for name in names}
+
+    try:
+        with serve_directory(served_dir) as base_url:
+            for ext in ('.tar.gz', '.zip'):
+                # Extract everything, without keeping the archive
+                folder = get_archive(os.path.join(local_dir, 'full'+ext), url=base_url+'/archive'+ext, keep_archive=False)
+                assert read_extracted(folder) == file_contents
+                assert not os.path.exists(folder+ext)
+
+                # Extract only some members, then ask for more, which are extracted from the kept archive
+                del _RangeRequestHandler.requests[:]
+                folder = get_archive(os.path.join(local_dir, 'partial'+ext), url=base_url+'/archive'+ext, members=['data/a.txt'])
+                assert read_extracted(folder) == {'data/a.txt': 'aaa'}
+                assert os.path.exists(folder+ext)
+                folder = get_archive(os.path.join(local_dir, 'partial'+ext), url=base_url+'/archive'+ext, members=['data/a.txt', 'data/sub'])
+                assert read_extracted(folder) == {'data/a.txt': 'aaa', 'data/sub/c.txt': 'ccc'}
+                assert len(_RangeRequestHandler.requests) == 1
+    finally:
+        shutil.rmtree(served_dir)
+        shutil.rmtree(local_dir)
+
+
+def test_get_file_and_cache():
+
+    served_dir = tempfile.mkdtemp()
+    old_cache_dir, old_max_bytes = file_getter.URL_CACHE_DIR, file_getter.URL_CACHE_MAX_BYTES
+    file_getter.URL_CACHE_DIR = tempfile.mkdtemp()
+    file_getter.URL_CACHE_MAX_BYTES = 1500
+    for i in xrange(3):
+        with open(os.path.join(served_dir, 'file_%s.txt' % (i, )), 'w') as f:
+            f.write(str(i)*1000)
+    try:
+        with serve_directory(served_dir) as base_url:
+            url = base_url+'/file_0.txt'
+            path = get_file_and_cache(url)
+            with open(path) as f:
+                assert f.read() == '0'*1000
+
+            # Unchanged files are revalidated, but not downloaded again
+            del _RangeRequestHandler.requests[:]
+            assert get_file_and_cache(url) == path
+            assert get_file_and_cache(url, max_age=100) == path
+            assert len(_RangeRequestHandler.requests) == 1
+
+            # Changed files are downloaded again
+            with open(os.path.join(served_dir, 'file_0.txt'), 'w') as f:
+                f.write('changed')
+            assert get_file_and_cache(url) == path
+            with open(path) as f:
+                assert f.read() == 'changed'
+            assert [e['url'] for e in get_url_cache_entries()] == [url]
+
+            # Least recently used files are evicted to stay within the budget
+            get_file_and_cache(base_url+'/file_1.txt')
+            get_file_and_cache(url)
+            get_file_and_cache(base_url+'/file_2.txt')
+            assert [e['url'] for e in get_url_cache_entries()] == [base_url+'/file_2.txt', url]
+
+            clear_url_cache(url)
+            assert [e['url'] for e in get_url_cache_entries()] == [base_url+'/file_2.txt']
+            clear_url_cache()
+            assert get_url_cache_entries() == []
+    finally:
+        shutil.rmtree(served_dir)
+        shutil.rmtree(file_getter.URL_CACHE_DIR)
+        file_getter.URL_CACHE_DIR, file_getter.URL_CACHE_MAX_BYTES = old_cache_dir, old_max_bytes
+
+
+def test_use_temp_file():
+
+    served_dir = tempfile.mkdtemp()
+    for name in ('data.txt', 'other.txt'):
+        with open(os.path.join(served_dir, name), 'w') as f:
+            f.write('abc'*100000)
+    try:
+        with serve_directory(served_dir) as base_url:
+            url = base_url+'/data.txt'
+
+            def read(_):
+                with use_temp_file(url) as local_path:
+                    with open(local_path) as f:
+                        return local_path, f.read()
+
+            # Concurrent and repeated loads share one download
+            del _RangeRequestHandler.requests[:]
+            pool = ThreadPool(8)
+            try:
+                results = pool.map(read, range(16))
+            finally:
+                pool.close()
+                pool.join()
+            assert all(r == results[0] for r in results) and results[0][1] == 'abc'*100000
+            assert read(None) == results[0]
+            assert len(_RangeRequestHandler.requests) == 1
+
+            # Expired copies are deleted, but not while they are in use
+            with use_temp_file(base_url+'/other.txt', ttl=0) as local_path:
+                assert os.path.exists(local_path)
+                with use_temp_file(url, ttl=0):
+                    pass
+                assert os.path.exists(local_path)
+            assert not os.path.exists(local_path)
+
+            with raises(Exception):
+                with use_temp_file(base_url+'/does_not_exist.txt'):
+                    pass
+    finally:
+        shutil.rmtree(served_dir)
+
+
 if __name__ == '__main__':
     test_unpack_zip()
     test_unpack_tar_gz()
-
+    test_download_file()
+    test_download_files()
+    test_get_archive()
+    test_get_file_and_cache()
+    test_use_temp_file()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from artemis.fileman.images2gif import writeGif, readGif, OnlineGifWriter, NeuQuant, iterGif, readGifFrame, readGifArray, \
+    getGifLength
+
+
+def _get_training_frames(n_frames = 20, size = (64, 96)):
+    """ Frames like the ones we make when visualizing training: smoothly changing blobs of colour """
+    yy, xx = np.mgrid[:size[0], :size[1]]
+    return [np.dstack([np.sin(xx/10.+t/5.), np.cos(yy/7.-t/3.), np.sin((xx+yy)/13.+t/7.)])*.5+.5 for t in xrange(n_frames)]
+
+
+def test_write_gif_in_parallel():
+
+    directory = tempfile.mkdtemp()
+    frames = _get_training_frames()
+    try:
+        writeGif(os.path.join(directory, 'serial.gif'), frames)
+        writeGif(os.path.join(directory, 'parallel.gif'), frames, nProcesses=2)
+        with open(os.path.join(directory, 'serial.gif'), 'rb') as f1, open(os.path.join(directory, 'parallel.gif'), 'rb') as f2:
+            assert f1.read() == f2.read()
+        loaded = readGif(os.path.join(directory, 'parallel.gif'))
+        assert len(loaded) == len(frames) and loaded[0].shape[:2] == frames[0].shape[:2]
+
+        for n_processes in (1, 2):
+            with OnlineGifWriter(os.path.join(directory, 'online_%s.gif' % (n_processes, )), nProcesses=n_processes) as writer:
+                for frame in frames:
+                    writer.write(frame)
+        with open(os.path.join(directory, 'online_1.gif'), 'rb') as f1, open(os.path.join(directory, 'online_2.gif'), 'rb') as f2:
+            assert f1.read() == f2.read()
+        assert len(readGif(os.path.join(directory, 'online_2.gif'))) == len(frames)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_neuquant():
+    im = Image.fromarray((_get_training_frames(n_frames=1)[0]*255).astype(np.uint8)).convert('RGBA')
+    nq = NeuQuant(im, samplefac=10)
+    quantized = nq.quantize_with_scipy(im)
+    assert quantized.mode == 'P'
+    rgb = np.asarray(im)[:, :, :3].astype(float)
+    sq_dist_with_scipy = ((np.asarray(quantized.convert('RGB'))-rgb)**2).sum(axis=2)
+    sq_dist_without_scipy = ((np.asarray(nq.quantize_without_scipy(im).convert('RGB'))-rgb)**2).sum(axis=2)
+    assert np.array_equal(sq_dist_with_scipy, sq_dist_without_scipy)  # Both find the closest colour (but may break ties differently)
+    assert np.sqrt(sq_dist_with_scipy).mean() < 40
+
+
+def test_read_gif_lazily():
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'anim.gif')
+    try:
+        writeGif(path, _get_training_frames(n_frames=10))
+        frames = readGif(path)
+        assert getGifLength(path) == 10
+        assert all(np.array_equal(f1, f2) for f1, f2 in zip(iterGif(path), frames))
+        assert np.array_equal(readGifFrame(path, 7), frames[7])
+        try:
+            readGifFrame(path, 10)
+            assert False
+        except IndexError:
+            pass
+        arr = readGifArray(path)
+        assert arr.shape == (10, )+frames[0].shape and np.array_equal(arr, np.array(frames))
+        assert np.array_equal(readGifArray(path, frames=slice(1, None, 3)), arr[1::3])
+        out = np.zeros((3, )+frames[0].shape, dtype=np.uint8)
+        result = readGifArray(path, frames=[2, 5, 9], out=out)
+        assert result.base is out or result is out
+        assert np.array_equal(out, arr[[2, 5, 9]])
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchmark_gif_writing(n_frames = 100, size = (128, 128), nq = 0, n_processes_options = (1, 4)):
+    """
+    Print the rate at which we can write frames like those we get when visualizing training.
+    """
+    frames = _get_training_frames(n_frames=n_frames, size=size)
+    directory = tempfile.mkdtemp()
+    try:
+        for n_processes in n_processes_options:
+            start_time = time.time()
+            writeGif(os.path.join(directory, 'anim.gif'), frames, nq=nq, subRectangles=False, nProcesses=n_processes)
+            print 'writeGif with %s processes, nq=%s, %sx%s: %.2f FPS' % (n_processes, nq, size[0], size[1], n_frames/(time.time()-start_time))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_benchmark_gif_writing():
+    benchmark_gif_writing(n_frames=4, size=(32, 32), nq=10, n_processes_options=(1, 2))
+
+
+if __name__ == '__main__':
+    test_write_gif_in_parallel()
+    test_neuquant()
+    test_read_gif_lazily()
+    benchmark_gif_writing(nq=0)
+    benchmark_gif_writing(nq=10)
@@ -1,6 +1,8 @@
 from artemis.fileman.local_dir import get_local_path
 import os
+import pickle
 
+from artemis.fileman import persistent_ordered_dict
 from artemis.fileman.persistent_ordered_dict import PersistentOrderedDict
 
 
@@ -25,5 +27,57 @@ def test_persistent_ordered_dict():
         assert pod.items() == [('a', [1, 2, 3]), ('b', [4, 5, 6]), ('c', [7, 8]), ('e', 11)]
 
 
+def test_persistent_ordered_dict_log():
+
+    file_path = get_local_path('tests/podtest_log.pkl')
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+    with PersistentOrderedDict(file_path) as pod:
+        for i in range(10):
+            pod[i] = [i]*10
+    size = os.path.getsize(file_path)
+    with PersistentOrderedDict(file_path) as pod:
+        pod[3] = 'three'
+        del pod[5]
+    assert size < os.path.getsize(file_path) < 2*size  # Only the changes were appended
+
+    # Simulate a write that was cut off half-way
+    with open(file_path, 'ab') as f:
+        f.write('S' + '\xff'*8)
+    pod = PersistentOrderedDict(file_path)
+    assert pod.keys() == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+    assert pod[3] == 'three' and pod[4] == [4]*10
+    with pod:
+        pod['a'] = 'aaa'
+    assert PersistentOrderedDict(file_path).items() == pod.items()
+
+    # Rewrite the same value many times, and check that the file gets compacted
+    old_min_bytes = persistent_ordered_dict.COMPACTION_MIN_BYTES
+    persistent_ordered_dict.COMPACTION_MIN_BYTES = 5000
+    try:
+        for i in range(100):
+            with PersistentOrderedDict(file_path) as pod:
+                pod['a'] = 'a'*1000
+    finally:
+        persistent_ordered_dict.COMPACTION_MIN_BYTES = old_min_bytes
+    assert os.path.getsize(file_path) < 10000
+    pod = PersistentOrderedDict(file_path)
+    assert pod.keys() == [0, 1, 2, 3, 4, 6, 7, 8, 9, 'a'] and pod['a'] == 'a'*1000 and pod[9] == [9]*10
+
+
+def test_persistent_ordered_dict_reads_old_format():
+
+    file_path = get_local_path('tests/podtest_old.pkl')
+    with open(file_path, 'wb') as f:
+        pickle.dump([('a', 1), ('b', 2)], f, protocol=2)
+    with PersistentOrderedDict(file_path) as pod:
+        assert pod.items() == [('a', 1), ('b', 2)]
+        pod['c'] = 3
+    assert PersistentOrderedDict(file_path).items() == [('a', 1), ('b', 2), ('c', 3)]
+
+
 if __name__ == '__main__':
     test_persistent_ordered_dict()
+    test_persistent_ordered_dict_log()
+    test_persistent_ordered_dict_reads_old_format()
@@ -1,4 +1,9 @@
-from artemis.fileman.smart_io import smart_load, smart_save
+import os
+import shutil
+import tempfile
+import pytest
+from artemis.fileman.smart_io import smart_load, smart_save, register_format, _iter_processed_frames, _collect_frames, \
+    smart_load_images
 import numpy as np
 
 
@@ -14,5 +19,144 @@ def test_smart_image_io(plot = False):
         dbplot(rev_image, 'Simetra', hang=True)
 
 
+def test_array_formats():
+
+    directory = tempfile.mkdtemp()
+    arr = np.random.RandomState(1234).randn(100, 5)
+    try:
+        for ext in ('.pkl', '.pkl.gz', '.pkl.bz2', '.npy', '.npz'):
+            path = smart_save(arr, os.path.join(directory, 'arr'+ext))
+            assert np.array_equal(smart_load(path), arr)
+
+        path = os.path.join(directory, 'arr.npy')
+        mapped = smart_load(path, mmap_mode='r')
+        assert isinstance(mapped, np.memmap) and np.array_equal(mapped[10:20], arr[10:20])
+        sliced = smart_load(path, index=(slice(10, 20), 3))
+        assert not isinstance(sliced, np.memmap) and np.array_equal(sliced, arr[10:20, 3])
+
+        path = smart_save({'a': arr, 'b': arr[:, 0]}, os.path.join(directory, 'arrs.npz'), compressed=True)
+        loaded = smart_load(path)
+        assert sorted(loaded.keys()) == ['a', 'b'] and np.array_equal(loaded['b'], arr[:, 0])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_hdf5_format():
+    pytest.importorskip('h5py')
+    directory = tempfile.mkdtemp()
+    arr = np.random.RandomState(1234).randn(100, 5)
+    try:
+        path = smart_save(arr, os.path.join(directory, 'arr.h5'), chunks=True)
+        assert np.array_equal(smart_load(path), arr)
+        assert np.array_equal(smart_load(path, index=slice(10, 20)), arr[10:20])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_zarr_format():
+    pytest.importorskip('zarr')
+    directory = tempfile.mkdtemp()
+    arr = np.random.RandomState(1234).randn(100, 5)
+    try:
+        path = smart_save(arr, os.path.join(directory, 'arr.zarr'), chunks=(10, 5))
+        assert np.array_equal(smart_load(path), arr)
+        assert np.array_equal(smart_load(path, index=slice(10, 20)), arr[10:20])
+        assert np.array_equal(smart_load(path, lazy=True)[30:40], arr[30:40])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_register_format():
+    directory = tempfile.mkdtemp()
+
+    def save_txt(obj, local_path):
+        with open(local_path, 'w') as f:
+            f.write(obj)
+
+    def load_txt(local_path, upper = False):
+        with open(local_path) as f:
+            txt = f.read()
+        return txt.upper() if upper else txt
+
+    try:
+        register_format('.mytxt', loader=load_txt, saver=save_txt)
+        path = smart_save('abc', os.path.join(directory, 'file.mytxt'))
+        assert smart_load(path) == 'abc'
+        assert smart_load(path, upper=True) == 'ABC'
+        with pytest.raises(Exception):
+            smart_save('abc', os.path.join(directory, 'file.unknownext'))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_video_frame_streaming():
+
+    n_frames_read = [0]
+
+    def frames():
+        for i in xrange(25):
+            n_frames_read[0] += 1
+            frame = np.zeros((40, 60, 3), dtype=np.uint8)
+            frame[5:35, 10:50] = i+10  # Dark edges around the frame
+            yield frame
+
+    processed = list(_iter_processed_frames(frames(), size=(20, 10), cut_edges=True))
+    assert len(processed) == 25 and all(f.shape == (10, 20, 3) for f in processed)
+    assert [f[5, 5, 0] for f in processed] == range(10, 35)
+
+    batches = list(_iter_processed_frames(frames(), batch_size=10))
+    assert [b.shape for b in batches] == [(10, 40, 60, 3), (10, 40, 60, 3), (5, 40, 60, 3)]
+
+    # Stopping early also stops the worker, which only reads a bounded number of frames ahead
+    n_frames_read[0] = 0
+    stream = _iter_processed_frames(frames(), prefetch=2)
+    next(stream)
+    stream.close()
+    assert n_frames_read[0] <= 5
+
+    out = np.zeros((10, 40, 60, 3), dtype=np.uint8)
+    video = _collect_frames(frames(), out=out)
+    assert video.base is out and np.array_equal(video[:, 20, 30, 0], np.arange(10, 20))
+    video = _collect_frames(frames(), n_frames_estimate=7)
+    assert video.shape == (25, 40, 60, 3)
+
+    def bad_frames():
+        yield np.zeros((40, 60, 3), dtype=np.uint8)
+        raise ValueError('Corrupt frame')
+
+    with pytest.raises(ValueError):
+        list(_iter_processed_frames(bad_frames()))
+
+
+def test_smart_load_images():
+    from PIL import Image
+    directory = tempfile.mkdtemp()
+    rng = np.random.RandomState(1234)
+    paths = []
+    try:
+        for i, (shape, ext) in enumerate([((60, 80, 3), '.jpg'), ((30, 50), '.png'), ((100, 70, 3), '.png'), ((400, 600, 3), '.jpg')]):
+            paths.append(os.path.join(directory, 'im%s%s' % (i, ext)))
+            Image.fromarray((rng.rand(*shape)*255).astype(np.uint8)).save(paths[-1])
+
+        images = smart_load_images(paths, size=(20, 10), n_processes=2)
+        assert images.shape == (4, 10, 20, 3) and images.dtype == np.uint8
+        assert np.array_equal(smart_load_images(paths, size=(20, 10), n_processes=1), images)
+        assert np.array_equal(images[1, :, :, 0], images[1, :, :, 1])  # Greyscale images are made RGB
+
+        out = np.zeros((4, 10, 20, 3), dtype=np.uint8)
+        assert smart_load_images(paths, size=(20, 10), draft=False, out=out, n_processes=1) is out
+
+        with pytest.raises(ValueError):
+            smart_load_images(paths, n_processes=1)  # Different sizes, and no size to resize them to
+    finally:
+        shutil.rmtree(directory)
+
+
 if __name__ == '__main__':
-    test_smart_image_io(plot=False)
\ No newline at end of file
+    test_smart_image_io(plot=False)
+    test_array_formats()
+    test_hdf5_format()
+    test_zarr_format()
+    test_register_format()
+    test_video_frame_streaming()
+    test_smart_load_images()
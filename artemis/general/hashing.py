@@ -1,9 +1,18 @@
 import hashlib
 import pickle
+import weakref
 from collections import OrderedDict
 import numpy as np
 
 
+# Immutable arrays (read-only views onto a string, see _is_immutable_array) at least this big are hashed into their
+# own sub-digest, which is then fed to the parent hasher.  This lets us remember their digests, so that hashing the
+# same big array again is free.  All other arrays are fed to the hasher directly.
+LARGE_ARRAY_BYTES = 2**16
+
+_ARRAY_DIGEST_CACHE = {}  # id(array) -> (weakref(array), (data pointer, shape, strides, algorithm), digest)
+
+
 def fixed_hash_eq(obj1, obj2):
     """
     Return True if the objects have equal fixed-hashes.  You can use this instead of the "==" operator when comparing
@@ -17,44 +26,110 @@ def fixed_hash_eq(obj1, obj2):
     return compute_fixed_hash(obj1)==compute_fixed_hash(obj2)
 
 
-def compute_fixed_hash(obj, hasher = None):
+def compute_fixed_hash(obj, hasher = None, algorithm = 'md5', use_cache = True):
     """
     Given an object, return a hash that will always be the same (not just for the lifetime of the
     object, but for all future runs of the program too).
     :param obj: Some nested container of primitives
     :param hasher: (for internal use - note that this is stateful, so calling this function with this argument changes
         the hasher object)
-    :return: A 32-character hexidecimal (0-f) hash code for your object.
+    :param algorithm: The hashing algorithm to use.  'md5' (default) or any other name known to hashlib.  Use 'xxhash'
+        for a much faster, non-cryptographic hash (requires the xxhash package).  Note that hashes computed with
+        different algorithms are not comparable.
+    :param use_cache: Remember the digests of large immutable numpy arrays (by identity), so that hashing the same
+        array again does not require re-reading its data.  Only arrays that can never be modified (read-only views
+        onto a string, e.g. from np.frombuffer) are cached.  This does not affect the hash itself.
+    :return: A 32-character hexidecimal (0-f) hash code for your object.  (16 characters if using xxhash without xxh128
+        support)
     """
     if hasher is None:
-        hasher = hashlib.md5()
-    hasher.update(obj.__class__.__name__)
-    if isinstance(obj, np.ndarray):
-        hasher.update(pickle.dumps(obj.dtype, protocol=2))
-        hasher.update(pickle.dumps(obj.shape, protocol=2))
-        hasher.update(obj.tostring())
-    elif isinstance(obj, (int, str, float, bool)) or (obj is None) or (obj in (int, str, float, bool)):
-        hasher.update(pickle.dumps(obj, protocol=2))
-    elif isinstance(obj, (list, tuple)):
-        hasher.update(str(len(obj)))  # Necessary to distinguish ([a, b], c) from ([a, b, c])
-        for el in obj:
-            compute_fixed_hash(el, hasher=hasher)
-    elif isinstance(obj, dict):
-        hasher.update(str(len(obj)))  # Necessary to distinguish ([a, b], c) from ([a, b, c])
-        keys = obj.keys() if isinstance(obj, OrderedDict) else sorted(obj.keys())
-        for k in keys:
-            compute_fixed_hash(k, hasher=hasher)
-            compute_fixed_hash(obj[k], hasher=hasher)
-    elif isinstance(obj, FixedHashObject):  # See below... allows you to make custom hashables
-        compute_fixed_hash(obj.get_hash_description(), hasher=hash)
-    elif hasattr(obj, 'memo_hashable'):  # Deprecated, just here for back-compatibility
-        compute_fixed_hash(obj.memo_hashable(), hasher=hasher)
-    else:
-        # TODO: Consider whether to pickle by default.  Note that pickle strings are not necessairly the same for identical objects.
-        raise NotImplementedError("Don't have a method for hashing this %s" % (obj, ))
+        hasher = _get_hasher(algorithm)
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        hasher.update(obj.__class__.__name__)
+        if isinstance(obj, np.ndarray):
+            hasher.update(pickle.dumps(obj.dtype, protocol=2))
+            hasher.update(pickle.dumps(obj.shape, protocol=2))
+            if obj.nbytes >= LARGE_ARRAY_BYTES and _is_immutable_array(obj):
+                hasher.update(_get_array_digest(obj, algorithm=algorithm, use_cache=use_cache))
+            else:
+                hasher.update(_get_array_buffer(obj))
+        elif isinstance(obj, (int, str, float, bool)) or (obj is None) or (obj in (int, str, float, bool)):
+            hasher.update(pickle.dumps(obj, protocol=2))
+        elif isinstance(obj, (list, tuple)):
+            hasher.update(str(len(obj)))  # Necessary to distinguish ([a, b], c) from ([a, b, c])
+            stack.extend(reversed(obj))
+        elif isinstance(obj, dict):
+            hasher.update(str(len(obj)))  # Necessary to distinguish ([a, b], c) from ([a, b, c])
+            keys = obj.keys() if isinstance(obj, OrderedDict) else sorted(obj.keys())
+            for k in reversed(keys):
+                stack.append(obj[k])
+                stack.append(k)
+        elif isinstance(obj, FixedHashObject):  # See below... allows you to make custom hashables
+            stack.append(obj.get_hash_description())
+        elif hasattr(obj, 'memo_hashable'):  # Deprecated, just here for back-compatibility
+            stack.append(obj.memo_hashable())
+        else:
+            # TODO: Consider whether to pickle by default.  Note that pickle strings are not necessairly the same for identical objects.
+            raise NotImplementedError("Don't have a method for hashing this %s" % (obj, ))
     return hasher.hexdigest()
 
 
+def clear_fixed_hash_cache():
+    """
+    Forget all remembered array digests.
+    """
+    _ARRAY_DIGEST_CACHE.clear()
+
+
+def _get_hasher(algorithm):
+    if algorithm == 'xxhash':
+        try:
+            import xxhash
+        except ImportError:
+            raise ImportError("Hashing with algorithm='xxhash' requires the xxhash package.  Run: pip install xxhash")
+        return xxhash.xxh128() if hasattr(xxhash, 'xxh128') else xxhash.xxh64()
+    else:
+        return hashlib.new(algorithm)
+
+
+def _get_array_buffer(arr):
+    """
+    Get a buffer onto the array's data (in C-order) without copying it, if possible.
+    """
+    return np.ascontiguousarray(arr)
+
+
+def _is_immutable_array(arr):
+    """
+    An array is immutable if it is a read-only view (possibly through other read-only views) onto a string.  Note that
+    a read-only array that owns its data is NOT immutable, because numpy lets you make it writeable again.
+    """
+    while isinstance(arr, np.ndarray):
+        if arr.flags.writeable:
+            return False
+        arr = arr.base
+    return isinstance(arr, str)
+
+
+def _get_array_digest(arr, algorithm, use_cache):
+    if use_cache:
+        key = id(arr)
+        signature = (arr.ctypes.data, arr.shape, arr.strides, algorithm)
+        if key in _ARRAY_DIGEST_CACHE:
+            ref, cached_signature, digest = _ARRAY_DIGEST_CACHE[key]
+            if ref() is arr and cached_signature == signature:
+                return digest
+        digest = _get_array_digest(arr, algorithm=algorithm, use_cache=False)
+        _ARRAY_DIGEST_CACHE[key] = (weakref.ref(arr, lambda _, key=key: _ARRAY_DIGEST_CACHE.pop(key, None)), signature, digest)
+        return digest
+    else:
+        sub_hasher = _get_hasher(algorithm)
+        sub_hasher.update(_get_array_buffer(arr))
+        return sub_hasher.hexdigest()
+
+
 class FixedHashObject(object):
     """
     Implement this interface to create an object that you can create fixed hashes form.  You can then call
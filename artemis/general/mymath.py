@@ -1,6 +1,6 @@
 from artemis.general.should_be_builtins import memoize, bad_value
 import numpy as np
-from scipy import weave
+from artemis.general.numpy_helpers import numba_jit
 from scipy.stats import norm, mode as sp_mode
 __author__ = 'peter'
 
@@ -130,49 +130,75 @@ def mode(x, axis = None, keepdims = False):
     return mode_x
 
 
-def cummode(x, weights = None, axis = 1):
+def cummode(x, weights = None, axis = 1, implementation = 'numpy'):
     """
     Cumulative mode along an axis.  Ties give priority to the first value to achieve the
     given count.
+
+    :param implementation: 'numpy' (vectorized), or 'numba' (a compiled loop, requires the numba package)
     """
 
     assert x.ndim == 2 and axis == 1, 'Only implemented for a special case!'
     all_values, element_ids = np.unique(x, return_inverse=True)
     n_unique = len(all_values)
     element_ids = element_ids.reshape(x.shape)
-    result = np.zeros(x.shape, dtype = int)
     weighted = weights is not None
     if weighted:
         assert x.shape == weights.shape
-    counts = np.zeros(n_unique, dtype = float if weighted else int)
-    code = """
-    bool weighted = %s;
-    int n_samples = Nelement_ids[0];
-    int n_events = Nelement_ids[1];
-    for (int i=0; i<n_samples; i++){
-        float maxcount = 0;
-        int maxel = -1;
-
-        for (int k=0; k<n_unique; k++)
-            counts[k] = 0;
-
-        for (int j=0; j<n_events; j++){
-            int ix = i*n_events+j;
-            int k = element_ids[ix];
-            counts[k] += weighted ? weights[ix] : 1;
-            if (counts[k] > maxcount){
-                maxcount = counts[k];
-                maxel = k;
-            }
-            result[ix]=maxel;
-        }
-    }
-    """ % ('true' if weighted else 'false')
-    weave.inline(code, ['element_ids', 'result', 'n_unique', 'counts', 'weights'], compiler = 'gcc')
+    if implementation == 'numpy':
+        result = _cummode_ids_numpy(element_ids, n_unique, weights)
+    elif implementation == 'numba':
+        result = np.zeros(x.shape, dtype = int)
+        _cummode_ids_loop(element_ids, np.ones(x.shape) if weights is None else weights.astype(float), n_unique, result)
+    else:
+        raise ValueError("implementation must be 'numpy' or 'numba', not {}".format(implementation))
     mode_values = all_values[result]
     return mode_values
 
 
+def _cummode_ids_numpy(element_ids, n_unique, weights = None):
+    """
+    Find the cumulative mode with a cumulative bincount: Compute the running count of each element at the point where
+    it occurs.  The mode changes whenever this count exceeds all counts so far.
+    """
+    n_samples, n_events = element_ids.shape
+    keys = (np.arange(n_samples)[:, None]*n_unique + element_ids).ravel()  # (sample, element) pairs
+    order = np.argsort(keys, kind='mergesort')  # Stable, so each group stays in order of occurrence
+    sorted_keys = keys[order]
+    sorted_weights = np.ones(len(keys), dtype=int) if weights is None else weights.ravel()[order]
+    cum_weights = np.cumsum(sorted_weights)
+    group_starts = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]]) if len(keys) > 0 else np.zeros(0, dtype=bool)
+    offsets = (cum_weights - sorted_weights)[group_starts]  # Total weight before the start of each group
+    counts = np.empty_like(cum_weights)
+    counts[order] = cum_weights - np.repeat(offsets, np.diff(np.append(np.flatnonzero(group_starts), len(keys))))
+    counts = counts.reshape(element_ids.shape)  # Count of element_ids[i, j] in element_ids[i, :j+1]
+
+    max_counts_before = np.maximum.accumulate(np.concatenate([np.zeros((n_samples, 1), dtype=counts.dtype), counts[:, :-1]], axis=1), axis=1)
+    is_new_mode = counts > max_counts_before
+    mode_ixs = np.maximum.accumulate(np.where(is_new_mode, np.arange(n_events), -1), axis=1)
+    result = element_ids[np.arange(n_samples)[:, None], mode_ixs]
+    result[mode_ixs < 0] = -1  # (As in the loop, no mode is found until some count is positive)
+    return result
+
+
+@numba_jit
+def _cummode_ids_loop(element_ids, weights, n_unique, result):
+    n_samples, n_events = element_ids.shape
+    counts = np.zeros(n_unique)
+    for i in range(n_samples):
+        maxcount = 0.
+        maxel = -1
+        for k in range(n_unique):
+            counts[k] = 0
+        for j in range(n_events):
+            k = element_ids[i, j]
+            counts[k] += weights[i, j]
+            if counts[k] > maxcount:
+                maxcount = counts[k]
+                maxel = k
+            result[i, j] = maxel
+
+
 def angle_between(a, b, axis=None, in_degrees = False):
     """
     Return the angle between two vectors a and b, in radians.  Raise an exception if one is a zero vector
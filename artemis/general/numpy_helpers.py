@@ -19,3 +19,26 @@ def get_rng(initializer):
         return np.random.RandomState(initializer)
     elif isinstance(initializer, RandomState):
         return initializer
+
+
+def numba_jit(fcn):
+    """
+    Decorator that compiles a function (written as plain loops over numpy arrays) with numba, in nopython mode.  The
+    compilation happens on the first call, so the numba package is only needed if you actually call the function.  The
+    undecorated function is available as the .py_func attribute, so it can also run (slowly) as plain python.
+    """
+    compiled = []
+
+    def compiled_fcn(*args):
+        if len(compiled) == 0:
+            try:
+                import numba
+            except ImportError:
+                raise ImportError('{} requires the numba package.  Run: pip install numba'.format(fcn.__name__))
+            compiled.append(numba.njit(fcn))
+        return compiled[0](*args)
+
+    compiled_fcn.py_func = fcn
+    compiled_fcn.__name__ = fcn.__name__
+    compiled_fcn.__doc__ = fcn.__doc__
+    return compiled_fcn
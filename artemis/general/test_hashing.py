@@ -1,5 +1,6 @@
-from artemis.general.hashing import compute_fixed_hash
+from artemis.general.hashing import compute_fixed_hash, clear_fixed_hash_cache
 import numpy as np
+import pytest
 
 
 def test_compute_fixed_hash():
@@ -11,5 +12,54 @@ def test_compute_fixed_hash():
     assert compute_fixed_hash(complex_obj) == '285f0ff77c0cb6a5fc529ae55775f9dd'
 
 
+def test_fixed_hash_of_large_arrays():
+    clear_fixed_hash_cache()
+    arr = np.random.RandomState(1234).randn(200, 300)
+    h1 = compute_fixed_hash([1, arr])
+    assert compute_fixed_hash([1, np.asfortranarray(arr)]) == h1  # Memory layout does not matter
+    arr.flags.writeable = False
+    assert compute_fixed_hash([1, arr]) == h1
+    arr.flags.writeable = True  # An array that owns its data can be made writeable again, so we must not cache it
+    arr[4, 5] = 0
+    arr.flags.writeable = False
+    h2 = compute_fixed_hash([1, arr])
+    assert h2 != h1
+    assert h2 == compute_fixed_hash([1, arr], use_cache=False)
+
+
+def test_fixed_hash_cache_for_immutable_arrays():
+    clear_fixed_hash_cache()
+    data = np.random.RandomState(1234).randn(200, 300)
+    arr = np.frombuffer(data.tostring(), dtype=data.dtype).reshape(data.shape)  # Read-only view onto a string
+    h1 = compute_fixed_hash([1, arr])
+    assert compute_fixed_hash([1, arr]) == h1  # Now from the cache
+    assert compute_fixed_hash([1, arr], use_cache=False) == h1
+    assert compute_fixed_hash([1, arr[:100]]) != h1
+    data[4, 5] = 0
+    arr2 = np.frombuffer(data.tostring(), dtype=data.dtype).reshape(data.shape)
+    assert compute_fixed_hash([1, arr2]) != h1
+
+
+def test_fixed_hash_deep_nesting():
+    obj = []
+    for _ in xrange(5000):  # Would exceed the recursion limit with a recursive implementation
+        obj = [obj]
+    assert len(compute_fixed_hash(obj)) == 32
+
+
+def test_fast_fixed_hash():
+    pytest.importorskip('xxhash')
+    complex_obj = [1, 'd', {'a': 4, 'b': np.arange(10)}, (7, range(10))]
+    h = compute_fixed_hash(complex_obj, algorithm='xxhash')
+    assert h != compute_fixed_hash(complex_obj)
+    assert h == compute_fixed_hash(complex_obj, algorithm='xxhash')
+    complex_obj[2]['b'][6]=0
+    assert h != compute_fixed_hash(complex_obj, algorithm='xxhash')
+
+
 if __name__ == '__main__':
     test_compute_fixed_hash()
+    test_fixed_hash_of_large_arrays()
+    test_fixed_hash_cache_for_immutable_arrays()
+    test_fixed_hash_deep_nesting()
+    test_fast_fixed_hash()
@@ -1,5 +1,6 @@
 from artemis.general.mymath import softmax, cummean, cumvar, sigm, expected_sigm_of_norm, mode, cummode, normalize, is_parallel, \
     align_curves, angle_between
+import time
 import numpy as np
 __author__ = 'peter'
 
@@ -101,6 +102,46 @@ def test_cummode_weighted():
             assert np.all(weights_of_mode_class >= weights_of_this_class)
 
 
+def test_cummode_matches_loop():
+    """ The vectorized cummode should give exactly the same results as the loop (which replaces the old weave code). """
+    from artemis.general.mymath import _cummode_ids_numpy, _cummode_ids_loop
+    rng = np.random.RandomState(1234)
+    for n_unique in (1, 3, 10):
+        arr = rng.randint(low=0, high=n_unique, size=(20, 50))
+        for weights in (None, rng.randint(-1, 4, size=arr.shape).astype(float), rng.rand(*arr.shape)):
+            _, element_ids = np.unique(arr, return_inverse=True)
+            element_ids = element_ids.reshape(arr.shape)
+            expected = np.zeros(arr.shape, dtype=int)
+            _cummode_ids_loop.py_func(element_ids, np.ones(arr.shape) if weights is None else weights, n_unique, expected)
+            assert np.array_equal(_cummode_ids_numpy(element_ids, n_unique, weights), expected)
+    assert cummode(np.zeros((0, 5)), axis=1).shape == (0, 5)
+
+
+def benchmark_cummode(n_samples = 100, n_events = 1000, n_unique = 10):
+    """
+    Compare the vectorized cummode with the pure-python version of the loop (and the compiled loop, if numba is installed).
+    """
+    from artemis.general.mymath import _cummode_ids_loop
+    arr = np.random.randint(low=0, high=n_unique, size=(n_samples, n_events))
+    start_time = time.time()
+    cummode(arr, axis=1)
+    print 'numpy cummode of %s x %s: %.3g ms' % (n_samples, n_events, 1000*(time.time()-start_time))
+    start_time = time.time()
+    _cummode_ids_loop.py_func(np.unique(arr, return_inverse=True)[1].reshape(arr.shape), np.ones(arr.shape), n_unique, np.zeros(arr.shape, dtype=int))
+    print 'python-loop cummode of %s x %s: %.3g ms' % (n_samples, n_events, 1000*(time.time()-start_time))
+    try:
+        cummode(arr, axis=1, implementation='numba')  # Compile
+    except ImportError:
+        return
+    start_time = time.time()
+    cummode(arr, axis=1, implementation='numba')
+    print 'numba cummode of %s x %s: %.3g ms' % (n_samples, n_events, 1000*(time.time()-start_time))
+
+
+def test_benchmark_cummode():
+    benchmark_cummode(n_samples=10, n_events=100)
+
+
 def test_normalize():
 
     # L1 - positive values
@@ -179,6 +220,8 @@ if __name__ == '__main__':
     test_align_curves()
     test_is_parallel()
     test_normalize()
+    test_cummode_matches_loop()
+    benchmark_cummode()
     test_cummode_weighted()
     test_cummode()
     test_mode()
@@ -21,15 +21,14 @@ def get_cifar_10_dataset(n_training_samples = None, n_test_samples = None, norma
         Images are 32x32 uint8 RGB images (n_samples, 3, 32, 32) of 10 categories of objects.
         Targets are integer labels in the range [0, 9]
     """
-    # TODO: Make method for downloading/unpacking data (from http://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz)
-    # We have this for single files already, but in this case the gz contains a folder with the files in it.
-
-    directory = get_archive(relative_path='data/cifar-10', url = 'http://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz')
-
     n_batches_to_read = 5 if n_training_samples is None else int(np.ceil(n_training_samples/10000.))
+    batch_names = [os.path.join('cifar-10-batches-py', 'data_batch_%s' % (i, )) for i in xrange(1, n_batches_to_read+1)] \
+        + [os.path.join('cifar-10-batches-py', 'test_batch')]
+
+    # Only the batches we need are extracted from the archive.
+    directory = get_archive(relative_path='data/cifar-10', url = 'http://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz', members=batch_names)
 
-    file_paths = [get_file(os.path.join(directory, 'cifar-10-batches-py', 'data_batch_%s' % (i, ))) for i in xrange(1, n_batches_to_read+1)] \
-        + [get_file(os.path.join(directory, 'cifar-10-batches-py', 'test_batch'))]
+    file_paths = [get_file(os.path.join(directory, name)) for name in batch_names]
 
     data = []
     for file_path in file_paths:
@@ -6,7 +6,7 @@ import os
 __author__ = 'peter'
 
 
-def load_ilsvrc_video(identifier, size = None, resize_mode='scale_crop', cut_edges=True, cut_edges_thresh=5):
+def load_ilsvrc_video(identifier, size = None, resize_mode='scale_crop', cut_edges=True, cut_edges_thresh=5, every = 1, max_frames = None):
     """
     Load a file from the ILSVRC Dataset.  The first time this is run, it will download an 8GB file, so be patient.
 
@@ -18,12 +18,31 @@ def load_ilsvrc_video(identifier, size = None, resize_mode='scale_crop', cut_edg
     :param size:
     :param cut_edges:
     :param cut_edges_thresh:
-    :return:
+    :param every: Only keep every n'th frame.
+    :param max_frames: Only read (up to) this many frames (after skipping).
+    :return: A (n_frames, height, width, 3) array.  (To stream the frames instead, use smart_iter_video on the path
+        returned by get_ilsvrc_video_path.)
     """
 
+    full_path = get_ilsvrc_video_path(identifier)
+    print 'Loading %s' % (identifier, )
+    video = smart_load_video(full_path, size=size, cut_edges=cut_edges, resize_mode=resize_mode, cut_edges_thresh=cut_edges_thresh,
+        every=every, max_frames=max_frames)
+    print 'Done.'
+    return video
+
+
+def get_ilsvrc_video_path(identifier):
+    """
+    Get the local path to a video from the ILSVRC Dataset, downloading the dataset if necessary.
+
+    :param identifier: The file-name of the video, not including the extension.  Eg: 'ILSVRC2015_train_00249001'
+    :return: The full path to the .mp4 file.
+    """
     archive_folder_path = get_archive(
         relative_path='data/ILSVRC2015',
-        url='http://vision.cs.unc.edu/ilsvrc2015/ILSVRC2015_VID_snippets_final.tar.gz'
+        url='http://vision.cs.unc.edu/ilsvrc2015/ILSVRC2015_VID_snippets_final.tar.gz',
+        keep_archive=False,  # The archive is extracted as it downloads, so we do not need to keep another 8GB around.
         )
     subpath = \
         'ILSVRC2015/Data/VID/snippets/test' if 'test' in identifier else \
@@ -33,15 +52,11 @@ def load_ilsvrc_video(identifier, size = None, resize_mode='scale_crop', cut_edg
         'ILSVRC2015/Data/VID/snippets/train/ILSVRC2015_VID_train_0003/' if os.path.exists(os.path.join(archive_folder_path, 'ILSVRC2015/Data/VID/snippets/train/ILSVRC2015_VID_train_0003/', identifier + '.mp4')) else \
         bad_value(identifier, 'Could not find identifier: {}'.format(identifier, ))
 
-    print 'Loading %s' % (identifier, )
-    full_path = get_file_in_archive(
+    return get_file_in_archive(
         relative_path='data/ILSVRC2015',
         subpath=os.path.join(subpath, identifier+'.mp4'),
         url='http://vision.cs.unc.edu/ilsvrc2015/ILSVRC2015_VID_snippets_final.tar.gz'
         )
-    video = smart_load_video(full_path, size=size, cut_edges=cut_edges, resize_mode=resize_mode, cut_edges_thresh=cut_edges_thresh)
-    print 'Done.'
-    return video
 
 
 if __name__ == '__main__':
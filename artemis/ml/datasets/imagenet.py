@@ -1,6 +1,6 @@
 from itertools import izip
-from artemis.fileman.file_getter import get_file, unzip_gz
-from artemis.fileman.smart_io import smart_load
+from artemis.fileman.file_getter import get_file, get_files, unzip_gz
+from artemis.fileman.smart_io import smart_load, smart_load_images
 import numpy as np
 import os
 __author__ = 'peter'
@@ -27,16 +27,21 @@ def get_imagenet_fall11_urls(n_images = None):
     return pairs
 
 
-def get_imagenet_images(indices):
+def get_imagenet_images(indices, size = None):
     """
     Get imagenet images at the given indices
     :param indices:
-    :return:
+    :param size: Optionally, a (width, height) to resize the images to.  (see smart_load_images)
+    :return: A list of images, or, if size is given, a (n_images, height, width, 3) uint8 array, whose images are
+        decoded and resized in parallel.
     """
     highest_index = np.max(indices)
     code_url_pairs = get_imagenet_fall11_urls(highest_index+1)
-    files = [get_file('data/imagenet/%s%s' % (code_url_pairs[index][0], os.path.splitext(code_url_pairs[index][1])[1]), code_url_pairs[index][1]) for index in indices]
-    return [smart_load(f) for f in files]
+    files = get_files(
+        relative_names = ['data/imagenet/%s%s' % (code_url_pairs[index][0], os.path.splitext(code_url_pairs[index][1])[1]) for index in indices],
+        urls = [code_url_pairs[index][1] for index in indices]
+        )
+    return [smart_load(f) for f in files] if size is None else smart_load_images(files, size=size)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,3 @@
-from artemis.general.should_be_builtins import memoize
 import numpy as np
 
 
@@ -34,49 +33,68 @@ def put_vector_in_grid(vec, shape = None):
     return grid
 
 
-@memoize
-def _data_shape_and_boundary_width_to_grid_slices(shape, grid_shape, boundary_width, is_colour = None):
-
+def _get_grid_layout(shape, grid_shape = None, is_colour = None):
+    """
+    :return: is_vector, (size_y, size_x), (n_rows, n_cols): Whether the data is a vector of images (as opposed to a
+        grid of images), the size of each image, and the number of rows and columns in the grid.
+    """
     assert len(shape) in (3, 4) or len(shape)==5 and shape[-1]==3
     if is_colour is None:
         is_colour = shape[-1]==3
     size_y, size_x = (shape[-3], shape[-2]) if is_colour else (shape[-2], shape[-1])
     is_vector = (len(shape)==4 and is_colour) or (len(shape)==3 and not is_colour)
-
     if grid_shape is None:
         grid_shape = vector_length_to_tile_dims(shape[0]) if is_vector else shape[:2]
-    n_rows, n_cols = grid_shape
-
-    output_shape = n_rows*(size_y+boundary_width)+1, n_cols*(size_x+boundary_width)+1
-    index_pairs = []
-    for i in xrange(n_rows):
-        for j in xrange(n_cols):
-            if is_vector:
-                pull_indices = (i*n_cols + j, )
-                if pull_indices[0] == shape[0]:
-                    break
-            else:
-                pull_indices = (i, j)
-            start_row, start_col = i*(size_y+1)+1, j*(size_x+1)+1
-            push_indices = slice(start_row, start_row+size_y), slice(start_col, start_col+size_x)
-            index_pairs.append((pull_indices, push_indices))
-    return output_shape, index_pairs
+    return is_vector, (size_y, size_x), tuple(grid_shape)
+
+
+def get_grid_image_shape(data_shape, grid_shape = None, boundary_width = 1, is_color_data = None):
+    """
+    :return: The shape of the image that put_data_in_grid would return for data of the given shape (e.g. to preallocate
+        its output).
+    """
+    _, (size_y, size_x), (n_rows, n_cols) = _get_grid_layout(data_shape, grid_shape, is_colour=is_color_data)
+    return n_rows*(size_y+boundary_width)+boundary_width, n_cols*(size_x+boundary_width)+boundary_width, 3
 
 
 def put_data_in_grid(data, grid_shape = None, fill_colour = np.array((0, 0, 128), dtype = 'uint8'), cmap = 'gray',
-        boundary_width = 1, clims = None, is_color_data=None, nan_colour=None):
+        boundary_width = 1, clims = None, is_color_data=None, nan_colour=None, out = None):
     """
     Given a 3-d or 4-D array, put it in a 2-d grid.
     :param data: A 4-D array of any data type
+    :param out: Optionally, a uint8 array of shape get_grid_image_shape(data.shape, ...) to write the grid into, instead
+        of allocating a new one.  (e.g. pass the output of the previous call when plotting the same data repeatedly)
     :return: A 3-D uint8 array of shape (n_rows, n_cols, 3)
     """
-    output_shape, slice_pairs = _data_shape_and_boundary_width_to_grid_slices(data.shape, grid_shape, boundary_width, is_colour=is_color_data)
-    output_data = np.empty(output_shape+(3, ), dtype='uint8')
-    output_data[..., :] = fill_colour  # Maybe more efficient just to set the spaces.
-    scaled_data = data_to_image(data, clims = clims, cmap = cmap, is_color_data=is_color_data, nan_colour=nan_colour)
-    for pull_slice, push_slice in slice_pairs:
-        output_data[push_slice] = scaled_data[pull_slice]
-    return output_data
+    output_shape = get_grid_image_shape(data.shape, grid_shape, boundary_width=boundary_width, is_color_data=is_color_data)
+    if out is None:
+        out = np.empty(output_shape, dtype='uint8')
+    else:
+        assert out.shape == output_shape and out.dtype == np.uint8, "out must be a uint8 array of shape {}.  Got a {} array of shape {}".format(output_shape, out.dtype, out.shape)
+    if clims is None:  # Compute the range here, because the tiles are converted to colours in parts
+        clims = (np.nanmin(data), np.nanmax(data)) if data.size != 0 else (0, 1)
+    is_vector, (size_y, size_x), (n_rows, n_cols) = _get_grid_layout(data.shape, grid_shape, is_colour=is_color_data)
+
+    # View the output (without the top and left boundaries) as (n_rows, size_y+boundary_width, n_cols, size_x+boundary_width, 3)
+    # blocks, each of which is an image followed by its bottom and right boundaries.
+    blocks = out[boundary_width:, boundary_width:].reshape(n_rows, size_y+boundary_width, n_cols, size_x+boundary_width, 3)
+    out[:boundary_width] = fill_colour
+    out[:, :boundary_width] = fill_colour
+    blocks[:, size_y:] = fill_colour
+    blocks[:, :, :, size_x:] = fill_colour
+    tiles = blocks[:, :size_y, :, :size_x].transpose(0, 2, 1, 3, 4)  # (n_rows, n_cols, size_y, size_x, 3)
+    image_kwargs = dict(clims = clims, cmap = cmap, is_color_data=is_color_data, nan_colour=nan_colour)
+    if is_vector:
+        n_tiles = min(len(data), n_rows*n_cols)
+        n_full_rows, n_remaining = divmod(n_tiles, n_cols)
+        data_to_image(data[:n_full_rows*n_cols].reshape((n_full_rows, n_cols)+data.shape[1:]), out=tiles[:n_full_rows], **image_kwargs)
+        if n_full_rows < n_rows:
+            data_to_image(data[n_full_rows*n_cols:n_tiles], out=tiles[n_full_rows, :n_remaining], **image_kwargs)
+            tiles[n_full_rows, n_remaining:] = fill_colour
+            tiles[n_full_rows+1:] = fill_colour
+    else:
+        data_to_image(data[:n_rows, :n_cols], out=tiles, **image_kwargs)
+    return out
 
 
 def put_list_of_images_in_array(list_of_images, fill_colour = np.array((0, 0, 0))):
@@ -154,20 +172,35 @@ def scale_data_to_range(data, in_range = None, out_range = (0, 1), clip_to_range
         return out
 
 
-mappables = {}
+_COLOURMAP_LUTS = {}  # cmap -> (n_colours, 3) uint8 array of the colours of the colourmap
+
+
+def _get_colourmap_lut(cmap):
+    """
+    :param cmap: The name of a matplotlib colourmap, or a Colormap object
+    :return: A (n_colours, 3) uint8 array of the RGB colours of the colourmap (usually n_colours is 256)
+    """
+    if cmap not in _COLOURMAP_LUTS:
+        import matplotlib.cm as cm
+        colourmap = cm.get_cmap(cmap)
+        _COLOURMAP_LUTS[cmap] = np.round(colourmap(np.arange(colourmap.N))[:, :3]*255).astype(np.uint8)
+    return _COLOURMAP_LUTS[cmap]
 
 
-def data_to_image(data, is_color_data = None, clims = None, cmap = 'gray', nan_colour=None):
-    import matplotlib.cm as cm
-    from matplotlib.colors import Normalize
+def data_to_image(data, is_color_data = None, clims = None, cmap = 'gray', nan_colour=None, out = None):
     """
     Convert and ndarray of data into RGB pixel data.
 
+    The colourmap is applied by quantizing the data to the colours of the colourmap (usually 256), and looking them up
+    in a table (which is computed once per colourmap).
+
     :param data: An ndarray of data.
     :param is_color_data: A boolean indicating whether this is colour data already.  If not specified we guess.
     :param clims: The range of values that the colour scale should cover.  Values outside this range will be
         clipped to fall in the range.  If None, calculate range from the data.
     :param cmap: Colormap - Use any of the names in matplotlib - eg ('gray', 'jet', 'Paired', 'cubehelix')
+    :param nan_colour: The colour of NaN pixels (default: black)
+    :param out: Optionally, a uint8 array (of the shape of the output) to write into, instead of allocating a new one.
     :return: An ndarray of unt8 colour data.  Shape is: data.shape if is_color_data else data.shape+(3, )
     """
 
@@ -176,51 +209,87 @@ def data_to_image(data, is_color_data = None, clims = None, cmap = 'gray', nan_c
     if is_color_data:
         assert data.shape[-1] == 3, 'If data is specified as being colour data, the final axis must have length 3.'
 
+    output_shape = data.shape if is_color_data else data.shape+(3, )
+    if out is None:
+        out = np.empty(output_shape, dtype=np.uint8)
+    else:
+        assert out.shape == output_shape and out.dtype == np.uint8, "out must be a uint8 array of shape {}.  Got a {} array of shape {}".format(output_shape, out.dtype, out.shape)
+    if data.size == 0:
+        return out
+
     if not is_color_data:
         # Need to apply the cmap.
-        if cmap == 'gray':
-            # For speed, we handle this separately
-            scaled_data = scale_data_to_8_bit(data, in_range=clims)
-            scaled_data = np.concatenate([scaled_data[..., None]]*3, axis = scaled_data.ndim)
+        lut = _get_colourmap_lut(cmap)
+        smin, smax = (np.nanmin(data), np.nanmax(data)) if clims is None else clims
+        if smin == smax or np.isnan(smin) or np.isnan(smax):  # Data is all nans, or min==max
+            smin, smax = (0, 1) if np.isnan(smin) or np.isnan(smax) else (smin, smin+1.)
+        levels = np.subtract(data, smin, dtype=float)
+        levels *= len(lut)/float(smax-smin)
+        np.clip(levels, 0, len(lut)-1, out=levels)
+        if cmap == 'gray':  # For speed, we handle this separately: The colour of each level is just (level, level, level)
+            grey_levels = levels.astype(np.uint8)[..., None]
+            np.concatenate([grey_levels]*3, axis=-1, out=out)
         else:
-            if (clims, cmap) not in mappables:
-                mappables[clims, cmap] = cm.ScalarMappable(cmap = cmap, norm = None if clims is None else Normalize(vmin=clims[0], vmax=clims[1]))
-            cmap = mappables[clims, cmap]
-            old_dim = data.shape
-            if len(old_dim)>2:
-                data = data.reshape((data.shape[0], -1))
-            rgba = cmap.to_rgba(data)
-            if len(old_dim)>2:
-                rgba = rgba.reshape(old_dim+(4, ))
-            scaled_data = (rgba[..., :-1]*255)
+            np.take(lut, levels.astype(np.intp), axis=0, out=out, mode='clip')  # (NaNs become garbage indices, clipped to 0)
     else:
-        scaled_data = scale_data_to_8_bit(data, in_range=clims).astype(np.uint8)
+        out[...] = scale_data_to_8_bit(data, in_range=clims)
 
-    if nan_colour is not None:
-        scaled_data = np.where(np.any(np.isnan(data if is_color_data else data[..., None]), axis=-1)[..., None], np.array(nan_colour, dtype=np.uint8), scaled_data)
+    if data.dtype.kind == 'f':
+        nan_mask = np.isnan(data).any(axis=-1) if is_color_data else np.isnan(data)
+        if nan_mask.any():
+            out[nan_mask] = nan_colour if nan_colour is not None else 0
 
-    return scaled_data
+    return out
 
 
 class RecordBuffer(object):
+    """
+    A fixed-length buffer of the most recent samples.  Each sample is stored twice, in a backing array of twice the
+    buffer length, so that the last buffer_len samples are always a contiguous slice.  This means that each update
+    returns a view (rather than a copy) of the buffer.  Note that this view is only valid until the next update, so
+    copy it if you need to keep it.
+    """
 
     def __init__(self, buffer_len, initial_value = np.NaN):
         self._buffer_len = buffer_len
         self._buffer = None
-        self._ix = 0
-        self._base_indices = np.arange(buffer_len)
+        self._ix = 0  # Index of the oldest sample
         self._initial_value = initial_value
 
+    def _initialize(self, data):
+        shape = () if np.isscalar(data) else data.shape
+        dtype_data = data+self._initial_value
+        dtype = dtype_data.dtype if isinstance(dtype_data, np.ndarray) else type(dtype_data) if isinstance(dtype_data, (int, float, bool)) else object
+        self._buffer = np.empty((2*self._buffer_len, )+shape, dtype = dtype)
+        self._buffer[:] = self._initial_value
+
     def __call__(self, data):
+        """
+        :param data: A new sample
+        :return: An array of the last buffer_len samples, oldest first.
+        """
         if self._buffer is None:
-            shape = () if np.isscalar(data) else data.shape
-            dtype_data = data+self._initial_value
-            dtype = dtype_data.dtype if isinstance(dtype_data, np.ndarray) else type(dtype_data) if isinstance(dtype_data, (int, float, bool)) else object
-            self._buffer = np.empty((self._buffer_len, )+shape, dtype = dtype)
-            self._buffer[:] = self._initial_value
+            self._initialize(data)
         self._buffer[self._ix] = data
+        self._buffer[self._ix+self._buffer_len] = data
         self._ix = (self._ix+1) % self._buffer_len
-        return self._buffer[(self._base_indices+self._ix) % self._buffer_len]
+        return self._buffer[self._ix:self._ix+self._buffer_len]
+
+    def extend(self, samples):
+        """
+        Add many samples at once.  This is equivalent to calling the buffer on each sample, but faster.
+        :param samples: An array of shape (n_samples, )+sample_shape
+        :return: An array of the last buffer_len samples, oldest first.
+        """
+        assert len(samples) > 0, "Can't extend by zero samples"
+        if self._buffer is None:
+            self._initialize(samples[0])
+        samples = samples[-self._buffer_len:]
+        ixs = (self._ix + np.arange(len(samples))) % self._buffer_len
+        self._buffer[ixs] = samples
+        self._buffer[ixs+self._buffer_len] = samples
+        self._ix = (self._ix+len(samples)) % self._buffer_len
+        return self._buffer[self._ix:self._ix+self._buffer_len]
 
 
 class UnlimitedRecordBuffer(object):
@@ -232,15 +301,113 @@ class UnlimitedRecordBuffer(object):
         self.expansion_factor = expansion_factor
 
     def __call__(self, data):
+        data = np.asarray(data)
+        if len(self._buffer)==0:
+            self._buffer = np.empty((self.initial_size, )+data.shape, dtype=data.dtype)
+        elif not np.can_cast(data.dtype, self._buffer.dtype):
+            self._buffer = self._buffer.astype(np.promote_types(data.dtype, self._buffer.dtype))
         if self._index==len(self._buffer):
-            data_shape = data.shape if isinstance(data, np.ndarray) else ()
-            if len(self._buffer)==0:
-                self._buffer = np.empty((self.initial_size, )+data_shape)
-            else:
-                new_buffer = np.empty((int(len(self._buffer)*self.expansion_factor), )+data_shape)
-                new_buffer[:self._index] = self._buffer
-                self._buffer = new_buffer
+            new_buffer = np.empty((int(len(self._buffer)*self.expansion_factor), )+data.shape, dtype=self._buffer.dtype)
+            new_buffer[:self._index] = self._buffer
+            self._buffer = new_buffer
         self._buffer[self._index] = data
         self._index += 1
         return self._buffer[:self._index]
 
+
+class DownsamplingRecordBuffer(object):
+    """
+    An unlimited history buffer whose memory only grows logarithmically with the number of samples.  The most recent
+    samples are kept at full resolution, and older ones at progressively lower resolutions: Level k of the buffer holds
+    blocks of 2**k samples, and keeps the min and max of each block.  When a level has 2*resolution blocks, its oldest
+    resolution blocks are merged in pairs and moved to the next level.  The dtype of the data is preserved.
+    """
+
+    def __init__(self, resolution = 1024):
+        """
+        :param resolution: Number of blocks to keep at each level (at least, and at most twice this number).
+        """
+        assert resolution % 2 == 0, 'resolution must be even'
+        self.resolution = resolution
+        self._levels = []  # A list of _MinMaxLevel, finest first
+        self.n_samples = 0
+
+    def __call__(self, data):
+        """
+        Add a sample.
+        :return: The (x, y) data, see get_data
+        """
+        self.append(data)
+        return self.get_data()
+
+    def append(self, data):
+        data = np.asarray(data)
+        self.extend(data[None])
+
+    def extend(self, samples):
+        """
+        :param samples: An array of shape (n_samples, )+sample_shape
+        """
+        samples = np.asarray(samples)
+        if len(self._levels)==0:
+            self._levels.append(_MinMaxLevel(2*self.resolution, samples.shape[1:], samples.dtype))
+        elif not np.can_cast(samples.dtype, self._levels[0].mins.dtype):
+            dtype = np.promote_types(samples.dtype, self._levels[0].mins.dtype)
+            for level in self._levels:
+                level.mins, level.maxs = level.mins.astype(dtype), level.maxs.astype(dtype)
+        starts = self.n_samples + np.arange(len(samples))
+        self.n_samples += len(samples)
+        self._add_to_level(0, starts, samples, samples)
+
+    def _add_to_level(self, k, starts, mins, maxs):
+        capacity = 2*self.resolution
+        level = self._levels[k]
+        i = 0
+        while i < len(starts):
+            n = min(len(starts)-i, capacity-level.count)
+            level.starts[level.count:level.count+n] = starts[i:i+n]
+            level.mins[level.count:level.count+n] = mins[i:i+n]
+            level.maxs[level.count:level.count+n] = maxs[i:i+n]
+            level.count += n
+            i += n
+            if level.count == capacity:  # Merge the oldest half into the next level
+                r = self.resolution
+                merged = (level.starts[0:r:2].copy(), np.fmin(level.mins[0:r:2], level.mins[1:r:2]), np.fmax(level.maxs[0:r:2], level.maxs[1:r:2]))
+                level.starts[:r] = level.starts[r:]
+                level.mins[:r] = level.mins[r:]
+                level.maxs[:r] = level.maxs[r:]
+                level.count = r
+                if k+1 == len(self._levels):
+                    self._levels.append(_MinMaxLevel(capacity, level.mins.shape[1:], level.mins.dtype))
+                self._add_to_level(k+1, *merged)
+
+    def get_data(self):
+        """
+        :return: (x, y), where x is a vector of sample indices and y is an array of shape (n_points, )+sample_shape,
+            oldest first.  For downsampled blocks, there are two points at the centre of the block: the min and the max.
+        """
+        if len(self._levels)==0:
+            return np.empty(0), np.empty(0)
+        xs, ys = [], []
+        for k in reversed(range(len(self._levels))):
+            level = self._levels[k]
+            c = level.count
+            if k == 0:
+                xs.append(level.starts[:c].astype(float))
+                ys.append(level.mins[:c])
+            else:
+                xs.append(np.repeat(level.starts[:c] + (2**k-1)/2., 2))
+                y = np.empty((2*c, )+level.mins.shape[1:], dtype=level.mins.dtype)
+                y[0::2] = level.mins[:c]
+                y[1::2] = level.maxs[:c]
+                ys.append(y)
+        return np.concatenate(xs), np.concatenate(ys)
+
+
+class _MinMaxLevel(object):
+
+    def __init__(self, capacity, sample_shape, dtype):
+        self.starts = np.empty(capacity, dtype=np.int64)  # Index of the first sample in each block
+        self.mins = np.empty((capacity, )+sample_shape, dtype=dtype)
+        self.maxs = np.empty((capacity, )+sample_shape, dtype=dtype)
+        self.count = 0
@@ -4,13 +4,14 @@ from artemis.plotting.matplotlib_backend import BarPlot
 from matplotlib.axes import Axes
 from matplotlib.gridspec import SubplotSpec
 from contextlib import contextmanager
+import time
 import numpy as np
 from matplotlib import pyplot as plt
 from artemis.plotting.drawing_plots import redraw_figure
 from artemis.plotting.expanding_subplots import select_subplot
 from artemis.plotting.matplotlib_backend import get_plot_from_data, TextPlot, MovingPointPlot, Moving2DPointPlot, \
     MovingImagePlot, HistogramPlot, CumulativeLineHistogram
-from artemis.plotting.plotting_backend import LinePlot, ImagePlot, is_server_plotting_on
+from artemis.plotting.plotting_backend import LinePlot, ImagePlot, is_server_plotting_on, is_async_plotting_on
 
 __author__ = 'peter'
 
@@ -59,7 +60,7 @@ def dbplot(data, name = None, plot_type = None, axis=None, plot_mode = 'live', d
     :param title: Title of the plot (will default to name if not included)
     :param fig: Name of the figure - use this when you want to create multiple figures.
     :param grid: Turn the grid on
-    :param wait_for_display_sec: In server mode, you can choose to wait maximally wait_for_display_sec seconds before this call returns. In case plotting
+    :param wait_for_display_sec: In server (or async) mode, you can choose to wait maximally wait_for_display_sec seconds before this call returns. In case plotting
     is finished earlier, the call returns earlier. Setting wait_for_display_sec to a negative number will cause the call to block until the plot has been displayed.
     """
     if is_server_plotting_on():
@@ -69,6 +70,12 @@ def dbplot(data, name = None, plot_type = None, axis=None, plot_mode = 'live', d
         from artemis.remote.plotting.plotting_client import dbplot_remotetly
         dbplot_remotetly(arg_locals=arg_locals)
         return
+    elif is_async_plotting_on():
+        # Send the call to a local plotting process, so that plotting does not slow down this thread
+        arg_locals = locals().copy()
+        from artemis.remote.plotting.local_plotting import dbplot_asynchronously
+        dbplot_asynchronously(arg_locals=arg_locals)
+        return
 
     if isinstance(fig, plt.Figure):
         assert None not in _DBPLOT_FIGURES, "If you pass a figure, you can only do it on the first call to dbplot (for now)"
@@ -104,8 +111,8 @@ def dbplot(data, name = None, plot_type = None, axis=None, plot_mode = 'live', d
                 'percent': lambda: MovingPointPlot(y_bounds=(0, 100)),
                 'trajectory': lambda: Moving2DPointPlot(axes_update_mode='expand'),
                 'trajectory+': lambda: Moving2DPointPlot(axes_update_mode='expand', x_bounds=(0, None), y_bounds=(0, None)),
-                'histogram': lambda: HistogramPlot(edges = np.linspace(-5, 5, 20)),
-                'cumhist': lambda: CumulativeLineHistogram(edges = np.linspace(-5, 5, 20)),
+                'histogram': lambda: HistogramPlot(),
+                'cumhist': lambda: CumulativeLineHistogram(),
                 }[plot_type]()
         elif plot_type is None:
             plot = get_plot_from_data(data, mode=plot_mode)
@@ -138,14 +145,20 @@ def dbplot(data, name = None, plot_type = None, axis=None, plot_mode = 'live', d
             _DBPLOT_FIGURES[fig].subplots[name].axis.set_ylabel(ylabel)
         if draw_every is not None:
             _draw_counters[fig, name] = -1
+        _plotted.discard((fig, name))
 
         if grid:
             plt.grid()
 
-    # Update the relevant data and plot it.  TODO: Add option for plotting update interval
+    # Update the relevant data and plot it.  If the figure's redraw rate is limited, plotting of a subplot that has
+    # already been drawn is deferred until the next redraw (plots with history still receive every sample).
     plot = _DBPLOT_FIGURES[fig].subplots[name].plot_object
     plot.update(data)
-    plot.plot()
+    if fig in _max_fps and (fig, name) in _plotted:
+        _pending_plots.setdefault(fig, OrderedDict())[name] = None
+    else:
+        plot.plot()
+        _plotted.add((fig, name))
     if title is not None:
         _DBPLOT_FIGURES[fig].subplots[name].axis.set_title(title)
     if legend is not None:
@@ -157,10 +170,11 @@ def dbplot(data, name = None, plot_type = None, axis=None, plot_mode = 'live', d
             if _draw_counters[fig, name] % draw_every != 0:
                 return _DBPLOT_FIGURES[fig].subplots[name].axis
         if hang:
+            _plot_pending(fig)
             plt.figure(_DBPLOT_FIGURES[fig].figure.number)
             plt.show()
-        else:
-            redraw_figure(_DBPLOT_FIGURES[fig].figure)
+        elif _is_redraw_due(fig):
+            _redraw_dbplot_figure(fig)
     return _DBPLOT_FIGURES[fig].subplots[name].axis
 
 
@@ -180,11 +194,22 @@ _hold_plot_counter = 0
 
 _default_layout = 'grid'
 
+_max_fps = {}  # fig_name -> maximum number of redraws per second
+
+_last_redraw_times = {}  # fig_name -> time of last redraw
+
+_pending_plots = {}  # fig_name -> OrderedDict<subplot_name: None> of subplots whose plotting was deferred
+
+_plotted = set()  # (fig_name, subplot_name) pairs that have been plotted at least once
+
 
 def reset_dbplot():
     for fig_name, plot_window in _DBPLOT_FIGURES.items():
         plt.close(plot_window.figure)
         del _DBPLOT_FIGURES[fig_name]
+    _last_redraw_times.clear()
+    _pending_plots.clear()
+    _plotted.clear()
 
 
 def set_dbplot_figure_size(width, height):
@@ -197,6 +222,50 @@ def set_dbplot_default_layout(layout):
     _default_layout = layout
 
 
+def set_dbplot_max_fps(max_fps, fig = None):
+    """
+    Limit the rate at which a dbplot figure is redrawn.  dbplot calls that come sooner than 1/max_fps seconds after
+    the last redraw only update the plots' data (so plots with history still record every sample), and the plotting
+    and redrawing is done by the first call after that.  This bounds the time spent plotting, no matter how often
+    dbplot is called.  Call redraw_dbplot to draw any data that has not been drawn yet.
+
+    :param max_fps: Maximum number of redraws per second, or None to redraw on every call (the default)
+    :param fig: The name of the figure
+    """
+    if max_fps is None:
+        _max_fps.pop(fig, None)
+        if fig in _DBPLOT_FIGURES:
+            _plot_pending(fig)
+    else:
+        assert max_fps > 0, 'max_fps must be positive.  Got {}'.format(max_fps)
+        _max_fps[fig] = max_fps
+
+
+def redraw_dbplot(fig = None):
+    """
+    Plot any data whose plotting was deferred (see set_dbplot_max_fps), and redraw the figure now.
+    """
+    _redraw_dbplot_figure(fig)
+
+
+def _is_redraw_due(fig):
+    return fig not in _max_fps or time.time() - _last_redraw_times.get(fig, -float('inf')) >= 1./_max_fps[fig]
+
+
+def _plot_pending(fig):
+    for name in _pending_plots.pop(fig, ()):
+        if name in _DBPLOT_FIGURES[fig].subplots:
+            subplot = _DBPLOT_FIGURES[fig].subplots[name]
+            plt.sca(subplot.axis)
+            subplot.plot_object.plot()
+
+
+def _redraw_dbplot_figure(fig):
+    _plot_pending(fig)
+    redraw_figure(_DBPLOT_FIGURES[fig].figure)
+    _last_redraw_times[fig] = time.time()
+
+
 def get_dbplot_figure(name=None):
     return _DBPLOT_FIGURES[name].figure
 
@@ -215,6 +284,11 @@ def _make_dbplot_figure():
 
 
 def freeze_dbplot(name, fig = None):
+    if name in _pending_plots.get(fig, ()):
+        subplot = _DBPLOT_FIGURES[fig].subplots[name]
+        plt.sca(subplot.axis)
+        subplot.plot_object.plot()
+        del _pending_plots[fig][name]
     del _DBPLOT_FIGURES[fig].subplots[name]
 
 
@@ -247,8 +321,8 @@ def hold_dbplots(fig = None, plot_every = None):
     else:
         plot_now = True
 
-    if plot_now:
-        redraw_figure(_DBPLOT_FIGURES[fig].figure)
+    if plot_now and _is_redraw_due(fig):
+        _redraw_dbplot_figure(fig)
 
 
 def clear_dbplot(fig = None):
@@ -257,6 +331,7 @@ def clear_dbplot(fig = None):
         plt.clf()
         _DBPLOT_FIGURES[fig].subplots.clear()
         _DBPLOT_FIGURES[fig].axes.clear()
+        _pending_plots.pop(fig, None)
 
 
 def get_dbplot_axis(axis_name, fig=None):
@@ -267,5 +342,7 @@ def get_dbplot_axis(axis_name, fig=None):
 
 
 def dbplot_hang():
+    for fig in _DBPLOT_FIGURES:
+        _plot_pending(fig)
     plt.show()
 
@@ -1,9 +1,86 @@
+import weakref
 from artemis.fileman.config_files import get_config_value
 from matplotlib import pyplot as plt
 __author__ = 'peter'
 
+# 'safe', 'fast', or 'blit' (see blit_redraw_figure).  Set it with "mode = blit" in the [plotting] section of ~/.artemisrc
 _plotting_mode = get_config_value('.artemisrc', section='plotting', option='mode', default_generator=lambda: 'safe', write_default=True)
 
+
+def blit_redraw_figure(fig=None):
+    """
+    Redraw a figure by blitting: The static parts of each axis (ticks, labels, titles...) are rendered once and cached,
+    and afterwards only the data artists (lines, images, patches, collections, texts) of axes that have changed are
+    redrawn on top of the cached backgrounds.  When anything that affects the background changes (e.g. axis limits, the
+    figure size or a title), the whole figure is redrawn and the backgrounds are cached again.
+
+    The artists are not left "animated", so other redraws (e.g. when saving the figure) still include them.
+
+    :param fig: The figure (default: the current figure)
+    """
+    if fig is None:
+        fig = plt.gcf()
+    canvas = fig.canvas
+    if not getattr(canvas, 'supports_blit', False):
+        plt.draw()
+        plt.pause(0.00001)
+        return
+
+    state = _BLIT_STATES.get(fig)
+    if state is None:
+        plt.show(block=False)
+        state = _BLIT_STATES[fig] = _BlitState()
+
+    signature = _get_figure_signature(fig)
+    if signature != state.signature:
+        # Draw everything but the data artists, cache the backgrounds, then draw the data artists on top.
+        artists = {ax: _get_data_artists(ax) for ax in fig.axes}
+        for ax_artists in artists.values():
+            for artist in ax_artists:
+                artist.set_animated(True)
+        canvas.draw()
+        state.backgrounds = {ax: canvas.copy_from_bbox(ax.bbox) for ax in fig.axes}
+        for ax, ax_artists in artists.iteritems():
+            for artist in ax_artists:
+                artist.set_animated(False)
+                ax.draw_artist(artist)
+        state.signature = _get_figure_signature(fig)  # Drawing may have changed things (e.g. tick labels)
+        canvas.blit(fig.bbox)
+    else:
+        for ax in fig.axes:
+            ax_artists = _get_data_artists(ax)
+            if any(artist.stale for artist in ax_artists):
+                canvas.restore_region(state.backgrounds[ax])
+                for artist in ax_artists:
+                    ax.draw_artist(artist)
+                canvas.blit(ax.bbox)
+    canvas.flush_events()
+
+
+class _BlitState(object):
+
+    def __init__(self):
+        self.signature = None
+        self.backgrounds = {}  # Axes -> the saved background region of that axis
+
+
+_BLIT_STATES = weakref.WeakKeyDictionary()  # Figure -> _BlitState
+
+
+def _get_data_artists(ax):
+    return sorted((a for a in ax.lines + ax.images + ax.collections + ax.patches + ax.texts if a.get_visible()), key=lambda a: a.zorder)
+
+
+def _get_figure_signature(fig):
+    """
+    :return: Something that changes whenever the static background of a figure has to be redrawn.
+    """
+    return fig.canvas.get_width_height(), [(
+        id(ax), ax.get_xlim(), ax.get_ylim(), ax.bbox.bounds, ax.get_title(), ax.get_xlabel(), ax.get_ylabel(),
+        id(ax.get_legend()), ax.get_xscale(), ax.get_yscale()
+        ) for ax in fig.axes]
+
+
 if _plotting_mode == 'safe':
 
     def redraw_figure(fig=None):
@@ -19,5 +96,9 @@ elif _plotting_mode == 'fast':
         plt.show(block=False)
         plt.show(block=False)
 
+elif _plotting_mode == 'blit':
+
+    redraw_figure = blit_redraw_figure
+
 else:
     raise Exception("Unknown plotting mode: {}".format(_plotting_mode))
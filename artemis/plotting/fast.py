@@ -1,4 +1,4 @@
-from scipy import weave
+from artemis.general.numpy_helpers import numba_jit
 
 __author__ = 'peter'
 import numpy as np
@@ -46,69 +46,137 @@ def fastloglog(line_data, **kwargs):
     return fastplot(line_data, xscale='log', yscale = 'symlog', **kwargs)
 
 
-def find_interval_extremes(array, edges):
+def decimate_line(x_data, y_data, x_lims, resolution, xscale = 'linear'):
+    """
+    Reduce a line to the points needed to draw it at a given resolution: The x-range x_lims is split into resolution
+    intervals (e.g. one per pixel), and only the min and max point within each interval are kept (along with the first
+    points outside x_lims, so that the line continues past the edges).  Points outside x_lims are dropped.
+
+    :param x_data: A vector of x-values.  If these are not sorted, the line can not be decimated, and is returned as is.
+    :param y_data: A vector of y-values
+    :param x_lims: The (left, right) limits of the visible x-range
+    :param resolution: The number of intervals to split x_lims into
+    :param xscale: {'linear', 'log'}
+    :return: (x_data, y_data) for the decimated line.
+    """
+    x_data = np.asarray(x_data)
+    y_data = np.asarray(y_data)
+    if len(x_data) < 2 or not np.all(x_data[1:] >= x_data[:-1]):
+        return x_data, y_data
+    left, right = sorted(x_lims)
+    start = max(_searchsorted(x_data, left, side='left')-1, 0)
+    stop = min(_searchsorted(x_data, right, side='right')+1, len(x_data))
+    x_visible = x_data[start:stop]
+    y_visible = y_data[start:stop]
+    if len(x_visible) <= 2*resolution:  # Nothing to gain
+        return x_visible, y_visible
+    if xscale == 'log' and left > 0:
+        boundaries = np.logspace(np.log10(left), np.log10(right), resolution+1)[1:-1]
+    else:
+        boundaries = np.linspace(left, right, resolution+1)[1:-1]
+    # An interval ends with (and includes) the point whose index passes its edge, so the edge for a boundary is the index
+    # of the last point before it.  The points outside x_lims get their own intervals.
+    edges = np.unique(np.concatenate([[0], _searchsorted(x_visible, boundaries)-1, [len(x_visible)-2]]).clip(0, None))
+    extreme_indices = np.union1d(find_interval_extremes(y_visible, edges), [0, len(x_visible)-1])
+    return x_visible[extreme_indices], y_visible[extreme_indices]
+
+
+def _searchsorted(sorted_array, values, side = 'left'):
+    """
+    np.searchsorted, but without converting sorted_array to float when it contains integers and values are floats
+    (which, for a long array, takes much longer than the search).
+    """
+    if np.issubdtype(sorted_array.dtype, np.integer):
+        values = np.clip(np.ceil(values) if side == 'left' else np.floor(values), np.iinfo(sorted_array.dtype).min, np.iinfo(sorted_array.dtype).max).astype(sorted_array.dtype)
+    return np.searchsorted(sorted_array, values, side=side)
+
+
+def find_interval_extremes(array, edges, implementation = 'numpy'):
     """
     Find the indeces of extreme points within each interval, and on the outsides of the two end edges.
     :param array: A vector
     :param edges: A vector of edges defining the intervals.  It's assumed that -Inf, Inf form the true outer edges.
+    :param implementation: 'numpy' (vectorized), or 'numba' (a compiled loop, requires the numba package)
     :return: A vector of ints indicating the indeces of extreme points.  If a distinct min and max extreme are found
         within every interval, this vector will have length 2*(len(edges)+1).  Otherwise, it will be shorter.
     """
+    array = np.asarray(array)
+    edges = np.asarray(edges, dtype=float)
+    if implementation == 'numpy':
+        return _find_interval_extremes_numpy(array, edges)
+    elif implementation == 'numba':
+        indices = np.empty(2*(len(edges)+1), dtype=int)
+        n_indices = _find_interval_extremes_loop(array.astype(float), edges, indices)
+        return indices[:n_indices]
+    else:
+        raise ValueError("implementation must be 'numpy' or 'numba', not {}".format(implementation))
+
+
+def _find_interval_extremes_numpy(array, edges):
+
+    n = len(array)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    # Point i closes interval k if i+1 > edges[k], but each point can close at most one interval, so the index of the
+    # last point in interval k is ends[k] = max(floor(edges[k]), ends[k-1]+1)
+    k = np.arange(len(edges))
+    ends = k + np.maximum.accumulate(np.maximum(np.floor(edges) - k, 0)).astype(int) if len(edges) > 0 else np.zeros(0, dtype=int)
+    ends = ends[ends < n-1]
+    starts = np.concatenate([[0], ends+1])
 
-    indices = np.zeros(len(array), dtype = int)-1
-    how_many = np.array([0])
-    code = """
-    float min = INFINITY;
-    float max = -INFINITY;
-    int argmin;
-    int argmax;
-    bool foundpoint = false;
-    int in_counter = 0;
-    int out_counter = 0;
-    int edge_counter = 0;
-    while(in_counter<Narray[0]){
-        float next_edge;
-        if (edge_counter == Nedges[0])
-            next_edge = INFINITY;
-        else
-            next_edge = edges[edge_counter];
-
-        if (array[in_counter] < min){
-            min = array[in_counter];
-            argmin = in_counter;
-            foundpoint = true;
-        }
-        if (array[in_counter] > max){
-            max = array[in_counter];
-            argmax = in_counter;
-            foundpoint = true;
-        }
-        in_counter++;
-        if (in_counter > next_edge){
-            if (foundpoint){
-                if (argmin < argmax){
-                    indices[out_counter] = argmin;
-                    indices[out_counter+1] = argmax;
-                    out_counter+=2;
-                }
-                else if (argmax < argmin){
-                    indices[out_counter] = argmax;
-                    indices[out_counter+1] = argmin;
-                    out_counter+=2;
-                }
-                else {
-                    indices[out_counter] = argmax;
-                    out_counter++;
-                }
-                min = INFINITY;
-                max = -INFINITY;
-                foundpoint = false;
-            }
-            edge_counter++;
-        }
-    }
-    how_many[0] = out_counter;
+    mins = np.fmin.reduceat(array, starts)  # (fmin and fmax ignore NaNs)
+    maxs = np.fmax.reduceat(array, starts)
+    lengths = np.diff(np.append(starts, n))
+    ixs = np.arange(n)
+    argmins = np.minimum.reduceat(np.where(array == np.repeat(mins, lengths), ixs, n), starts)  # First minimum in each interval
+    argmaxs = np.minimum.reduceat(np.where(array == np.repeat(maxs, lengths), ixs, n), starts)
+
+    found = argmins < n  # Intervals that are all-NaN have no extremes
+    firsts = np.minimum(argmins, argmaxs)[found]
+    seconds = np.maximum(argmins, argmaxs)[found]
+    pairs = np.column_stack([firsts, seconds])
+    keep = np.column_stack([np.ones(len(pairs), dtype=bool), seconds != firsts])
+    return pairs[keep]
+
+
+@numba_jit
+def _find_interval_extremes_loop(array, edges, indices):
+    """
+    The extremes of each interval, as a loop.  Writes them into indices, and returns how many were written.
     """
-    weave.inline(code, ['array', 'edges', 'indices', 'how_many'], compiler = 'gcc')
-    result = indices[:how_many[0]]
-    return result
+    min_val = np.inf
+    max_val = -np.inf
+    argmin = -1
+    argmax = -1
+    found_point = False
+    out_counter = 0
+    edge_counter = 0
+    n = len(array)
+    for in_counter in range(n):
+        next_edge = edges[edge_counter] if edge_counter < len(edges) else np.inf
+        if array[in_counter] < min_val:
+            min_val = array[in_counter]
+            argmin = in_counter
+            found_point = True
+        if array[in_counter] > max_val:
+            max_val = array[in_counter]
+            argmax = in_counter
+            found_point = True
+        if in_counter+1 > next_edge or in_counter == n-1:
+            if found_point:
+                if argmin < argmax:
+                    indices[out_counter] = argmin
+                    indices[out_counter+1] = argmax
+                    out_counter += 2
+                elif argmax < argmin:
+                    indices[out_counter] = argmax
+                    indices[out_counter+1] = argmin
+                    out_counter += 2
+                else:
+                    indices[out_counter] = argmax
+                    out_counter += 1
+                min_val = np.inf
+                max_val = -np.inf
+                found_point = False
+            edge_counter += 1
+    return out_counter
@@ -2,8 +2,9 @@ from abc import ABCMeta, abstractmethod
 from itertools import cycle
 
 from artemis.general.should_be_builtins import bad_value
+from artemis.plotting.fast import decimate_line
 from artemis.plotting.data_conversion import put_data_in_grid, RecordBuffer, data_to_image, put_list_of_images_in_array, \
-    UnlimitedRecordBuffer
+    UnlimitedRecordBuffer, DownsamplingRecordBuffer, get_grid_image_shape
 from matplotlib import pyplot as plt
 import numpy as np
 
@@ -63,6 +64,7 @@ class ImagePlot(HistoryFreePlot):
         self._is_colour_data = is_colour_data
         self.show_clims = show_clims
         self.only_grow_clims = only_grow_clims
+        self._image_buffer = None  # Reused for the image on every update (matplotlib copies the data when it is set)
         if only_grow_clims:
             self._old_clims = (float('inf'), -float('inf'))
 
@@ -86,9 +88,12 @@ class ImagePlot(HistoryFreePlot):
             if self._is_colour_data is None:
                 self._is_colour_data = data.shape[-1]==3
 
-            plottable_data = put_data_in_grid(data, clims = clims, cmap = self._cmap, is_color_data = self._is_colour_data, fill_colour = np.array((0, 0, 128)), nan_colour = np.array((0, 0, 128))) \
-                if not (self._is_colour_data and data.ndim==3 or data.ndim==2) else \
-                data_to_image(data, clims = clims, cmap = self._cmap, nan_colour = np.array((0, 0, 128)))
+            if not (self._is_colour_data and data.ndim==3 or data.ndim==2):
+                out = self._get_image_buffer(get_grid_image_shape(data.shape, is_color_data=self._is_colour_data))
+                plottable_data = put_data_in_grid(data, clims = clims, cmap = self._cmap, is_color_data = self._is_colour_data, fill_colour = np.array((0, 0, 128)), nan_colour = np.array((0, 0, 128)), out=out)
+            else:
+                out = self._get_image_buffer(data.shape if self._is_colour_data else data.shape+(3, ))
+                plottable_data = data_to_image(data, clims = clims, cmap = self._cmap, is_color_data = self._is_colour_data, nan_colour = np.array((0, 0, 128)), out=out)
 
         if self._plot is None:
             self._plot = plt.imshow(plottable_data, interpolation = self._interpolation, aspect = self._aspect, cmap = self._cmap)
@@ -100,6 +105,11 @@ class ImagePlot(HistoryFreePlot):
         if self.show_clims:
             self._plot.axes.set_xlabel('{:.3g} <> {:.3g}'.format(*clims))
 
+    def _get_image_buffer(self, shape):
+        if self._image_buffer is None or self._image_buffer.shape != shape:
+            self._image_buffer = np.empty(shape, dtype=np.uint8)
+        return self._image_buffer
+
 
 class MovingImagePlot(ImagePlot):
 
@@ -122,7 +132,7 @@ class LinePlot(HistoryFreePlot):
 
     def __init__(self, x_axis_type = 'lin', y_axis_type = 'lin', x_bounds = (None, None), y_bounds = (None, None), y_bound_extend = (.05, .05),
                  x_bound_extend = (0, 0), make_legend = None, axes_update_mode = 'fit', add_end_markers = False, legend_entries = None,
-                 legend_entry_size = 8, plot_kwargs = {}, allow_axis_offset = False):
+                 legend_entry_size = 8, plot_kwargs = {}, allow_axis_offset = False, decimation_threshold = 20000):
         """
         :param y_axis_type: 'lin' (only one supported now)
         :param x_bounds: A tuple of (lower_bound, upper_bound), where None means automatic
@@ -136,6 +146,9 @@ class LinePlot(HistoryFreePlot):
         :param legend_entries: Entries of the legend.  Should be one per line in the data.
         :param legend_entry_size: Font size for legend entries.
         :param plot_kwargs:
+        :param decimation_threshold: Lines with more points than this are decimated to the pixel width of the axes
+            before drawing (keeping the min and max point of each pixel column, see fast.decimate_line), and decimated
+            again whenever the x-limits change (e.g. on zoom).  None to always draw every point.
         """
         # assert y_axis_type == 'lin', 'Changing axis scaling not supported yet'
         self.x_axis_type = x_axis_type
@@ -153,6 +166,9 @@ class LinePlot(HistoryFreePlot):
         self.legend_entries = [legend_entries] if isinstance(legend_entries, basestring) else legend_entries
         self.legend_entry_size = legend_entry_size
         self.allow_axis_offset = allow_axis_offset
+        self.decimation_threshold = decimation_threshold
+        self._line_data = None  # The full (x_data, y_data) of each line, which may be decimated for display
+        self._updating_lines = False
 
     def _plot_last_data(self, data):
         """
@@ -202,15 +218,18 @@ class LinePlot(HistoryFreePlot):
         else:
             raise Exception(self.y_axis_type)
 
+        self._line_data = zip(x_data, y_data)
         if self._plots is None:
             self._plots = []
-            plt.gca().autoscale(enable=False)
-            plt.gca().get_yaxis().get_major_formatter().set_useOffset(self.allow_axis_offset)
-            plt.gca().get_xaxis().get_major_formatter().set_useOffset(self.allow_axis_offset)
+            ax = plt.gca()
+            ax.autoscale(enable=False)
+            ax.get_yaxis().get_major_formatter().set_useOffset(self.allow_axis_offset)
+            ax.get_xaxis().get_major_formatter().set_useOffset(self.allow_axis_offset)
             if self.x_axis_type!='lin':
-                plt.gca().set_xscale(self.x_axis_type)
+                ax.set_xscale(self.x_axis_type)
             if self.y_axis_type!='lin':
-                plt.gca().set_yscale(self.y_axis_type)
+                ax.set_yscale(self.y_axis_type)
+            self._set_axes_bound(ax, (left, right), (lower, upper))
 
             if isinstance(self.plot_kwargs, dict):
                 plot_kwargs = [self.plot_kwargs]*len(x_data)
@@ -218,12 +237,12 @@ class LinePlot(HistoryFreePlot):
                 assert len(self.plot_kwargs)==len(x_data), "You provided a list of {0} plot kwargs, but {1} lines".format(len(self.plot_kwargs), len(x_data))
                 plot_kwargs = self.plot_kwargs
             for i, (xd, yd, legend_entry) in enumerate(zip(x_data, y_data, self.legend_entries if self.legend_entries is not None else [None]*len(x_data))):
-                p, =plt.plot(xd, yd, label = legend_entry, **plot_kwargs[i])
+                p, =plt.plot(*self._get_display_data(ax, xd, yd), label = legend_entry, **plot_kwargs[i])
                 self._plots.append(p)
-                _update_axes_bound(p.axes, (left, right), (lower, upper), self.axes_update_mode)
                 if self.add_end_markers:
                     colour = p.get_color()
                     self._end_markers.append((plt.plot(xd[[0]], yd[[0]], marker='.', markersize=20, color=colour)[0], plt.plot(xd[0], yd[0], marker='x', markersize=10, mew=4, color=colour)[0]))
+            ax.callbacks.connect('xlim_changed', lambda ax: self._on_xlim_changed(ax))  # (Not the bound method, which matplotlib only keeps a weak reference to)
 
             if (self.make_legend is True) or (self.make_legend is None and (self.legend_entries is not None or len(y_data)>1)):
                 plt.legend(loc='best', framealpha=0.5, prop={'size':self.legend_entry_size})
@@ -236,10 +255,10 @@ class LinePlot(HistoryFreePlot):
                 #     plt.gca().set_legend_handles_labels(handles + self._plots, labels+entries)
 
         else:
-            for i, (p, xd, yd) in enumerate(zip(self._plots, x_data, y_data)):
-                p.set_xdata(xd)
-                p.set_ydata(yd)
-                _update_axes_bound(p.axes, (left, right), (lower, upper), self.axes_update_mode)
+            ax = self._plots[0].axes
+            self._set_axes_bound(ax, (left, right), (lower, upper))
+            self._update_lines(ax)
+            for i, (xd, yd) in enumerate(zip(x_data, y_data)):
                 if self.add_end_markers:
                     self._end_markers[i][0].set_xdata(xd[[0]])
                     self._end_markers[i][0].set_ydata(yd[[0]])
@@ -248,6 +267,30 @@ class LinePlot(HistoryFreePlot):
 
         # plt.legend(loc='best', framealpha=0.5, prop={'size': self.legend_entry_size})
 
+    def _set_axes_bound(self, ax, (left, right), (lower, upper)):
+        self._updating_lines = True  # The lines are decimated once the bounds are set, not on every change of x-limits
+        try:
+            _update_axes_bound(ax, (left, right), (lower, upper), self.axes_update_mode)
+        finally:
+            self._updating_lines = False
+
+    def _get_display_data(self, ax, xd, yd):
+        """
+        :return: The (x_data, y_data) to draw for a line: decimated to the pixel width of the axes if the line has more
+            than decimation_threshold points.
+        """
+        if self.decimation_threshold is None or len(xd) <= self.decimation_threshold:
+            return xd, yd
+        return decimate_line(xd, yd, x_lims=ax.get_xlim(), resolution=max(int(ax.bbox.width), 1), xscale=ax.get_xscale())
+
+    def _update_lines(self, ax):
+        for p, (xd, yd) in zip(self._plots, self._line_data):
+            p.set_data(*self._get_display_data(ax, xd, yd))
+
+    def _on_xlim_changed(self, ax):
+        if not self._updating_lines and self._plots is not None and self.decimation_threshold is not None:
+            self._update_lines(ax)
+
 
 def _update_axes_bound(ax, (left, right), (lower, upper), mode = 'fit'):
     if mode=='fit':
@@ -268,24 +311,34 @@ def _update_axes_bound(ax, (left, right), (lower, upper), mode = 'fit'):
 
 class MovingPointPlot(LinePlot):
 
-    def __init__(self, buffer_len=None, **kwargs):
+    def __init__(self, buffer_len=None, history_resolution=1024, **kwargs):
         """
         :param buffer_len: An integar to keep a fixed-length window, or None to keep an expanding buffer
+        :param history_resolution: If buffer_len is None, older parts of the history are downsampled (keeping the min
+            and max) so that memory grows only logarithmically with the number of samples.  This is the number of
+            points kept at each level of resolution (see DownsamplingRecordBuffer).  None to keep every sample.
         :param kwargs:
         :return:
         """
         LinePlot.__init__(self, **kwargs)
-        self._buffer = UnlimitedRecordBuffer() if buffer_len is None else RecordBuffer(buffer_len)
+        self._buffer = RecordBuffer(buffer_len) if buffer_len is not None else \
+            DownsamplingRecordBuffer(resolution=history_resolution) if history_resolution is not None else \
+            UnlimitedRecordBuffer()
         self.x_data = np.arange(-buffer_len+1, 1) if buffer_len is not None else None
 
     def update(self, data):
         if not np.isscalar(data) or isinstance(data, np.ndarray):
             data = np.array(data)
-        buffer_data = self._buffer(data)
-        x_data = np.arange(len(buffer_data)) if self.x_data is None else self.x_data
-        LinePlot.update(self, (x_data, buffer_data))
+        if isinstance(self._buffer, DownsamplingRecordBuffer):
+            self._buffer.append(data)  # The data to plot is only assembled when we plot
+        else:
+            buffer_data = self._buffer(data)
+            x_data = np.arange(len(buffer_data)) if self.x_data is None else self.x_data
+            LinePlot.update(self, (x_data, buffer_data))
 
     def plot(self):
+        if isinstance(self._buffer, DownsamplingRecordBuffer):
+            LinePlot.update(self, self._buffer.get_data())
         LinePlot.plot(self)
 
 
@@ -373,58 +426,113 @@ class BarPlot(HistoryFreePlot):
 
 class HistogramPlot(IPlot):
 
-    def __init__(self, edges, mode = 'mass', plot_type = 'bar', cumulative = False):
+    def __init__(self, edges = None, mode = 'mass', plot_type = 'bar', cumulative = False, n_bins = 20, decay = None):
+        """
+        A histogram of all the data it has been given, which is accumulated as the data arrives.
+
+        :param edges: The edges of the bins.  Values outside the edges are not counted.  If None, the range of the bins
+            is taken from the first data, and whenever data falls outside the range, the range is doubled (by merging
+            pairs of neighbouring bins) until it fits.
+        :param mode: 'mass' for the fraction of the data in each bin, or 'density' for the fraction per unit length.
+        :param plot_type: 'bar' or 'line'
+        :param cumulative: Plot the cumulative histogram
+        :param n_bins: The number of bins, if edges is None
+        :param decay: None to count all data equally, or a number in (0, 1) to multiply the counts by (1-decay) before
+            adding the counts of new data, so that the histogram follows recent data.
+        """
         assert mode in ('mass', 'density')
-        edges = np.array(edges)
-        self._edges = edges
+        assert decay is None or 0 < decay < 1, "decay should be None or in (0, 1).  Got {}".format(decay)
+        self._adaptive = edges is None
+        self._edges = np.array(edges, dtype=float) if edges is not None else None
+        self._n_bins = len(edges)-1 if edges is not None else n_bins
+        self._counts = np.zeros(self._n_bins)
         self._mode = mode
-        self._binvals = np.ones(len(edges)-1)/len(edges)
-        self._n_points = 0
+        self._decay = decay
         self._plot = None
-        self._widths = np.diff(edges)
-        self._lefts = edges[:-1]
+        self._plotted_edges = None
         self._plot_type=plot_type
         self._cumulative = cumulative
 
     def update(self, data):
 
-        if isinstance(data, (list, tuple)):
-            data = np.array(data)
+        data = np.asarray(data, dtype=float).ravel()
+        data = data[np.isfinite(data)]
+        if self._adaptive and len(data) > 0:
+            lower, upper = np.min(data), np.max(data)
+            if self._edges is None:
+                if lower == upper:
+                    lower, upper = lower-.5, upper+.5
+                self._edges = np.linspace(lower, upper, self._n_bins+1)
+            while lower < self._edges[0] or upper > self._edges[-1]:
+                self._double_range(extend_left = lower < self._edges[0])
+        if self._decay is not None:
+            self._counts *= 1-self._decay
+        if self._edges is not None and len(data) > 0:
+            bin_ixs = np.searchsorted(self._edges, data, side='right')-1
+            bin_ixs[data == self._edges[-1]] = self._n_bins-1  # As in np.histogram, the last bin includes its right edge
+            self._counts += np.bincount(bin_ixs[(bin_ixs >= 0) & (bin_ixs < self._n_bins)], minlength=self._n_bins)
+
+    def _double_range(self, extend_left):
+        """
+        Double the range of the bins (extending it to the left or right) by merging pairs of neighbouring bins.
+        """
+        counts = self._counts
+        if len(counts) % 2 == 1:  # Pad with an empty bin on the side we extend to, so the old range splits into pairs
+            counts = np.concatenate([[0], counts] if extend_left else [counts, [0]])
+        merged_counts = counts.reshape(-1, 2).sum(axis=1)
+        self._counts = np.zeros(self._n_bins)
+        width = self._edges[-1] - self._edges[0]
+        if extend_left:
+            self._counts[-len(merged_counts):] = merged_counts
+            self._edges = np.linspace(self._edges[-1]-2*width, self._edges[-1], self._n_bins+1)
+        else:
+            self._counts[:len(merged_counts)] = merged_counts
+            self._edges = np.linspace(self._edges[0], self._edges[0]+2*width, self._n_bins+1)
 
-        # Update data
-        new_n_points = self._n_points + data.size
-        this_hist, _ = np.histogram(data, self._edges)
-        frac = (float(data.size)/self._n_points) if self._n_points > 0 else 1
-        self._binvals += this_hist * frac
-        self._binvals /= max(1, np.sum(self._binvals))
-        self._n_points = new_n_points
-        # DIsplay
-        heights = self._binvals if self._mode == 'mass' else self._binvals/self._widths
+    def get_heights(self):
+        """
+        :return: The heights of the bins (fractions of the data, or densities, depending on mode)
+        """
+        heights = self._counts / max(np.sum(self._counts), 1e-300)
+        if self._mode == 'density':
+            heights = heights / np.diff(self._edges)
         if self._cumulative:
             heights = np.cumsum(heights)
-        self._last_heights = heights
+        return heights
 
     def plot(self):
-        heights = self._last_heights
+        if self._edges is None:  # No data yet
+            return
+        heights = self.get_heights()
+        lefts, widths = self._edges[:-1], np.diff(self._edges)
         if self._plot_type == 'bar':
             if self._plot is None:
-                self._plot = plt.bar(self._lefts, heights, width = self._widths)
+                self._plot = plt.bar(lefts, heights, width = widths, align='edge')
             else:
-                for rect, h in zip(self._plot, heights):
+                edges_changed = self._plotted_edges is not self._edges
+                for rect, left, width, h in zip(self._plot, lefts, widths, heights):
+                    if edges_changed:
+                        rect.set_x(left)
+                        rect.set_width(width)
                     rect.set_height(h)
         elif self._plot_type == 'line':
             if self._plot is None:
-                self._plot = plt.plot(self._edges[:-1], heights)
+                self._plot = plt.plot(lefts, heights)
             else:
-                self._plot[0].set_ydata(heights)
+                self._plot[0].set_data(lefts, heights)
+        else:
+            raise Exception('No histogram plot type: "%s"' % (self._plot_type, ))
 
-        self._plot[0].axes.set_ybound(0, np.max(heights)*1.05)
+        if self._plotted_edges is not self._edges:
+            self._plot[0].axes.set_xbound(self._edges[0], self._edges[-1])
+            self._plotted_edges = self._edges
+        self._plot[0].axes.set_ybound(0, max(np.max(heights), 1e-9)*1.05)
 
 
 class CumulativeLineHistogram(HistogramPlot):
 
-    def __init__(self, edges):
-        HistogramPlot.__init__(self, edges, mode = 'mass', plot_type='line', cumulative=True)
+    def __init__(self, edges = None, **kwargs):
+        HistogramPlot.__init__(self, edges, mode = 'mass', plot_type='line', cumulative=True, **kwargs)
 
 
 def get_plot_from_data(data, mode, **plot_preference_kwargs):
@@ -13,6 +13,9 @@ else:
     _USE_SERVER = False
     _PLOTTING_SERVER = ""
 
+# With "async = True" in the [plotting] section, dbplot calls are sent to a separate local process which does the plotting
+_USE_ASYNC = config.has_option('plotting', 'async') and config.getboolean('plotting', 'async')
+
 assert BACKEND in ('matplotlib', 'matplotlib-web', 'bokeh'), 'Your config file ~/.artimisrc lists "%s" as the backend.  Valid backends are "matplotlib" and "bokeh".  Change the file.' % (BACKEND, )
 
 if BACKEND in ('matplotlib', 'matplotlib-web'):
@@ -32,4 +35,16 @@ def set_server_plotting(state):
 
 
 def get_plotting_server_address():
-    return _PLOTTING_SERVER
\ No newline at end of file
+    return _PLOTTING_SERVER
+
+def is_async_plotting_on():
+    return _USE_ASYNC
+
+
+def set_async_plotting(state):
+    """
+    :param state: True to send dbplot calls to a local plotting process (see artemis.remote.plotting.local_plotting),
+        so that plotting does not slow down the calling thread.
+    """
+    global _USE_ASYNC
+    _USE_ASYNC = state
@@ -0,0 +1,240 @@
+import time
+import numpy as np
+from artemis.plotting.data_conversion import RecordBuffer, UnlimitedRecordBuffer, DownsamplingRecordBuffer, put_data_in_grid, \
+    get_grid_image_shape, data_to_image, vector_length_to_tile_dims
+
+__author__ = 'peter'
+
+
+class _FancyIndexRecordBuffer(object):
+    """ The old implementation of RecordBuffer, which copies the whole buffer on every update, for comparison. """
+
+    def __init__(self, buffer_len, initial_value = np.NaN):
+        self._buffer_len = buffer_len
+        self._buffer = None
+        self._ix = 0
+        self._base_indices = np.arange(buffer_len)
+        self._initial_value = initial_value
+
+    def __call__(self, data):
+        if self._buffer is None:
+            self._buffer = np.empty((self._buffer_len, )+np.shape(data))
+            self._buffer[:] = self._initial_value
+        self._buffer[self._ix] = data
+        self._ix = (self._ix+1) % self._buffer_len
+        return self._buffer[(self._base_indices+self._ix) % self._buffer_len]
+
+
+def test_record_buffer():
+
+    for shape in [(), (3, ), (2, 4)]:
+        buf = RecordBuffer(5)
+        old_buf = _FancyIndexRecordBuffer(5)
+        for i in xrange(12):
+            data = np.random.randn(*shape)
+            out = buf(data)
+            np.testing.assert_array_equal(out, old_buf(data))  # (treats NaNs as equal)
+            assert out.shape == (5, )+shape and out.base is not None  # A view, not a copy
+
+    buf = RecordBuffer(4)
+    assert np.isnan(buf(1.)[:3]).all()
+    np.testing.assert_array_equal(buf.extend(np.arange(2., 4.)), [np.nan, 1, 2, 3])
+    assert np.array_equal(buf.extend(np.arange(4., 7.)), [3, 4, 5, 6])
+    assert np.array_equal(buf.extend(np.arange(7., 20.)), [16, 17, 18, 19])
+    assert np.array_equal(buf(20.), [17, 18, 19, 20])
+
+    text_buf = RecordBuffer(3, initial_value='')
+    text_buf('a')
+    assert list(text_buf('b')) == ['', 'a', 'b']
+
+
+def test_unlimited_record_buffer():
+    buf = UnlimitedRecordBuffer(initial_size=4)
+    for i in xrange(10):
+        out = buf(np.int16(i))
+    assert out.dtype == np.int16 and np.array_equal(out, np.arange(10))
+    out = buf(0.5)  # Upcasts rather than truncating
+    assert out[-1] == 0.5 and np.array_equal(out[:10], np.arange(10))
+
+
+def test_downsampling_record_buffer():
+
+    resolution = 8
+    buf = DownsamplingRecordBuffer(resolution=resolution)
+    data = np.random.RandomState(1234).randint(-100, 100, size=(1000, 2)).astype(np.int32)
+    for i in xrange(0, 900, 30):
+        buf.extend(data[i:i+30])
+    for d in data[900:]:
+        x, y = buf(d)
+    assert y.dtype == np.int32 and buf.n_samples == 1000
+    assert len(x) <= 2*resolution*2*int(np.ceil(np.log2(1000./resolution)+1))  # Memory grows logarithmically
+    assert np.all(np.diff(x) >= 0)
+    assert np.array_equal(x[-resolution:], np.arange(1000-resolution, 1000)) and np.array_equal(y[-resolution:], data[-resolution:])  # Recent data at full resolution
+    assert np.array_equal(y.min(axis=0), data.min(axis=0)) and np.array_equal(y.max(axis=0), data.max(axis=0))  # The envelope is kept
+    for k, level in enumerate(buf._levels[1:], 1):  # Each block keeps the min and max of its samples
+        for start, mn, mx in zip(level.starts[:level.count], level.mins, level.maxs):
+            assert np.array_equal(mn, data[start:start+2**k].min(axis=0)) and np.array_equal(mx, data[start:start+2**k].max(axis=0))
+
+
+def benchmark_record_buffer(buffer_len = 1000, sample_shape = (20, ), n_samples = 2000):
+    """
+    Compare the time per update of the RecordBuffer with that of the old fancy-indexing implementation, and with
+    adding the samples in batches.
+    """
+    samples = np.random.randn(n_samples, *sample_shape)
+    for name, buf in [('fancy-index', _FancyIndexRecordBuffer(buffer_len)), ('ring', RecordBuffer(buffer_len))]:
+        start_time = time.time()
+        for s in samples:
+            buf(s)
+        print '%s buffer of %s x %s: %.3g us/sample' % (name, buffer_len, sample_shape, 1e6*(time.time()-start_time)/n_samples)
+    buf = RecordBuffer(buffer_len)
+    start_time = time.time()
+    for i in xrange(0, n_samples, 100):
+        buf.extend(samples[i:i+100])
+    print 'ring buffer of %s x %s, batches of 100: %.3g us/sample' % (buffer_len, sample_shape, 1e6*(time.time()-start_time)/n_samples)
+
+
+def test_benchmark_record_buffer():
+    benchmark_record_buffer(buffer_len=100, n_samples=200)
+
+
+def _put_data_in_grid_with_loop(data, grid_shape = None, fill_colour = np.array((0, 0, 128), dtype = 'uint8'), cmap = 'gray', clims = None, is_color_data = None):
+    """ The old implementation of put_data_in_grid (with a boundary width of 1), which copies one tile at a time, for comparison. """
+    is_colour = data.shape[-1]==3 if is_color_data is None else is_color_data
+    size_y, size_x = (data.shape[-3], data.shape[-2]) if is_colour else (data.shape[-2], data.shape[-1])
+    is_vector = (data.ndim==4 and is_colour) or (data.ndim==3 and not is_colour)
+    n_rows, n_cols = grid_shape if grid_shape is not None else vector_length_to_tile_dims(data.shape[0]) if is_vector else data.shape[:2]
+    output_data = np.empty((n_rows*(size_y+1)+1, n_cols*(size_x+1)+1, 3), dtype='uint8')
+    output_data[..., :] = fill_colour
+    scaled_data = data_to_image(data, clims = clims, cmap = cmap, is_color_data=is_color_data)
+    for i in xrange(n_rows):
+        for j in xrange(n_cols):
+            if is_vector and i*n_cols + j == data.shape[0]:
+                break
+            output_data[i*(size_y+1)+1:i*(size_y+1)+1+size_y, j*(size_x+1)+1:j*(size_x+1)+1+size_x] = scaled_data[i*n_cols+j] if is_vector else scaled_data[i, j]
+    return output_data
+
+
+def test_put_data_in_grid():
+    rng = np.random.RandomState(1234)
+    for shape, grid_shape, is_color_data in [
+            ((10, 5, 6), None, None),  # Vector of images, with a partly empty last row
+            ((9, 5, 6), None, None),
+            ((7, 5, 6, 3), None, None),  # Vector of colour images
+            ((3, 4, 5, 6), None, None),  # Grid of images
+            ((3, 4, 5, 6, 3), None, None),  # Grid of colour images
+            ((3, 5, 3), None, False),  # Vector of images that happen to be 3 pixels wide
+            ((10, 5, 6), (2, 7), None),  # Vector in a given grid
+            ]:
+        data = rng.rand(*shape)
+        expected = _put_data_in_grid_with_loop(data, grid_shape=grid_shape, is_color_data=is_color_data)
+        grid = put_data_in_grid(data, grid_shape=grid_shape, is_color_data=is_color_data)
+        assert grid.shape == get_grid_image_shape(shape, grid_shape=grid_shape, is_color_data=is_color_data)
+        assert np.array_equal(grid, expected)
+        assert np.array_equal(put_data_in_grid(data, grid_shape=grid_shape, cmap='jet', is_color_data=is_color_data), _put_data_in_grid_with_loop(data, grid_shape=grid_shape, cmap='jet', is_color_data=is_color_data))
+
+    data = rng.rand(10, 5, 6)
+    out = np.zeros(get_grid_image_shape(data.shape), dtype='uint8')
+    grid = put_data_in_grid(data, out=out)
+    assert grid is out and np.array_equal(out, _put_data_in_grid_with_loop(data))
+    grid = put_data_in_grid(rng.rand(10, 5, 6), out=out)  # Overwritten in place
+    assert grid is out and not np.array_equal(out, _put_data_in_grid_with_loop(data))
+
+    grid = put_data_in_grid(data, boundary_width=3, fill_colour=(1, 2, 3), clims=(0, 1))
+    assert grid.shape == (3*8+3, 4*9+3, 3)
+    assert np.array_equal(grid[3:8, 3:9], data_to_image(data[0], clims=(0, 1))) and np.array_equal(grid[11:16, 12:18], data_to_image(data[5], clims=(0, 1)))
+    assert np.all(grid[:3] == (1, 2, 3)) and np.all(grid[8:11] == (1, 2, 3)) and np.all(grid[-8:-3, -9:-3] == (1, 2, 3))
+
+
+def _data_to_image_with_mappable(data, clims, cmap = 'gray'):
+    """ The old implementation of data_to_image for non-colour data, which goes through matplotlib's ScalarMappable, for comparison. """
+    import matplotlib.cm as cm
+    from matplotlib.colors import Normalize
+    if cmap == 'gray':
+        scaled_data = np.clip((data-clims[0])*(255./(clims[1]-clims[0])), 0, 255).astype(np.uint8)
+        return np.concatenate([scaled_data[..., None]]*3, axis = scaled_data.ndim)
+    else:
+        rgba = cm.ScalarMappable(cmap = cmap, norm = Normalize(vmin=clims[0], vmax=clims[1])).to_rgba(data.reshape((data.shape[0], -1)))
+        return (rgba[..., :-1]*255).reshape(data.shape+(3, ))
+
+
+def test_data_to_image():
+    rng = np.random.RandomState(1234)
+    data = rng.randn(20, 30, 40)
+    for cmap in ('gray', 'jet', 'viridis'):
+        image = data_to_image(data, clims=(-2, 2), cmap=cmap)
+        assert image.shape == (20, 30, 40, 3) and image.dtype == np.uint8
+        assert np.abs(image.astype(int) - _data_to_image_with_mappable(data, clims=(-2, 2), cmap=cmap)).max() <= 1
+    image = data_to_image(data, cmap='jet')
+    assert np.array_equal(image, data_to_image(data, clims=(data.min(), data.max()), cmap='jet'))
+    assert np.array_equal(image[data==data.min()][0], (0, 0, 128)) and np.array_equal(image[data==data.max()][0], (128, 0, 0))
+
+    data[3, 4, 5] = np.nan
+    image = data_to_image(data, cmap='jet', nan_colour=(1, 2, 3))
+    assert np.array_equal(image[3, 4, 5], (1, 2, 3)) and not np.any(np.all(image[~np.isnan(data)] == (1, 2, 3), axis=-1))
+    assert np.array_equal(data_to_image(data, cmap='jet')[3, 4, 5], (0, 0, 0))
+
+    out = np.zeros((20, 30, 40, 3), dtype=np.uint8)
+    assert data_to_image(data, cmap='jet', nan_colour=(1, 2, 3), out=out) is out and np.array_equal(out, image)
+
+    colour_data = rng.rand(5, 6, 3)
+    assert np.array_equal(data_to_image(colour_data, clims=(0, 1)), (colour_data*255).astype(np.uint8))
+    assert np.array_equal(data_to_image(np.full((4, 5), np.nan), nan_colour=(1, 2, 3)), np.tile([1, 2, 3], (4, 5, 1)))
+    assert np.array_equal(data_to_image(np.ones((4, 5)), cmap='gray'), np.zeros((4, 5, 3)))
+
+
+def benchmark_data_to_image(shape = (64, 64, 28, 28), cmap = 'jet', n_frames = 10):
+    """
+    Compare the time to apply a colourmap to a large grid of images with that of going through matplotlib's
+    ScalarMappable.
+    """
+    data = np.random.randn(n_frames, *shape)
+    start_time = time.time()
+    for d in data:
+        _data_to_image_with_mappable(d, clims=(-2, 2), cmap=cmap)
+    print 'ScalarMappable data_to_image of %s with %s: %.3g ms/frame' % (shape, cmap, 1000*(time.time()-start_time)/n_frames)
+    start_time = time.time()
+    for d in data:
+        data_to_image(d, clims=(-2, 2), cmap=cmap)
+    print 'lookup-table data_to_image of %s with %s: %.3g ms/frame' % (shape, cmap, 1000*(time.time()-start_time)/n_frames)
+    out = np.empty(shape+(3, ), dtype=np.uint8)
+    start_time = time.time()
+    for d in data:
+        data_to_image(d, clims=(-2, 2), cmap=cmap, out=out)
+    print 'lookup-table data_to_image of %s with %s into a preallocated output: %.3g ms/frame' % (shape, cmap, 1000*(time.time()-start_time)/n_frames)
+
+
+def test_benchmark_data_to_image():
+    benchmark_data_to_image(shape=(4, 4, 28, 28), n_frames=2)
+
+
+def benchmark_put_data_in_grid(n_filters = 4096, filter_shape = (5, 5), n_frames = 10):
+    """
+    Compare the time to arrange a vector of filters into a grid with that of the old tile-by-tile implementation.
+    """
+    data = np.random.randn(n_frames, n_filters, *filter_shape)
+    for name, func in [('tile-by-tile', _put_data_in_grid_with_loop), ('vectorized', put_data_in_grid)]:
+        start_time = time.time()
+        for d in data:
+            func(d, clims=(-2, 2))
+        print '%s put_data_in_grid of %s %s filters: %.3g ms/frame' % (name, n_filters, filter_shape, 1000*(time.time()-start_time)/n_frames)
+    out = np.empty(get_grid_image_shape(data.shape[1:]), dtype='uint8')
+    start_time = time.time()
+    for d in data:
+        put_data_in_grid(d, clims=(-2, 2), out=out)
+    print 'vectorized put_data_in_grid of %s %s filters into a preallocated output: %.3g ms/frame' % (n_filters, filter_shape, 1000*(time.time()-start_time)/n_frames)
+
+
+def test_benchmark_put_data_in_grid():
+    benchmark_put_data_in_grid(n_filters=100, n_frames=2)
+
+
+if __name__ == '__main__':
+    test_record_buffer()
+    test_unlimited_record_buffer()
+    test_downsampling_record_buffer()
+    benchmark_record_buffer()
+    test_put_data_in_grid()
+    benchmark_put_data_in_grid()
+    test_data_to_image()
+    benchmark_data_to_image()
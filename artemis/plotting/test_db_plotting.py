@@ -1,9 +1,10 @@
 from functools import partial
+import time
 import numpy as np
 from artemis.plotting.demo_dbplot import demo_dbplot
 from artemis.plotting.db_plotting import dbplot, clear_dbplot, hold_dbplots, freeze_all_dbplots, reset_dbplot, \
-    dbplot_hang
-from artemis.plotting.plotting_backend import LinePlot, HistogramPlot, MovingPointPlot, _USE_SERVER
+    dbplot_hang, set_dbplot_max_fps, redraw_dbplot, get_dbplot_subplot
+from artemis.plotting.plotting_backend import LinePlot, HistogramPlot, MovingPointPlot, _USE_SERVER, set_async_plotting
 import pytest
 
 from matplotlib import gridspec
@@ -160,6 +161,119 @@ def test_custom_axes_placement(hang=False):
         dbplot_hang()
 
 
+@pytest.mark.skipif(_USE_SERVER, reason = "Rate limiting is only applied to local plots")
+def test_dbplot_max_fps():
+    reset_dbplot()
+    set_dbplot_max_fps(1, fig='rate-limited')
+    try:
+        plot_counts = {'n': 0}
+
+        class CountingPlot(MovingPointPlot):
+            def plot(self):
+                plot_counts['n'] += 1
+                MovingPointPlot.plot(self)
+
+        for i in xrange(20):
+            dbplot(i, 'counter', plot_type=CountingPlot, fig='rate-limited')
+        assert plot_counts['n'] < 5  # All but the first few calls (within the first second) are deferred
+        redraw_dbplot(fig='rate-limited')
+        line = get_dbplot_subplot('counter', fig_name='rate-limited').lines[0]
+        assert np.array_equal(line.get_ydata(), np.arange(20))  # But every sample was recorded
+    finally:
+        set_dbplot_max_fps(None, fig='rate-limited')
+
+
+def test_line_decimation():
+    reset_dbplot()
+    data = np.random.randn(1000000)
+    dbplot(data, 'huge-line', plot_type='line')
+    ax = get_dbplot_subplot('huge-line')
+    line = ax.lines[0]
+    pixel_width = ax.bbox.width
+    assert len(line.get_xdata()) <= 2*pixel_width+4
+    assert line.get_ydata().min() == data.min() and line.get_ydata().max() == data.max()
+    ax.set_xlim(1000, 1100)  # Zooming in shows every point
+    assert np.array_equal(line.get_xdata(), np.arange(999, 1102)) and np.array_equal(line.get_ydata(), data[999:1102])
+    ax.set_xlim(0, 1000000)
+    assert len(line.get_xdata()) <= 2*pixel_width+4
+    dbplot(data[:100], 'huge-line', plot_type='line')  # Small lines are not decimated
+    assert np.array_equal(line.get_ydata(), data[:100])
+
+
+def test_streaming_histogram():
+    rng = np.random.RandomState(1234)
+    chunks = [rng.randn(1000)*(i+1) + i for i in xrange(5)]
+    all_data = np.concatenate(chunks)
+
+    hist = HistogramPlot(edges=np.linspace(-3, 3, 13), mode='density')
+    for chunk in chunks:
+        hist.update(chunk)
+    expected, _ = np.histogram(all_data, np.linspace(-3, 3, 13), density=False)
+    assert np.allclose(hist.get_heights(), expected/float(expected.sum())/0.5)
+
+    hist = HistogramPlot(n_bins=15)  # Adaptive edges
+    for chunk in chunks:
+        hist.update(chunk)
+    edges = hist._edges
+    assert len(edges) == 16 and edges[0] <= all_data.min() and edges[-1] >= all_data.max()
+    expected, _ = np.histogram(all_data, edges)
+    assert np.array_equal(hist._counts, expected)  # The counts of merged bins are exact
+
+    hist = HistogramPlot(edges=[0, 1, 2], decay=0.5)
+    hist.update([0.5, 0.5, 1.5])
+    hist.update([1.5, 1.5, 5])
+    assert np.allclose(hist._counts, [1, 2.5])
+
+    reset_dbplot()
+    for i, chunk in enumerate(chunks):
+        dbplot(chunk, 'hist', plot_type='histogram')
+        if i == 0:
+            bars = list(get_dbplot_subplot('hist').patches)
+    ax = get_dbplot_subplot('hist')
+    assert ax.patches == bars  # The bars are updated, not recreated
+    assert np.isclose(bars[0].get_x(), edges[0]) and np.isclose(bars[-1].get_x()+bars[-1].get_width(), edges[-1])
+    assert ax.get_xbound() == (edges[0], edges[-1])
+
+
+def benchmark_streaming_histogram(n_points = 1000000, n_steps = 5):
+    """
+    Compare the time to add data to a HistogramPlot with the time to compute its histogram with np.histogram.
+    """
+    data = np.random.randn(n_steps, n_points)
+    start_time = time.time()
+    for d in data:
+        np.histogram(d, np.linspace(-5, 5, 20))
+    print 'np.histogram of %s points: %.3g ms/step' % (n_points, 1000*(time.time()-start_time)/n_steps)
+    hist = HistogramPlot()
+    start_time = time.time()
+    for d in data:
+        hist.update(d)
+    print 'Streaming histogram of %s points: %.3g ms/step' % (n_points, 1000*(time.time()-start_time)/n_steps)
+
+
+def test_benchmark_streaming_histogram():
+    benchmark_streaming_histogram(n_points=10000, n_steps=2)
+
+
+@pytest.mark.skipif(_USE_SERVER, reason = "Server mode takes precedence over async mode")
+def test_async_dbplot():
+    from artemis.remote.plotting import local_plotting
+    set_async_plotting(True)
+    try:
+        for i in xrange(5):
+            data = np.random.randn(20, 20)
+            dbplot(data, 'async-image')
+            data[:] = 0  # The data has already been snapshotted, so this does not affect the plot
+            dbplot(np.random.randn(), 'async-history', plot_type=partial(MovingPointPlot))
+        dbplot(np.random.randn(20, 20), 'async-image', wait_for_display_sec=-1)  # Blocks until it has been drawn
+        process = local_plotting._process
+        assert process.poll() is None
+        local_plotting.close_local_plotting_process(timeout=20)
+        assert process.returncode == 0
+    finally:
+        set_async_plotting(False)
+
+
 if __name__ == '__main__':
     test_trajectory_plot()
     test_demo_dbplot()
@@ -174,3 +288,8 @@ if __name__ == '__main__':
     test_particular_plot()
     test_dbplot()
     test_custom_axes_placement()
+    test_dbplot_max_fps()
+    test_async_dbplot()
+    test_line_decimation()
+    test_streaming_histogram()
+    benchmark_streaming_histogram()
@@ -0,0 +1,70 @@
+import time
+import numpy as np
+from matplotlib import pyplot as plt
+from artemis.plotting.drawing_plots import blit_redraw_figure
+
+__author__ = 'peter'
+
+
+def _get_pixels(fig):
+    return np.frombuffer(fig.canvas.buffer_rgba(), dtype=np.uint8).reshape(-1, 4).copy()
+
+
+def _nearly_same_image(pixels1, pixels2):
+    # Spines and ticks are part of the cached background, so with blitting they are drawn under the data, not over it.
+    return (pixels1 != pixels2).any(axis=1).mean() < 0.01
+
+
+def test_blit_redraw_figure():
+
+    fig = plt.figure()
+    ax1 = fig.add_subplot(2, 1, 1)
+    line, = ax1.plot(np.sin(np.linspace(0, 10, 100)))
+    ax1.set_ylim(-2, 2)
+    ax2 = fig.add_subplot(2, 1, 2)
+    im = ax2.imshow(np.random.rand(10, 10))
+    blit_redraw_figure(fig)
+
+    for i in range(3):
+        line.set_ydata(np.sin(np.linspace(0, 10, 100)+i))
+        im.set_array(np.random.rand(10, 10))
+        blit_redraw_figure(fig)
+        blitted = _get_pixels(fig)
+        fig.canvas.draw()
+        assert _nearly_same_image(blitted, _get_pixels(fig))
+
+    ax1.set_ylim(-3, 3)  # Changes the background, so we need a full redraw
+    line.set_ydata(np.cos(np.linspace(0, 10, 100)))
+    blit_redraw_figure(fig)
+    blitted = _get_pixels(fig)
+    fig.canvas.draw()
+    assert _nearly_same_image(blitted, _get_pixels(fig))
+    plt.close(fig)
+
+
+def benchmark_redraw(n_subplots=12, n_frames=20):
+    """
+    Compare the frame rate of a full redraw and a blitting redraw of a figure with many live line plots.
+    """
+    fig = plt.figure()
+    lines = [fig.add_subplot(3, (n_subplots+2)//3, i+1).plot(np.random.randn(100))[0] for i in range(n_subplots)]
+    for ax in fig.axes:
+        ax.set_ylim(-4, 4)
+    for name, redraw in [('full', lambda: fig.canvas.draw()), ('blit', lambda: blit_redraw_figure(fig))]:
+        redraw()
+        start_time = time.time()
+        for i in xrange(n_frames):
+            for line in lines:
+                line.set_ydata(np.random.randn(100))
+            redraw()
+        print '%s redraw of %s subplots: %.2f FPS' % (name, n_subplots, n_frames/(time.time()-start_time))
+    plt.close(fig)
+
+
+def test_benchmark_redraw():
+    benchmark_redraw(n_subplots=4, n_frames=2)
+
+
+if __name__ == '__main__':
+    test_blit_redraw_figure()
+    benchmark_redraw()
@@ -1,5 +1,6 @@
 from artemis.general.test_mode import set_test_mode
-from artemis.plotting.fast import find_interval_extremes, fastplot, fastloglog
+from artemis.plotting.fast import find_interval_extremes, fastplot, fastloglog, _find_interval_extremes_loop, decimate_line
+import time
 import matplotlib.pyplot as plt
 
 __author__ = 'peter'
@@ -26,7 +27,78 @@ def test_find_interval_extremes():
     assert np.std(arr[extreme_indices]) > 2* np.std(arr)  # Good enough test
 
 
+def _find_interval_extremes_reference(array, edges):
+    indices = np.empty(2*(len(edges)+1), dtype=int)
+    n_found = _find_interval_extremes_loop.py_func(array, edges, indices)
+    return indices[:n_found]
+
+
+def test_find_interval_extremes_matches_loop():
+    """ The vectorized version should give exactly the same indices as the loop (which replaces the old weave code). """
+    rng = np.random.RandomState(1234)
+    for n, n_edges in [(1000, 10), (1000, 999), (1000, 5000), (17, 3), (1, 1), (0, 3)]:
+        arr = rng.randn(n)
+        arr[rng.rand(n) < 0.05] = np.nan
+        arr[10:30] = np.nan  # A whole interval of NaNs
+        for edges in (np.sort(rng.rand(n_edges)*n), np.linspace(0, n, n_edges), np.logspace(0, np.log10(max(n, 2)), n_edges), np.arange(n_edges)):
+            assert np.array_equal(find_interval_extremes(arr, edges), _find_interval_extremes_reference(arr, edges))
+    arr = np.array([3., 1, 4, 1, 5, 9, 2, 6, 5, 3, 5])
+    assert np.array_equal(find_interval_extremes(arr, [2.5, 7.5]), [1, 2, 3, 5, 8, 9])  # The points after the last edge are included
+
+
+def test_decimate_line():
+
+    rng = np.random.RandomState(1234)
+    x = np.cumsum(rng.rand(100000))
+    y = rng.randn(100000)
+    left, right, resolution = x[1000]+.5, x[60000]+.5, 500
+    xd, yd = decimate_line(x, y, x_lims=(left, right), resolution=resolution)
+    assert len(xd) <= 2*resolution+4  # (2 per interval, plus the points just outside x_lims)
+    assert xd[0] == x[1000] and xd[-1] == x[60001]  # The line continues past the edges
+    bins = np.linspace(left, right, resolution+1)
+    for lower, upper in zip(bins[:-1], bins[1:]):  # Every pixel column shows the same range of values
+        in_bin = (x >= lower) & (x < upper)
+        in_decimated_bin = (xd >= lower) & (xd < upper)
+        assert y[in_bin].min() == yd[in_decimated_bin].min() and y[in_bin].max() == yd[in_decimated_bin].max()
+
+    xd, yd = decimate_line(x, y, x_lims=(x[10], x[20]), resolution=resolution)  # Zoomed in: every point is kept
+    assert np.array_equal(xd, x[9:22]) and np.array_equal(yd, y[9:22])
+
+    x_unsorted = rng.rand(100000)
+    xd, yd = decimate_line(x_unsorted, y, x_lims=(0, 1), resolution=resolution)  # Can't decimate
+    assert np.array_equal(xd, x_unsorted)
+
+
+def benchmark_find_interval_extremes(n = 1000000, n_edges = 2000):
+    """
+    Compare the vectorized find_interval_extremes with the pure-python version of the loop (and the compiled loop, if
+    numba is installed).
+    """
+    arr = np.random.randn(n)
+    edges = np.linspace(0, n, n_edges+2)[1:-1]
+    start_time = time.time()
+    find_interval_extremes(arr, edges)
+    print 'numpy find_interval_extremes of %s points: %.3g ms' % (n, 1000*(time.time()-start_time))
+    start_time = time.time()
+    _find_interval_extremes_reference(arr, edges)
+    print 'python-loop find_interval_extremes of %s points: %.3g ms' % (n, 1000*(time.time()-start_time))
+    try:
+        find_interval_extremes(arr, edges, implementation='numba')  # Compile
+    except ImportError:
+        return
+    start_time = time.time()
+    find_interval_extremes(arr, edges, implementation='numba')
+    print 'numba find_interval_extremes of %s points: %.3g ms' % (n, 1000*(time.time()-start_time))
+
+
+def test_benchmark_find_interval_extremes():
+    benchmark_find_interval_extremes(n=10000, n_edges=100)
+
+
 if __name__ == '__main__':
     set_test_mode(True)
     test_fastplot()
     test_find_interval_extremes()
+    test_find_interval_extremes_matches_loop()
+    test_decimate_line()
+    benchmark_find_interval_extremes()
@@ -0,0 +1,178 @@
+from __future__ import print_function
+import Queue
+import atexit
+import os
+import pickle
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from artemis.general.should_be_builtins import is_lambda
+from matplotlib import pyplot as plt
+
+"""
+Asynchronous dbplot: Instead of plotting on the calling thread, dbplot calls are pickled (which also takes a snapshot
+of the data, so you can safely modify it afterwards) and sent to a local plotting process, which owns the figures and
+draws whatever has arrived since its last redraw.  The messages are the same DBPlotMessage objects that are sent to a
+remote plotting server (see plotting_client.py), but they go through the pipes of the child process instead of a socket.
+
+Turn it on with set_async_plotting(True) (from artemis.plotting.plotting_backend), or by adding "async = True" to the
+[plotting] section of ~/.artemisrc.
+"""
+
+_process = None
+_to_process_queue = None
+_id_queue = None
+_process_lock = threading.Lock()
+
+_MAX_PLOT_BATCH_SIZE = 20000
+
+
+def dbplot_asynchronously(arg_locals):
+    """
+    This method should be called from dbplot immedeatly, in case we should plot asynchronously.
+    :param arg_locals: A dict of arguments with which dbplot was called.
+    """
+    assert not is_lambda(arg_locals['plot_type']), "dbplot in async mode does not accept lambda. Use partial instead"
+    assert not isinstance(arg_locals['fig'], plt.Figure), "dbplot in async mode does not accept a Figure.  Use a figure name instead"
+
+    with _process_lock:
+        if _process is None or _process.poll() is not None:
+            set_up_local_plotting_process()
+
+    from artemis.remote.plotting.plotting_server import DBPlotMessage
+    unique_plot_id = str(uuid.uuid4())
+    _to_process_queue.put(pickle.dumps(DBPlotMessage(plot_id=unique_plot_id, dbplot_args=arg_locals), protocol=2))
+
+    # Now we wait (or not) for the plot to be rendered.  (As with the plotting server, this is not reliable when
+    # several threads wait at the same time)
+    wait_for_display_sec = arg_locals["wait_for_display_sec"]
+    if wait_for_display_sec != 0:
+        if wait_for_display_sec < 0:
+            wait_for_display_sec = sys.maxint
+        end_time = time.time() + wait_for_display_sec
+        try:
+            while _id_queue.get(timeout=max(0, end_time-time.time())) != unique_plot_id:
+                pass
+        except Queue.Empty:
+            pass
+
+
+def set_up_local_plotting_process():
+    """
+    Start the local plotting process, and the threads that send it dbplot calls and collect the ids of the rendered plots.
+    """
+    global _process, _to_process_queue, _id_queue
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))  # So that the child can import whatever we can
+    _process = subprocess.Popen([sys.executable, '-u', '-m', 'artemis.remote.plotting.local_plotting'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+    _to_process_queue = Queue.Queue()
+    _id_queue = Queue.Queue()
+    t1 = threading.Thread(target=_push_to_process, args=(_to_process_queue, _process.stdin))
+    t1.setDaemon(True)
+    t1.start()
+    t2 = threading.Thread(target=_collect_from_process, args=(_id_queue, _process.stdout))
+    t2.setDaemon(True)
+    t2.start()
+
+
+def close_local_plotting_process(timeout=None):
+    """
+    Let the local plotting process draw all the plots that were sent to it, and then stop it.
+    :param timeout: Maximum time to wait for it to finish, after which it is killed.  None to wait forever.
+    """
+    global _process
+    with _process_lock:
+        if _process is None:
+            return
+        _to_process_queue.put(None)  # Tells the push thread to close the pipe, which tells the process to finish
+        end_time = None if timeout is None else time.time() + timeout
+        while _process.poll() is None:
+            if end_time is not None and time.time() > end_time:
+                _process.kill()
+                break
+            time.sleep(0.01)
+        _process.wait()
+        _process = None
+
+
+atexit.register(close_local_plotting_process, timeout=10)
+
+
+def _write_message(f, message):
+    f.write(struct.pack('!I', len(message)) + message)
+    f.flush()
+
+
+def _read_message(f):
+    """ :return: The message, or None if the pipe was closed. """
+    size_data = f.read(4)
+    if len(size_data) < 4:
+        return None
+    size = struct.unpack('!I', size_data)[0]
+    message = f.read(size)
+    return message if len(message) == size else None
+
+
+def _push_to_process(queue, pipe):
+    try:
+        while True:
+            message = queue.get()
+            if message is None:
+                break
+            _write_message(pipe, message)
+    except IOError:  # The process has died
+        pass
+    finally:
+        pipe.close()
+
+
+def _collect_from_process(queue, pipe):
+    while True:
+        message = _read_message(pipe)
+        if message is None:
+            break
+        queue.put(message)
+
+
+def _read_into_queue(pipe, queue):
+    while True:
+        message = _read_message(pipe)
+        queue.put(message)
+        if message is None:
+            break
+
+
+def run_local_plotting_process(input_pipe, output_pipe):
+    """
+    The main loop of the local plotting process: plot all dbplot calls that have arrived on input_pipe since the last
+    redraw, redraw, and send their plot_ids back through output_pipe.  Stops when input_pipe is closed.
+    """
+    from artemis.plotting.plotting_backend import set_server_plotting, set_async_plotting
+    from artemis.remote.plotting.plotting_server import plot_dbplot_messages, _queue_get_all_no_wait
+    set_server_plotting(False)
+    set_async_plotting(False)
+    input_queue = Queue.Queue()
+    t = threading.Thread(target=_read_into_queue, args=(input_pipe, input_queue))
+    t.setDaemon(True)
+    t.start()
+    finished = False
+    while not finished:
+        try:
+            messages = [input_queue.get(timeout=0.05)] + _queue_get_all_no_wait(input_queue, _MAX_PLOT_BATCH_SIZE)
+        except Queue.Empty:
+            for num in plt.get_fignums():  # Keep the windows responsive while we wait
+                plt.figure(num).canvas.flush_events()
+            continue
+        finished = None in messages
+        plot_ids = plot_dbplot_messages([m for m in messages if m is not None])
+        for plot_id in plot_ids:
+            _write_message(output_pipe, plot_id)
+
+
+if __name__ == '__main__':
+    # Replies go through the original stdout.  Anything printed while plotting goes to stderr.
+    output_pipe = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    run_local_plotting_process(input_pipe=sys.stdin, output_pipe=output_pipe)
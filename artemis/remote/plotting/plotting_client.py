@@ -6,18 +6,16 @@ import threading
 import time
 import uuid
 import pickle
-from collections import namedtuple
 from artemis.general.should_be_builtins import is_lambda
 from artemis.plotting.plotting_backend import get_plotting_server_address
 from artemis.remote.child_processes import check_ssh_connection, ChildProcess, ParamikoPrintThread
 from artemis.remote.file_system import check_config_file
+from artemis.remote.plotting.plotting_server import DBPlotMessage
 from artemis.remote.port_forwarding import forward_tunnel
 from artemis.remote.utils import get_local_ips, send_size, recv_size
 _to_subprocess_queue = None
 _id_queue = None
 
-DBPlotMessage = namedtuple('DBPlotMessage', ['plot_id', 'dbplot_args'])
-
 
 def dbplot_remotetly(arg_locals):
     """
@@ -118,20 +118,30 @@ def run_plotting_server(address, port):
         client_messages = _queue_get_all_no_wait(main_input_queue,max_plot_batch_size)
         # client_messages is a list of ClientMessage objects
         if len(client_messages) > 0:
-            return_values = []
-            with hold_dbplots():
-                for client_msg in client_messages:  # For each ClientMessage object
-                    # Take apart the received message, plot, and return the plot_id to the client who sent it
-                    plot_message = pickle.loads(client_msg.dbplot_message)  # A DBPlotMessage object (see plotting_client.py)
-                    plot_message.dbplot_args['draw_now'] = False
-                    dbplot(**plot_message.dbplot_args)
-                    return_values.append((client_msg.client_address, plot_message.plot_id))
-            for client, plot_id in return_values:
-                return_queue.put([client,plot_id])
+            # Plot, and return the plot_id to the client who sent it
+            plot_ids = plot_dbplot_messages([client_msg.dbplot_message for client_msg in client_messages])
+            for client_msg, plot_id in zip(client_messages, plot_ids):
+                return_queue.put([client_msg.client_address, plot_id])
         else:
             time.sleep(0.1)
 
 
+def plot_dbplot_messages(dbplot_messages):
+    """
+    Plot a batch of dbplot calls, and then draw them all at once.
+    :param dbplot_messages: A list of pickled DBPlotMessage objects
+    :return: A list of the plot_ids of the messages
+    """
+    plot_ids = []
+    with hold_dbplots():
+        for message in dbplot_messages:
+            plot_message = pickle.loads(message)
+            plot_message.dbplot_args['draw_now'] = False
+            dbplot(**plot_message.dbplot_args)
+            plot_ids.append(plot_message.plot_id)
+    return plot_ids
+
+
 def _queue_get_all_no_wait(q, max_items_to_retreive):
     """
     Empties the queue, but takes maximally maxItemsToRetreive from the queue
@@ -206,6 +216,10 @@ ClientMessage = namedtuple('ClientMessage', ['dbplot_message', 'client_address']
 # dbplot_args is a DBPlotMessage object
 # client_address: A string IP address
 
+DBPlotMessage = namedtuple('DBPlotMessage', ['plot_id', 'dbplot_args'])
+# plot_id: A unique string identifying this call
+# dbplot_args: A dict of arguments with which dbplot was called
+
 
 def handle_input_connection(connection, client_address, input_queue):
     """